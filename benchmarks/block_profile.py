@@ -0,0 +1,64 @@
+"""
+Runs a testcase in the LC-3 simulator and counts how many times each of its basic blocks runs, for
+main.py --block-profile to lay the blocks out by. The counts are only good for the optimization
+level they were taken at, since other levels have other blocks.
+
+Usage: python -m benchmarks.block_profile [-O level] testcase.c [profile.json]
+"""
+
+import argparse
+import json
+import os
+import sys
+
+from pycparser import c_parser, preprocess_file
+
+import gwcc
+from gwcc import cfg
+from gwcc import il
+from benchmarks import lc3sim
+from benchmarks.dynamic_count import MEMORY
+
+
+def profile(source_file, opt_level=0):
+    """
+    :return: map from function name to a map from block name to the number of times the block ran
+    """
+    ast = c_parser.CParser().parse(preprocess_file(source_file, 'cpp', ''), source_file)
+    frontend = gwcc.Frontend(gwcc.abi.LC3, opt_level=opt_level)
+    frontend.compile(ast)
+    globs = frontend.get_globals()
+    backend = gwcc.backend.LC3(globs)
+    backend.compile()
+
+    counts = {}
+    lc3sim.run('\n'.join(backend.get_output()), MEMORY.get(os.path.basename(source_file)), counts=counts)
+
+    # without a layout every block ends in a jump, so its first word runs as often as the block
+    result = {}
+    for glob in globs:
+        if type(glob.value) == il.Function:
+            func = glob.value
+            result[func.name] = {bb.name: counts.get(backend.get_binary_location(backend.name_basic_block(func, bb)), 0)
+                                 for bb in cfg.topoorder(func.cfg)}
+    return result
+
+
+def main():
+    args_parser = argparse.ArgumentParser()
+    args_parser.add_argument('-O', dest='opt_level', type=int, default=0)
+    args_parser.add_argument('source_file')
+    args_parser.add_argument('output', nargs='?')
+    args = args_parser.parse_args()
+
+    result = profile(args.source_file, args.opt_level)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2, sort_keys=True)
+    else:
+        json.dump(result, sys.stdout, indent=2, sort_keys=True)
+        print
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Counts the IL statements and LC-3 instructions that copy propagation and dead code elimination
+remove from each testcase, by compiling it with and without them.
+
+Usage: python -m benchmarks.dead_code [testcase.c ...]
+"""
+
+import glob
+import os
+import sys
+
+from pycparser import c_parser, preprocess_file
+
+import gwcc
+from gwcc import il
+from gwcc.optimization.copy_propagation import CopyPropagationPass
+from gwcc.optimization.dce import DeadCodeEliminationPass
+from gwcc.optimization.naturalization_pass import NaturalizationPass
+from benchmarks.dynamic_count import static_size
+
+
+def count_stmts(globs):
+    return sum(len([stmt for stmt in bb.stmts if type(stmt) != il.CommentStmt])
+               for glob in globs if type(glob.value) == il.Function
+               for bb in glob.value.cfg.basic_blocks)
+
+
+def compile_file(ast, eliminate):
+    frontend = gwcc.Frontend(gwcc.abi.LC3)
+    frontend.compile(ast)
+    globs = frontend.get_globals()
+    if eliminate:
+        for glob in globs:
+            if type(glob.value) == il.Function:
+                CopyPropagationPass(glob.value).process()
+                DeadCodeEliminationPass(glob.value).process()
+                NaturalizationPass(glob.value).process()
+                glob.value.verify()
+    backend = gwcc.backend.LC3(globs)
+    backend.compile()
+    return count_stmts(globs), static_size(backend.get_output())
+
+
+def main():
+    files = sys.argv[1:] or sorted(glob.glob('testcases/*.c'))
+    print '%-22s %18s %18s' % ('', 'IL statements', 'LC-3 instructions')
+    totals = [0, 0, 0, 0]
+    for source_file in files:
+        ast = c_parser.CParser().parse(preprocess_file(source_file, 'cpp', ''), source_file)
+        try:
+            before = compile_file(ast, False)
+        except Exception as e:
+            print '%-22s %s' % (os.path.basename(source_file), e)
+            continue
+        after = compile_file(ast, True)
+        row = [before[0], before[0] - after[0], before[1], before[1] - after[1]]
+        totals = [total + n for total, n in zip(totals, row)]
+        print '%-22s %8d %-9s %8d %-9s' % (os.path.basename(source_file), row[0], '(-%d)' % (row[1],),
+                                           row[2], '(-%d)' % (row[3],))
+    print '%-22s %8d %-9s %8d %-9s' % ('total', totals[0], '(-%d)' % (totals[1],), totals[2], '(-%d)' % (totals[3],))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Compiles the runnable programs in testcases/ with each backend configuration, runs them in the
+LC-3 simulator, and compares how many instructions they execute.
+
+Usage: python -m benchmarks.dynamic_count [testcase.c ...]
+"""
+
+import glob
+import os
+import sys
+
+from pycparser import c_parser, preprocess_file
+
+import gwcc
+from gwcc import il
+from benchmarks import lc3sim
+
+# compiler options to compare, the first one is the reference. opt_level and abi go to the frontend,
+# the rest to the backend.
+CONFIGS = [
+    ('local', dict(regalloc='local')),
+    ('linear-scan', dict(regalloc='linear-scan')),
+    ('coloring', dict(regalloc='coloring')),
+    ('coloring+peephole', dict(regalloc='coloring', peephole=True)),
+    ('-O2', dict(opt_level=2, regalloc='coloring', peephole=True, layout=True, literal_pools=True, minimal_frames=True,
+                 tail_calls=True)),
+    ('-O2 register ABI', dict(opt_level=2, abi=gwcc.abi.LC3Registers, regalloc='coloring', peephole=True, layout=True,
+                              literal_pools=True, minimal_frames=True, tail_calls=True)),
+]
+
+# inputs some testcases expect to find in memory
+MEMORY = {
+    'tl3.c': dict((0x5000 + i, value) for i, value in enumerate([3, -4, 7, -2, 9, -5])),
+    'linkedlist.c': {0x6000: 0x6010, 0x6001: 3, 0x6010: 0x6020, 0x6011: 10,
+                     0x6020: 0x6030, 0x6021: 4, 0x6030: 0, 0x6031: 10},
+    'keyboard.c': {0xFE00: -32768},
+}
+
+
+def compile_file(source_file, opt_level=0, abi=gwcc.abi.LC3, **backend_options):
+    ast = c_parser.CParser().parse(preprocess_file(source_file, 'cpp', ''), source_file)
+    frontend = gwcc.Frontend(abi, opt_level=opt_level)
+    frontend.compile(ast)
+    globs = frontend.get_globals()
+    if not any(glob.name == 'main' and type(glob.value) == il.Function for glob in globs):
+        return None, None  # a library, nothing to run
+    backend = gwcc.backend.LC3(globs, **backend_options)
+    backend.compile()
+    return backend.get_output(), [glob.name for glob in globs if type(glob.value) == il.Variable]
+
+
+def run(asm, global_names, memory):
+    steps, program, regs = lc3sim.run('\n'.join(asm), memory)
+    mem = program.memory
+    observed = [lc3sim.to_signed(mem[regs[6]])]  # main's return value
+    observed += [lc3sim.to_signed(mem[program.symbols[name]]) for name in global_names if name in program.symbols]
+    observed += [lc3sim.to_signed(mem[address]) for address in sorted(memory or {})]
+    return steps, observed
+
+
+def static_size(asm):
+    return sum(1 for line in asm if line.split(';')[0].strip())
+
+
+def main():
+    files = sys.argv[1:] or sorted(glob.glob('testcases/*.c'))
+    print '%-22s' % ('executed (static)',) + ''.join('%20s' % (name,) for name, _ in CONFIGS)
+    totals = [0] * len(CONFIGS)
+    for source_file in files:
+        memory = MEMORY.get(os.path.basename(source_file))
+        row = []
+        reference = None
+        for k, (name, options) in enumerate(CONFIGS):
+            asm, global_names = compile_file(source_file, **options)
+            if asm is None:
+                break
+            steps, observed = run(asm, global_names, memory)
+            if reference is None:
+                reference = observed
+            elif observed != reference:
+                raise AssertionError('%s behaves differently with %s: %s, expected %s'
+                                     % (source_file, name, observed, reference))
+            totals[k] += steps
+            row.append('%12d (%5d)' % (steps, static_size(asm)))
+        if row:
+            print '%-22s' % (os.path.basename(source_file),) + ''.join('%20s' % (cell,) for cell in row)
+    print '%-22s' % ('total',) + ''.join('%20d' % (total,) for total in totals)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Micro-benchmark of enum comparisons on the hot paths: Variable.__eq__ and the backend's
+`if stmt.op == ...` chains. "legacy" members reproduce the old value-comparing EnumValue.__eq__.
+
+Usage: python -m benchmarks.enum_compare
+"""
+
+import timeit
+
+from gwcc import il
+from gwcc.util.enum import EnumValue
+
+
+class LegacyEnumValue(EnumValue):
+    def __eq__(self, other):
+        if other == None:
+            return False
+        if isinstance(other, EnumValue):
+            return self is other or self.value == other.value
+        else:
+            return self.value == other
+
+
+def legacy_members(enum_cls):
+    members = {}
+    for name in dir(enum_cls):
+        member = getattr(enum_cls, name)
+        if isinstance(member, EnumValue):
+            members[name] = LegacyEnumValue(enum_cls, member.name, member.value)
+    return members
+
+
+def current_members(enum_cls):
+    return dict((name, getattr(enum_cls, name)) for name in dir(enum_cls)
+                if isinstance(getattr(enum_cls, name), EnumValue))
+
+
+# the order LC3.emit_basic_block tests binary ops in
+OP_NAMES = ['Add', 'Sub', 'And', 'Or', 'Xor', 'Lt', 'Gt', 'LogicalAnd', 'LogicalOr', 'Equ', 'Neq', 'Mul']
+
+
+def make_pointer_variables(types):
+    a = il.Variable('t0', il.Types.ptr, 1, il.Types.int)
+    b = il.Variable('t0', il.Types.ptr, 1, il.Types.int)
+    a.type, a.ref_type = types['ptr'], types['int']
+    b.type, b.ref_type = types['ptr'], types['int']
+    return a, b
+
+
+def chain_dispatch(op, ops):
+    for name in OP_NAMES:
+        if op == ops[name]:
+            return name
+
+
+def best_of(fn, number=100000, repeat=3):
+    return min(timeit.Timer(fn).repeat(repeat=repeat, number=number)) / number * 1e9
+
+
+def main():
+    print '%-34s %12s %12s' % ('ns per operation', 'legacy', 'interned')
+    old_a, old_b = make_pointer_variables(legacy_members(il.Types))
+    new_a, new_b = make_pointer_variables(current_members(il.Types))
+    print '%-34s %12.1f %12.1f' % ('Variable.__eq__ (pointers)',
+                                   best_of(lambda: old_a == old_b), best_of(lambda: new_a == new_b))
+
+    old_ops, new_ops = legacy_members(il.BinaryOp), current_members(il.BinaryOp)
+    for name in ['Add', 'Mul']:
+        old_op, new_op = old_ops[name], new_ops[name]
+        print '%-34s %12.1f %12.1f' % ('if-chain dispatch (%s)' % name,
+                                       best_of(lambda: chain_dispatch(old_op, old_ops)),
+                                       best_of(lambda: chain_dispatch(new_op, new_ops)))
+
+    table = dict((new_ops[name], name) for name in OP_NAMES)
+    mul = new_ops['Mul']
+    print '%-34s %12s %12.1f' % ('dict dispatch (Mul)', 'unhashable', best_of(lambda: table[mul]))
+
+
+if __name__ == '__main__':
+    main()
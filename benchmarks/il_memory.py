@@ -0,0 +1,49 @@
+"""
+Measures the peak memory of keeping the IL of many compiled copies of a testcase alive.
+
+Usage: python -m benchmarks.il_memory [source_file] [copies]
+"""
+
+import resource
+import sys
+
+from pycparser import c_parser, preprocess_file
+
+import gwcc
+from gwcc import il
+
+
+def max_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def count_stmts(globs):
+    total = 0
+    for glob in globs:
+        if type(glob.value) == il.Function:
+            for bb in glob.value.cfg.basic_blocks:
+                total += len(bb.stmts)
+    return total
+
+
+def main():
+    source_file = sys.argv[1] if len(sys.argv) > 1 else 'testcases/1.c'
+    copies = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+
+    ast = c_parser.CParser().parse(preprocess_file(source_file, 'cpp', ''), source_file)
+    before = max_rss_kb()
+
+    programs = []
+    for _ in range(copies):
+        frontend = gwcc.Frontend(gwcc.abi.LC3)
+        frontend.compile(ast)
+        programs.append(frontend.get_globals())
+
+    after = max_rss_kb()
+    print '%s x %d: %d statements' % (source_file, copies, sum(map(count_stmts, programs)))
+    print 'peak rss before: %8d KiB' % (before,)
+    print 'peak rss after:  %8d KiB (+%d KiB)' % (after, after - before)
+
+
+if __name__ == '__main__':
+    main()
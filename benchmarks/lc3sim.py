@@ -0,0 +1,161 @@
+"""
+A small LC-3 assembler and simulator, just enough to run the backend's output and count the
+instructions it executes.
+"""
+
+import re
+
+OPCODES = frozenset(['ADD', 'AND', 'NOT', 'LD', 'LDI', 'LDR', 'LEA', 'ST', 'STI', 'STR',
+                     'JMP', 'JSR', 'JSRR', 'RET', 'HALT'])
+BRANCH = re.compile(r'^BR[NZP]*$')
+
+
+class SimulationError(RuntimeError):
+    pass
+
+
+def parse_number(token):
+    if token.startswith('#'):
+        return int(token[1:])
+    if re.match(r'^[xX]-?[0-9a-fA-F]+$', token):
+        return int(token[1:], 16)
+    if re.match(r'^-?\d+$', token):
+        return int(token)
+    return None
+
+
+def is_opcode(token):
+    token = token.upper()
+    return token in OPCODES or BRANCH.match(token) is not None or token.startswith('.')
+
+
+def to_signed(value):
+    value &= 0xffff
+    return value - 0x10000 if value & 0x8000 else value
+
+
+class Program(object):
+    def __init__(self, asm):
+        self.memory = [0] * 0x10000
+        self.code = {}  # address -> tokens of the instruction there
+        self.symbols = {}
+        self._assemble(asm)
+
+    def _assemble(self, asm):
+        items = []
+        pc = None
+        for line in asm.split('\n'):
+            tokens = line.split(';')[0].replace(',', ' ').split()
+            if not tokens:
+                continue
+            if not is_opcode(tokens[0]):
+                self.symbols[tokens[0]] = pc
+                tokens = tokens[1:]
+                if not tokens:
+                    continue
+            op = tokens[0].upper()
+            if op == '.ORIG':
+                pc = parse_number(tokens[1])
+            elif op == '.FILL':
+                items.append((pc, tokens[1]))
+                pc += 1
+            elif op == '.BLKW':
+                pc += parse_number(tokens[1])
+            elif op == '.END':
+                pass
+            else:
+                self.code[pc] = [op] + tokens[1:]
+                pc += 1
+
+        for address, token in items:
+            value = parse_number(token)
+            if value is None:
+                value = self.symbols[token]
+            self.memory[address] = value & 0xffff
+
+
+def run(asm, memory=None, max_steps=10000000, counts=None):
+    """
+    Runs a program from x3000 until HALT.
+    :param memory: optional map from address to initial value
+    :param counts: optional map that gets the number of times each address was executed added to it
+    :return: (number of instructions executed, final Program state, registers)
+    """
+    program = Program(asm)
+    mem = program.memory
+    for address, value in (memory or {}).items():
+        mem[address] = value & 0xffff
+    regs = [0] * 8
+    cc = 'z'
+    pc = 0x3000
+
+    def reg(token):
+        return int(token[1:])
+
+    def offset(token, pc):
+        value = parse_number(token)
+        return program.symbols[token] - (pc + 1) if value is None else value
+
+    def set_cc(value):
+        value = to_signed(value)
+        return 'n' if value < 0 else 'z' if value == 0 else 'p'
+
+    steps = 0
+    while steps < max_steps:
+        if pc not in program.code:
+            raise SimulationError('executing data at x%04x' % (pc,))
+        tokens = program.code[pc]
+        op = tokens[0]
+        steps += 1
+        if counts is not None:
+            counts[pc] = counts.get(pc, 0) + 1
+        next_pc = pc + 1
+
+        if op == 'ADD' or op == 'AND':
+            operand = tokens[3]
+            b = regs[reg(operand)] if operand[0] in 'rR' else parse_number(operand)
+            value = regs[reg(tokens[2])] + b if op == 'ADD' else regs[reg(tokens[2])] & b
+            regs[reg(tokens[1])] = value & 0xffff
+            cc = set_cc(value)
+        elif op == 'NOT':
+            regs[reg(tokens[1])] = ~regs[reg(tokens[2])] & 0xffff
+            cc = set_cc(regs[reg(tokens[1])])
+        elif op == 'LD':
+            regs[reg(tokens[1])] = mem[(next_pc + offset(tokens[2], pc)) & 0xffff]
+            cc = set_cc(regs[reg(tokens[1])])
+        elif op == 'LDI':
+            regs[reg(tokens[1])] = mem[mem[(next_pc + offset(tokens[2], pc)) & 0xffff]]
+            cc = set_cc(regs[reg(tokens[1])])
+        elif op == 'LDR':
+            regs[reg(tokens[1])] = mem[(regs[reg(tokens[2])] + parse_number(tokens[3])) & 0xffff]
+            cc = set_cc(regs[reg(tokens[1])])
+        elif op == 'LEA':
+            regs[reg(tokens[1])] = (next_pc + offset(tokens[2], pc)) & 0xffff
+        elif op == 'ST':
+            mem[(next_pc + offset(tokens[2], pc)) & 0xffff] = regs[reg(tokens[1])]
+        elif op == 'STI':
+            mem[mem[(next_pc + offset(tokens[2], pc)) & 0xffff]] = regs[reg(tokens[1])]
+        elif op == 'STR':
+            address = (regs[reg(tokens[2])] + parse_number(tokens[3])) & 0xffff
+            if address in program.code:
+                raise SimulationError('store into code at x%04x (pc=x%04x)' % (address, pc))
+            mem[address] = regs[reg(tokens[1])]
+        elif BRANCH.match(op):
+            if cc in (op[2:].lower() or 'nzp'):
+                next_pc = pc + 1 + offset(tokens[1], pc)
+        elif op == 'JMP':
+            next_pc = regs[reg(tokens[1])]
+        elif op == 'RET':
+            next_pc = regs[7]
+        elif op == 'JSRR':
+            next_pc = regs[reg(tokens[1])]
+            regs[7] = pc + 1
+        elif op == 'JSR':
+            regs[7] = pc + 1
+            next_pc = pc + 1 + offset(tokens[1], pc)
+        elif op == 'HALT':
+            return steps, program, regs
+        else:
+            raise SimulationError('unsupported instruction ' + ' '.join(tokens))
+        pc = next_pc & 0xffff
+    raise SimulationError('no HALT after %d instructions' % (max_steps,))
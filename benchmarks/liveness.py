@@ -0,0 +1,30 @@
+"""
+Compares the set-based LivenessAnalysis against BitVectorLiveness on synthetic functions.
+
+Usage: python -m benchmarks.liveness
+"""
+
+from gwcc.optimization.dataflow import LivenessAnalysis, BitVectorLiveness
+from benchmarks.synthetic import make_function, timeit
+
+
+def check_agreement(func):
+    old = LivenessAnalysis(func)
+    new = BitVectorLiveness(func)
+    for bb in func.cfg.basic_blocks:
+        assert set(old.live_in(bb)) == set(new.live_in(bb)), 'live-in mismatch in ' + str(bb)
+        assert set(old.live_out(bb)) == set(new.live_out(bb)), 'live-out mismatch in ' + str(bb)
+
+
+def main():
+    print '%8s %12s %12s %8s' % ('blocks', 'sets (s)', 'bitsets (s)', 'speedup')
+    for num_blocks in [100, 400, 1600, 6400]:
+        func = make_function(num_blocks)
+        check_agreement(func)
+        old_time = timeit(lambda: LivenessAnalysis(func))
+        new_time = timeit(lambda: BitVectorLiveness(func))
+        print '%8d %12.4f %12.4f %7.1fx' % (num_blocks, old_time, new_time, old_time / new_time)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+Times statement dispatch (il.used_vars / il.defed_var) and LC-3 lowering of a single large
+synthetic function.
+
+Usage: python -m benchmarks.lowering
+"""
+
+from gwcc import il
+from gwcc.backend.lc3 import LC3
+from benchmarks.synthetic import make_function, timeit
+
+NUM_STMTS = 50000
+STMTS_PER_BLOCK = 8
+
+
+def all_stmts(func):
+    for bb in func.cfg.basic_blocks:
+        for stmt in bb.stmts:
+            yield stmt
+
+
+def walk_vars(stmts):
+    for stmt in stmts:
+        il.used_vars(stmt)
+        il.defed_var(stmt)
+
+
+def lower(func):
+    backend = LC3([il.GlobalName('main', func)], with_symbols=False)
+    backend.compile()
+    return backend.get_output()
+
+
+def main():
+    # each block also ends in a goto or a conditional jump
+    func = make_function(NUM_STMTS // (STMTS_PER_BLOCK + 1), stmts_per_block=STMTS_PER_BLOCK)
+    stmts = list(all_stmts(func))
+    print '%d statements in %d blocks' % (len(stmts), len(func.cfg.basic_blocks))
+    print 'used_vars/defed_var: %.4fs' % timeit(lambda: walk_vars(stmts))
+    print 'lowering:            %.4fs (%d lines of asm)' % (timeit(lambda: lower(func), repeat=1), len(lower(func)))
+
+
+if __name__ == '__main__':
+    main()
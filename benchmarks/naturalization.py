@@ -0,0 +1,27 @@
+"""
+Runs NaturalizationPass over synthetic frontend-shaped functions of increasing size.
+Time per block should stay flat if the pass is linear.
+
+Usage: python -m benchmarks.naturalization
+"""
+
+import time
+
+from gwcc.optimization.naturalization_pass import NaturalizationPass
+from benchmarks.synthetic import make_unnaturalized_function
+
+
+def main():
+    print '%8s %10s %14s %8s   %s' % ('blocks', 'time (s)', 'us per block', 'left', 'stats')
+    for num_blocks in [1000, 2000, 4000, 8000, 16000]:
+        func = make_unnaturalized_function(num_blocks)
+        start = time.time()
+        stats = NaturalizationPass(func).process()
+        elapsed = time.time() - start
+        func.verify()
+        print '%8d %10.4f %14.2f %8d   %s' % (num_blocks, elapsed, elapsed / num_blocks * 1e6,
+                                            func.cfg.num_blocks, dict(stats))
+
+
+if __name__ == '__main__':
+    main()
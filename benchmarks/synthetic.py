@@ -0,0 +1,109 @@
+"""
+Generators for large synthetic IL functions, used by the benchmarks.
+"""
+
+import random
+import time
+
+from gwcc import il
+
+
+def int_constant(value):
+    return il.Constant(il.CompiledValue(value, il.CompiledValueType.Integer), il.Types.int)
+
+
+def make_function(num_blocks, num_locals=32, stmts_per_block=8, loop_every=4, seed=0):
+    """
+    Builds a function made of a long chain of blocks with frequent backwards branches, so that
+    dataflow problems need several iterations to converge.
+    """
+    rnd = random.Random(seed)
+    func = il.Function('synthetic_%d' % num_blocks, [], il.Variable('_retval', il.Types.int))
+    local_vars = [func.variables.intern('_v%d' % i, il.Types.int) for i in range(num_locals)]
+    func.locals.extend(local_vars)
+    blocks = [func.cfg.new_block() for _ in range(num_blocks)]
+    zero = int_constant(0)
+
+    for i, bb in enumerate(blocks):
+        for _ in range(stmts_per_block):
+            dst, src_a, src_b = rnd.choice(local_vars), rnd.choice(local_vars), rnd.choice(local_vars)
+            bb.add_stmt(il.BinaryStmt(dst, il.BinaryOp.Add, src_a, src_b))
+
+        if i == num_blocks - 1:
+            bb.add_stmt(il.UnaryStmt(func.retval, il.UnaryOp.Identity, local_vars[0]))
+            bb.add_stmt(il.ReturnStmt())
+        elif i % loop_every == loop_every - 1:
+            back = blocks[rnd.randint(max(0, i - 2 * loop_every), i)]
+            bb.add_stmt(il.CondJumpStmt(back, blocks[i + 1], rnd.choice(local_vars), il.ComparisonOp.Neq, zero))
+            func.cfg.connect(bb, back)
+            func.cfg.connect(bb, blocks[i + 1])
+        else:
+            bb.add_stmt(il.GotoStmt(blocks[i + 1]))
+            func.cfg.connect(bb, blocks[i + 1])
+    return func
+
+
+def timeit(fn, repeat=3):
+    """
+    Returns the best wall-clock time of running fn() repeat times.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        fn()
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def make_unnaturalized_function(num_blocks, seed=0):
+    """
+    Builds a function shaped like raw frontend output: runs of blocks that just fall into the
+    next one through a goto, blocks that are a single goto, conditionals whose branches are the
+    same block, and empty unreachable blocks left over after returns.
+    """
+    rnd = random.Random(seed)
+    func = il.Function('unnaturalized_%d' % num_blocks, [], il.Variable('_retval', il.Types.int))
+    local_vars = [func.variables.intern('_v%d' % i, il.Types.int) for i in range(8)]
+    func.locals.extend(local_vars)
+    blocks = [func.cfg.new_block() for _ in range(num_blocks)]
+    zero = int_constant(0)
+
+    def goto(bb, dst):
+        bb.add_stmt(il.GotoStmt(dst))
+        func.cfg.connect(bb, dst)
+
+    i = 0
+    while i < num_blocks - 1:
+        bb = blocks[i]
+        kind = rnd.randint(0, 4)
+        if kind == 0:
+            # lone goto, gets inlined
+            goto(bb, blocks[i + 1])
+        elif kind == 1:
+            # conditional with identical branches
+            bb.add_stmt(il.UnaryStmt(local_vars[0], il.UnaryOp.Identity, rnd.choice(local_vars)))
+            bb.add_stmt(il.CondJumpStmt(blocks[i + 1], blocks[i + 1], local_vars[0], il.ComparisonOp.Neq, zero))
+            func.cfg.connect(bb, blocks[i + 1])
+        elif kind == 2 and i + 2 < num_blocks:
+            # a return followed by the empty block the frontend opens after it
+            bb.add_stmt(il.UnaryStmt(local_vars[1], il.UnaryOp.Identity, rnd.choice(local_vars)))
+            goto(bb, blocks[i + 2])
+            i += 1
+        elif kind == 3 and i + 2 < num_blocks:
+            # branch around a block that only jumps onwards, so it has to be inlined
+            bb.add_stmt(il.CondJumpStmt(blocks[i + 1], blocks[i + 2], rnd.choice(local_vars), il.ComparisonOp.Neq, zero))
+            func.cfg.connect(bb, blocks[i + 1])
+            func.cfg.connect(bb, blocks[i + 2])
+            goto(blocks[i + 1], blocks[i + 2])
+            i += 1
+        else:
+            bb.add_stmt(il.BinaryStmt(local_vars[2], il.BinaryOp.Add, rnd.choice(local_vars), rnd.choice(local_vars)))
+            goto(bb, blocks[i + 1])
+        i += 1
+
+    last = blocks[-1]
+    last.add_stmt(il.UnaryStmt(func.retval, il.UnaryOp.Identity, local_vars[0]))
+    last.add_stmt(il.ReturnStmt())
+    return func
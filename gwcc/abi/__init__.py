@@ -1 +1 @@
-from lc3 import LC3
+from lc3 import LC3, LC3Registers
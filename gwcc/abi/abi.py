@@ -13,6 +13,8 @@ class ABI(object):
     LONG_SIZE = 0
     PTR_SIZE = 0
 
+    CALLING_CONVENTION = il.CallingConvention.Stack
+
     @classmethod
     def bitsize(cls, il_type):
         if il_type == il.Types.char or il_type == il.Types.uchar:
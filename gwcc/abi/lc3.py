@@ -1,4 +1,5 @@
 from abi import ABI
+from .. import il
 
 """
 Stores ABI information for the LC-3.
@@ -15,3 +16,10 @@ class LC3(ABI):
     INT_SIZE = 1
     LONG_SIZE = 2
     PTR_SIZE = 1
+
+"""
+The LC-3 with the register calling convention: the first three arguments go in r0, r1 and r2 and the
+value comes back in r0. See gwcc.backend.lc3.LC3 for the details.
+"""
+class LC3Registers(LC3):
+    CALLING_CONVENTION = il.CallingConvention.Register
@@ -0,0 +1,114 @@
+"""
+Block placement: picks the order a function's blocks are laid out in, so that a block is followed by
+the successor it most likely goes to and the jump there can be left out.
+"""
+
+from .. import cfg
+from .. import il
+from ..optimization.loops import LoopNesting
+
+# how many times a loop is assumed to run each time it is entered
+LOOP_WEIGHT = 10
+
+
+class BlockLayout(object):
+    """
+    Chains blocks along their heaviest edges, after Pettis and Hansen: going from the heaviest edge
+    down, an edge joins the chain that ends in its source to the one that starts with its target.
+    A block weighs its execution count if there is a profile, and LOOP_WEIGHT to the power of its
+    loop nesting depth otherwise. Its weight is split among its successors in proportion to theirs.
+
+    Chains are then placed starting with the entry's, each time taking the one the blocks already
+    placed jump into the most. A loop with its test on top comes out rotated: the body first, then
+    the test, which branches back to the body and falls through to the exit. The epilogue comes
+    right after the last block, so the chain ending in the heaviest return is kept for last.
+
+    Only blocks reachable from the entry are laid out.
+    """
+    def __init__(self, func, frequencies=None):
+        """
+        :param frequencies: optional map from block name to the number of times the block ran
+        """
+        self.func = func
+        self.cfg = func.cfg
+        self.blocks = cfg.topoorder(self.cfg)
+        self._index = {bb: i for i, bb in enumerate(self.blocks)}
+
+        self.loops = LoopNesting(func)
+        if frequencies is not None:
+            self._weight = {bb: float(frequencies.get(bb.name, 0)) for bb in self.blocks}
+        else:
+            self._weight = {bb: float(LOOP_WEIGHT ** self.loops.depth(bb)) for bb in self.blocks}
+
+    def successors(self, bb):
+        return [succ for succ in self.cfg.successors(bb) if succ in self._index]
+
+    def edges(self):
+        """
+        :return: (weight, source, target) for every edge between laid out blocks
+        """
+        edges = []
+        for bb in self.blocks:
+            succs = self.successors(bb)
+            total = sum(self._weight[succ] for succ in succs)
+            for succ in succs:
+                weight = self._weight[bb] * self._weight[succ] / total if total else 0.0
+                edges.append((weight, bb, succ))
+        return edges
+
+    def chains(self, edges):
+        chain_of = {bb: [bb] for bb in self.blocks}
+        entry = self.blocks[0] if self.blocks else None
+
+        # a back edge goes before an edge as heavy into the loop, so that the loop gets rotated
+        def key(edge):
+            weight, src, dst = edge
+            return -weight, not self.loops.dominates(dst, src), self._index[src], self._index[dst]
+
+        for weight, src, dst in sorted(edges, key=key):
+            head, tail = chain_of[dst], chain_of[src]
+            if head is tail or tail[-1] is not src or head[0] is not dst or dst is entry:
+                continue
+            tail.extend(head)
+            for bb in head:
+                chain_of[bb] = tail
+        chains = []
+        for bb in self.blocks:
+            if chain_of[bb][0] is bb:
+                chains.append(chain_of[bb])
+        return chains
+
+    def order(self):
+        """
+        :return: the blocks in the order they should be laid out, the entry first
+        """
+        edges = self.edges()
+        chains = self.chains(edges)
+        if not chains:
+            return []
+        chain_index = {}
+        for i, chain in enumerate(chains):
+            for bb in chain:
+                chain_index[bb] = i
+
+        # the chain that returns the most goes last, to run into the epilogue
+        returns = [i for i, chain in enumerate(chains)
+                   if i > 0 and chain[-1].stmts and type(chain[-1].stmts[-1]) == il.ReturnStmt]
+        last = max(returns, key=lambda i: (self._weight[chains[i][-1]], i)) if returns else None
+
+        layout = []
+        placed = set([last])
+        pull = [0.0] * len(chains)  # weight of the edges from placed blocks into each chain
+        best = 0
+        while best is not None:
+            placed.add(best)
+            layout.extend(chains[best])
+            for weight, src, dst in edges:
+                if chain_index[src] == best:
+                    pull[chain_index[dst]] += weight
+            remaining = [i for i in range(len(chains)) if i not in placed]
+            # chains are in the order of their heads, so ties go to the earliest
+            best = max(remaining, key=lambda i: (pull[i], -i)) if remaining else None
+        if last is not None:
+            layout.extend(chains[last])
+        return layout
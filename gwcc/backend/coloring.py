@@ -0,0 +1,315 @@
+"""
+Graph-coloring register allocation with iterated register coalescing (George & Appel).
+"""
+
+from collections import defaultdict
+
+from .. import il
+
+# how much more an access inside a loop costs than one outside it, per level of nesting
+LOOP_WEIGHT = 10
+
+
+class IteratedCoalescing(object):
+    """
+    Colors the interference graph of a function with the given registers, coalescing the
+    variables of UnaryOp.Identity moves whenever the Briggs test says that can't cause a spill.
+    Nodes that don't get a color stay spilled: the backend keeps them in the frame and goes through
+    its scratch registers to reach them, so there is no rewrite-and-repeat step.
+
+    Worklists are sets, and every pick from one takes the lowest variable id, so that the result
+    doesn't depend on hash order.
+
+    Variables live across a call don't get the registers in call_clobbered. Simplification doesn't
+    know that, so it can leave such a variable without a color where a better allocator wouldn't.
+    """
+    def __init__(self, func, blocks, stmt_liveness, registers, loops, ignore=(), commutative_ops=(),
+                 call_clobbered=(), hints=None):
+        """
+        :param hints: map from variable to a register it would rather have, all else being equal
+        """
+        self.func = func
+        self.blocks = blocks
+        self.stmt_liveness = stmt_liveness
+        self.registers = registers
+        self.K = len(registers)
+        self.loops = loops
+        self.ignore = ignore
+        self.commutative_ops = commutative_ops
+        self.call_clobbered = frozenset(call_clobbered)
+        self.hints = hints or {}
+        self.crosses_call = set()
+
+        self.nodes = set()
+        self.adj_set = set()
+        self.adj_list = defaultdict(set)
+        self.degree = defaultdict(int)
+        self.cost = defaultdict(int)  # loop-weighted number of uses and defs
+        self.move_list = defaultdict(set)
+        self.operands = defaultdict(list)  # a variable and what it's computed on top of, both ways
+        self.conflicts = defaultdict(list)  # a variable and the second operand of the statement defining it
+        self.alias = {}
+
+        self.simplify_worklist = set()
+        self.freeze_worklist = set()
+        self.spill_worklist = set()
+        self.coalesced_nodes = set()
+        self.select_stack = []
+        self.on_stack = set()
+
+        self.worklist_moves = set()  # moves are (number, dst, src)
+        self.active_moves = set()
+        self.coalesced_moves = set()
+        self.constrained_moves = set()
+        self.frozen_moves = set()
+
+        self.colors = {}
+        self.spilled = set()
+
+    def allocate(self):
+        """
+        :return: map from variable to register name. Spilled variables are left out.
+        """
+        self.build()
+        self.make_worklist()
+        while True:
+            if self.simplify_worklist:
+                self.simplify()
+            elif self.worklist_moves:
+                self.coalesce()
+            elif self.freeze_worklist:
+                self.freeze()
+            elif self.spill_worklist:
+                self.select_spill()
+            else:
+                break
+        self.assign_colors()
+        return self.colors
+
+    def build(self):
+        ignore = self.ignore
+        entry_live = [var for var in self.stmt_liveness.liveness.live_in(self.func.cfg.entry) if var not in ignore]
+        for i, u in enumerate(entry_live):
+            self.nodes.add(u)
+            for v in entry_live[i + 1:]:
+                self.add_edge(u, v)
+
+        num_moves = 0
+        for bb in self.blocks:
+            weight = LOOP_WEIGHT ** self.loops.depth(bb)
+            for i, stmt in enumerate(bb.stmts):
+                uses = il.used_vars(stmt)
+                for var in uses:
+                    if var not in ignore:
+                        self.nodes.add(var)
+                        self.cost[var] += weight
+                dst = il.defed_var(stmt)
+                if dst is None or dst in ignore:
+                    continue
+                self.nodes.add(dst)
+                self.cost[dst] += weight
+
+                src = None
+                if type(stmt) == il.UnaryStmt and stmt.op is il.UnaryOp.Identity and stmt.src not in ignore:
+                    src = stmt.src
+                    move = (num_moves, dst, src)
+                    num_moves += 1
+                    self.move_list[dst].add(move)
+                    self.move_list[src].add(move)
+                    self.worklist_moves.add(move)
+                elif uses and type(stmt) != il.CallStmt:  # a call's result doesn't come from its operands
+                    self.add_operands(stmt, dst, [var for var in uses if var not in ignore])
+                for var in self.stmt_liveness.live_out(bb, i):
+                    if var is not src and var not in ignore:
+                        self.add_edge(dst, var)
+                        if type(stmt) == il.CallStmt and var is not dst:
+                            self.crosses_call.add(var)
+
+    def add_operands(self, stmt, dst, uses):
+        if type(stmt) == il.BinaryStmt and stmt.op in self.commutative_ops:
+            first, second = uses, []  # the backend computes on top of whichever shares dst's register
+        else:
+            first, second = uses[:1], uses[1:2]
+        for var in first:
+            self.operands[dst].append(var)
+            self.operands[var].append(dst)
+        for var in second:
+            if var not in first:
+                # the second operand must not be clobbered while the first is copied into dst
+                self.conflicts[dst].append(var)
+                self.conflicts[var].append(dst)
+
+    def add_edge(self, u, v):
+        if u is not v and (u, v) not in self.adj_set:
+            self.adj_set.add((u, v))
+            self.adj_set.add((v, u))
+            self.adj_list[u].add(v)
+            self.adj_list[v].add(u)
+            self.degree[u] += 1
+            self.degree[v] += 1
+
+    @staticmethod
+    def pick(worklist):
+        return min(worklist, key=lambda var: var.id)
+
+    def make_worklist(self):
+        for n in self.nodes:
+            if self.degree[n] >= self.K:
+                self.spill_worklist.add(n)
+            elif self.move_related(n):
+                self.freeze_worklist.add(n)
+            else:
+                self.simplify_worklist.add(n)
+
+    def adjacent(self, n):
+        return [m for m in self.adj_list[n] if m not in self.on_stack and m not in self.coalesced_nodes]
+
+    def node_moves(self, n):
+        return [m for m in self.move_list[n] if m in self.active_moves or m in self.worklist_moves]
+
+    def move_related(self, n):
+        return any(m in self.active_moves or m in self.worklist_moves for m in self.move_list[n])
+
+    def simplify(self):
+        n = self.pick(self.simplify_worklist)
+        self.simplify_worklist.remove(n)
+        self.select_stack.append(n)
+        self.on_stack.add(n)
+        for m in self.adjacent(n):
+            self.decrement_degree(m)
+
+    def decrement_degree(self, m):
+        d = self.degree[m]
+        self.degree[m] = d - 1
+        if d == self.K:
+            self.enable_moves([m] + self.adjacent(m))
+            self.spill_worklist.discard(m)
+            if self.move_related(m):
+                self.freeze_worklist.add(m)
+            else:
+                self.simplify_worklist.add(m)
+
+    def enable_moves(self, nodes):
+        for n in nodes:
+            for m in self.node_moves(n):
+                if m in self.active_moves:
+                    self.active_moves.remove(m)
+                    self.worklist_moves.add(m)
+
+    def get_alias(self, n):
+        while n in self.coalesced_nodes:
+            n = self.alias[n]
+        return n
+
+    def add_work_list(self, u):
+        if not self.move_related(u) and self.degree[u] < self.K:
+            self.freeze_worklist.discard(u)
+            self.simplify_worklist.add(u)
+
+    def conservative(self, nodes):
+        return sum(1 for n in nodes if self.degree[n] >= self.K) < self.K
+
+    def coalesce(self):
+        m = min(self.worklist_moves)
+        self.worklist_moves.remove(m)
+        u = self.get_alias(m[1])
+        v = self.get_alias(m[2])
+        if u is v:
+            self.coalesced_moves.add(m)
+            self.add_work_list(u)
+        elif (u, v) in self.adj_set:
+            self.constrained_moves.add(m)
+            self.add_work_list(u)
+            self.add_work_list(v)
+        elif self.conservative(set(self.adjacent(u)) | set(self.adjacent(v))):
+            self.coalesced_moves.add(m)
+            self.combine(u, v)
+            self.add_work_list(u)
+        else:
+            self.active_moves.add(m)
+
+    def combine(self, u, v):
+        if v in self.freeze_worklist:
+            self.freeze_worklist.remove(v)
+        else:
+            self.spill_worklist.discard(v)
+        self.coalesced_nodes.add(v)
+        self.alias[v] = u
+        self.move_list[u] |= self.move_list[v]
+        self.cost[u] += self.cost[v]
+        if v in self.crosses_call:
+            self.crosses_call.add(u)
+        self.enable_moves([v])
+        for t in self.adjacent(v):
+            self.add_edge(t, u)
+            self.decrement_degree(t)
+        if self.degree[u] >= self.K and u in self.freeze_worklist:
+            self.freeze_worklist.remove(u)
+            self.spill_worklist.add(u)
+
+    def freeze(self):
+        u = self.pick(self.freeze_worklist)
+        self.freeze_worklist.remove(u)
+        self.simplify_worklist.add(u)
+        self.freeze_moves(u)
+
+    def freeze_moves(self, u):
+        for m in self.node_moves(u):
+            x, y = m[1], m[2]
+            v = self.get_alias(x) if self.get_alias(y) is self.get_alias(u) else self.get_alias(y)
+            self.active_moves.discard(m)
+            self.worklist_moves.discard(m)
+            self.frozen_moves.add(m)
+            if v in self.freeze_worklist and not self.move_related(v) and self.degree[v] < self.K:
+                self.freeze_worklist.remove(v)
+                self.simplify_worklist.add(v)
+
+    def select_spill(self):
+        # cheapest per interference removed, loop nesting making accesses dearer
+        m = min(self.spill_worklist, key=lambda n: (float(self.cost[n]) / self.degree[n], n.id))
+        self.spill_worklist.remove(m)
+        self.simplify_worklist.add(m)
+        self.freeze_moves(m)
+
+    def preferred_colors(self, n):
+        """
+        Colors of the variables n has a move with but wasn't coalesced with, so the move might vanish
+        anyway, then colors shared with the first operand of a statement, which save a copy of that
+        operand, then the hinted color.
+        """
+        partners = [var for m in sorted(self.move_list[n]) for var in m[1:]] + self.operands[n]
+        preferred = []
+        for var in partners:
+            color = self.colors.get(self.get_alias(var))
+            if color and color not in preferred:
+                preferred.append(color)
+        if n in self.hints:
+            preferred.append(self.hints[n])
+        return preferred
+
+    def assign_colors(self):
+        while self.select_stack:
+            n = self.select_stack.pop()
+            ok = set(self.registers)
+            if n in self.crosses_call:
+                ok -= self.call_clobbered
+            for w in self.adj_list[n]:
+                color = self.colors.get(self.get_alias(w))
+                if color:
+                    ok.discard(color)
+            if not ok:
+                self.spilled.add(n)
+                continue
+            for color in self.preferred_colors(n):
+                if color in ok:
+                    self.colors[n] = color
+                    break
+            else:
+                avoid = set(self.colors.get(self.get_alias(var)) for var in self.conflicts[n])
+                self.colors[n] = min(ok, key=lambda color: (color in avoid, self.registers.index(color)))
+        for n in self.coalesced_nodes:
+            alias = self.get_alias(n)
+            if alias in self.colors:
+                self.colors[n] = self.colors[alias]
+            else:
+                self.spilled.add(n)
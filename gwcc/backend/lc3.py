@@ -5,7 +5,20 @@ from gwcc.exceptions import UnsupportedFeatureError
 from .. import cfg
 from .. import il
 from ..abi.lc3 import LC3 as ABI
-from ..optimization.dataflow import LivenessAnalysis
+from ..optimization.dataflow import BitVectorLiveness, StatementLiveness
+from ..optimization.loops import LoopNesting
+from ..optimization.tail_calls import find_tail_calls
+from .linear_scan import build_intervals, linear_scan
+from .coloring import IteratedCoalescing
+from .block_layout import BlockLayout
+from .peephole import Insn, PeepholeOptimizer
+from . import lc3_runtime
+from ..util import trace
+from ..util.artifacts import NO_ARTIFACTS
+
+tracer = trace.get_tracer('backend')
+alloc_tracer = trace.get_tracer('regalloc')
+peephole_tracer = trace.get_tracer('peephole')
 
 
 class ImmRange(object):
@@ -18,12 +31,73 @@ class ImmRange(object):
 
 
 IMM5 = ImmRange(5)
+PC9 = ImmRange(9)
+PC11 = ImmRange(11)
+
+# a literal pool goes out early when the first load from it is within this many words of losing reach
+POOL_SLACK = 64
+
+# right shifts by a constant that keep at most this many bits are done inline, one bit at a time
+INLINE_SHIFT_BITS = 8
+
+
+def to_word(value):
+    """
+    :return: value wrapped around to a signed 16-bit word
+    """
+    value &= 0xffff
+    return value - 0x10000 if value & 0x8000 else value
+
+
+def log2(value):
+    """
+    :return: k if value is 2 ** k, otherwise None
+    """
+    if value > 0 and not value & (value - 1):
+        return value.bit_length() - 1
+    return None
+
+
+def binary_digits(value):
+    """
+    :return: digits of a non-negative value, least significant first
+    """
+    digits = []
+    while value:
+        digits.append(value & 1)
+        value >>= 1
+    return digits
+
+
+def csd_digits(value):
+    """
+    :return: canonical signed-digit form of a non-negative value, least significant digit first: each
+             digit is -1, 0 or 1 and no two adjacent digits are nonzero
+    """
+    digits = []
+    while value:
+        if value & 1:
+            digit = 2 - (value & 3)  # 1 if value ends in 01, -1 if it ends in 11
+            value -= digit
+        else:
+            digit = 0
+        digits.append(digit)
+        value >>= 1
+    return digits
+
+
+def shift_add_cost(digits):
+    """
+    :return: instructions needed to multiply by digits with shifts and adds, a subtraction taking three
+    """
+    return len(digits) - 1 + sum(1 if digit == 1 else 3 for digit in digits[:-1] if digit)
 
 
 class Relocation(object):
-    def __init__(self, asm_idx, asm_len, gen_func, *gen_args):
+    def __init__(self, asm_idx, asm_len, binary_loc, gen_func, *gen_args):
         self.asm_idx = asm_idx
         self.asm_len = asm_len
+        self.binary_loc = binary_loc  # where the code goes, for pc-relative offsets
         self.gen_func = gen_func
         self.gen_args = gen_args
 
@@ -39,6 +113,20 @@ class Relocation(object):
             return 'r!' + self.name
 
 
+class LiteralPool(object):
+    """
+    Words a function reads with a pc-relative LD rather than jumping over them in the code: long
+    constants and addresses. Each goes in once, and the pool is written out where no code runs.
+    """
+    def __init__(self):
+        self.entries = []  # (key, name the entry's location gets mapped under)
+        self.names = {}  # key -> name. a key is ('value', word) or ('address', symbol).
+        self.first_use = None  # location of the first load from the pool
+
+    def __len__(self):
+        return len(self.entries)
+
+
 class StackLocation(object):
     def __init__(self, bp_offset):
         assert type(bp_offset) == int
@@ -124,21 +212,25 @@ class RegisterAllocator(object):
         self.address_desc[local].add(stack_loc)
         for j in range(size):
             self.stack_slots[slot_index + j] += 1
-        print '%s is now at %s' % (local, stack_loc)
+        if alloc_tracer.active:
+            alloc_tracer.event('alloc_stack', '%(local)s is now at %(loc)s', local=str(local), loc=repr(stack_loc))
         return stack_loc
 
     def free_stack(self, stack_address, size):
         if stack_address < 0:  # don't free params
             return
-        print 'freeing %d stack slots at %d' % (size, stack_address)
+        if alloc_tracer.active:
+            alloc_tracer.event('free_stack', 'freeing %(size)d stack slots at %(offset)d', size=size, offset=stack_address)
         for j in range(size):
             self.stack_slots[stack_address + j] -= 1
         while self.stack_slots and self.stack_slots[-1] == 0:
             self.stack_slots = self.stack_slots[:-1]
-            print 'stack spill heap has shrunken'
+            if alloc_tracer.active:
+                alloc_tracer.event('shrink_stack', 'stack spill heap has shrunken', size=len(self.stack_slots))
 
     def free_local(self, local, free_stack=True):
-        print 'local %s is now dead' % (local,)
+        if alloc_tracer.active:
+            alloc_tracer.event('free_local', 'local %(local)s is now dead', local=str(local))
         size = ABI.sizeof(local.type)
         to_remove = set()
         for location in self.address_desc[local]:
@@ -148,10 +240,12 @@ class RegisterAllocator(object):
                 else:
                     stack_address = location.bp_offset
                     self.free_stack(stack_address, size)
+                    to_remove.add(location)  # a spill slot, which may be reused
             elif type(location) == RegisterLocation:
                 # if type(location) == RegisterLocation:
                 self.register_desc[location.reg].remove(local)
-                print 'reg %s is no longer storing %s' % (location.reg, local)
+                if alloc_tracer.active:
+                    alloc_tracer.event('free_reg', 'reg %(reg)s is no longer storing %(local)s', reg=location.reg, local=str(local))
                 to_remove.add(location)
         # del self.address_desc[local]
         self.address_desc[local].difference_update(to_remove)
@@ -160,6 +254,14 @@ class RegisterAllocator(object):
         self.register_desc[reg].remove(local)
         self.address_desc[local].remove(RegisterLocation(reg))
 
+    def invalidate_copies(self, local, reg):
+        """
+        Forgets every register other than 'reg' holding 'local', after 'local' has been redefined in 'reg'.
+        """
+        for location in [loc for loc in self.address_desc[local] if type(loc) == RegisterLocation]:
+            if location.reg != reg:
+                self.free_local_reg(local, location.reg)
+
     def spill_reg(self, reg):
         """
         Free up a register by spilling all locals currently stored in it to the stack.
@@ -230,7 +332,8 @@ class RegisterAllocator(object):
         for reg in self.register_set:
             if reg not in no_spill:
                 if all(map(self.has_been_spilled, self.register_desc[reg])):
-                    print 'spilling %s, but no copy is required.' % (reg,)
+                    if alloc_tracer.active:
+                        alloc_tracer.event('spill', 'spilling %(reg)s, but no copy is required.', reg=reg, copy=False)
                     for local in self.register_desc[reg]:
                         self.address_desc[local].remove(RegisterLocation(reg))
                     self.register_desc[reg].clear()
@@ -241,12 +344,28 @@ class RegisterAllocator(object):
             if reg not in no_spill:
                 if self.register_desc[reg]:
                     spill_dst = self.spill_reg(reg)
-                    print 'spilling contents of %s to %s' % (reg, spill_dst)
+                    if alloc_tracer.active:
+                        alloc_tracer.event('spill', 'spilling contents of %(reg)s to %(loc)s', reg=reg, loc=repr(spill_dst), copy=True)
                     self.spill_callback(spill_dst, reg)
                     return reg
 
         raise RuntimeError("couldn't allocate register")
 
+    def live_registers(self, live):
+        """
+        :return: the registers holding a variable in live
+        """
+        return set(reg for reg, local_set in self.register_desc.items() if any(local in live for local in local_set))
+
+    def forget_registers(self):
+        """
+        Forgets what every register holds, at the start of a block that can be entered from elsewhere.
+        """
+        for reg, local_set in self.register_desc.items():
+            for local in local_set:
+                self.address_desc[local].remove(RegisterLocation(reg))
+            local_set.clear()
+
     def store_reg(self, reg, local):
         """
         Updates metadata to reflect that 'local' is stored in 'reg'.
@@ -255,7 +374,8 @@ class RegisterAllocator(object):
         assert type(local) == il.Variable
         self.address_desc[local].add(reg)
         self.register_desc[reg.reg].add(local)
-        print '%s is now stored in %s' % (local, reg.reg)
+        if alloc_tracer.active:
+            alloc_tracer.event('store_reg', '%(local)s is now stored in %(reg)s', local=str(local), reg=reg.reg)
 
     def add_global(self, global_name, memory_loc):
         assert type(global_name) == il.GlobalName
@@ -265,8 +385,98 @@ class RegisterAllocator(object):
         elif type(global_name.value) == il.Function:
             pass
         else:
-            print global_name.value
-            assert False
+            assert False, 'unsupported global ' + str(global_name.value)
+
+
+class AssignedLocations(object):
+    """
+    Homes for the variables of a function that stay fixed for the whole function, as chosen by an
+    assignment-based allocator such as linear scan. Provides the part of RegisterAllocator's
+    interface that the statement lowerings use, and hands out temporaries per statement: first the
+    scratch register, then registers no interval occupies, and as a last resort a register that is
+    pushed before and popped after the statement. When the prologue only saves the registers the
+    function writes, temporaries come from those alone, and any other register is pushed and popped.
+    """
+    scratch_reg = 'r7'  # never holds a variable, JSRR overwrites it anyway
+    jump_stmts = (il.GotoStmt, il.CondJumpStmt, il.ReturnStmt)
+
+    def __init__(self, backend, intervals, homes, registers, written=None):
+        """
+        :param written: registers the prologue saves, which temporaries are taken from, or None for all
+        """
+        self.backend = backend
+        self.homes = homes  # maps variables to locations
+        self.registers = registers
+        self.written = written
+
+        self._by_start = sorted([iv for iv in intervals if iv.reg], key=lambda iv: iv.start)
+        self._next = 0
+        self._active = []
+        self._point = 0
+
+        self._stmt = None
+        self._occupied = set()
+        self._taken = set()
+        self._borrowed = []
+
+    def reg_of(self, var):
+        location = self.homes.get(var)
+        return location.reg if type(location) == RegisterLocation else None
+
+    def begin_statement(self, stmt):
+        use_point, def_point = self._point, self._point + 1
+        while self._next < len(self._by_start) and self._by_start[self._next].start <= def_point:
+            self._active.append(self._by_start[self._next])
+            self._next += 1
+        self._active = [iv for iv in self._active if iv.end >= use_point]
+        self._occupied = set(iv.reg for iv in self._active)
+        self._taken = set()
+        self._borrowed = []
+        self._stmt = stmt
+
+    def end_statement(self):
+        for reg in reversed(self._borrowed):
+            self.backend.cl_pop(reg)
+        self._point += 2
+
+    def take(self, reg):
+        self._taken.add(reg)
+        return reg
+
+    def getreg(self, live_out, src_local, no_spill):
+        if self.scratch_reg not in self._taken and self.scratch_reg not in no_spill:
+            return self.take(self.scratch_reg)
+        for reg in self.registers:
+            if reg not in self._occupied and reg not in self._taken and reg not in no_spill and \
+                    (self.written is None or reg in self.written):
+                return self.take(reg)
+
+        if type(self._stmt) in self.jump_stmts:
+            # can't pop after a jump. jump lowerings only ask for a temporary once they are done with
+            # their operand, so the scratch copy of that operand can be reused.
+            if self.scratch_reg in self._taken:
+                return self.scratch_reg
+            raise BackendError('no register left for ' + str(self._stmt))
+
+        assert type(self._stmt) not in (il.ParamStmt, il.CallStmt)  # would mess up the argument stack
+        for reg in self.registers:
+            if reg not in self._taken and reg not in no_spill:
+                self.backend.cl_push(reg)
+                self._borrowed.append(reg)
+                return self.take(reg)
+        raise BackendError('no register left for ' + str(self._stmt))
+
+    def get_loc(self, local):
+        return self.homes[local]
+
+    def live_registers(self, live):
+        return set(self.reg_of(var) for var in live) - set([None])
+
+    def free_local(self, local, free_stack=True):
+        pass
+
+    def store_reg(self, reg, local):
+        pass
 
 
 class LC3(object):
@@ -286,18 +496,55 @@ class LC3(object):
     r7 is not saved because it holds the return address.
 
     Stack starts at 0xEFFF and grows toward lower addresses.
+
+    --- The register calling convention ---
+    Opt-in for a whole program, by compiling it for the LC3Registers ABI.
+
+    The first three arguments go in r0, r1 and r2, the rest are pushed right-to-left and popped
+    by the caller. There is no return value slot, the value comes back in r0.
+    r7 holds the return address. r0, r1, r2 and r7 may be overwritten by the callee, the other
+    registers are preserved.
+
+    Compiled code always calls the register entry. A function with asm linkage also gets a stack
+    convention entry under its name, for code written in assembly.
     """
 
     bp = 'r5'  # basepointer basepointer basepointer basepointer
     sp = 'r6'  # stack pointer
     rp = 'r7'  # return pointer
     retval_reg = 'r0'
+    arg_regs = ('r0', 'r1', 'r2')  # of the register calling convention
+    call_clobbered = ('r0', 'r1', 'r2', 'r7')  # by a call under the register calling convention
 
-    def __init__(self, names, with_symbols=True):
+    regalloc_modes = ('local', 'linear-scan', 'coloring')
+
+    def __init__(self, names, with_symbols=True, artifacts=NO_ARTIFACTS, regalloc='local', peephole=False,
+                 layout=False, block_frequencies=None, literal_pools=False, minimal_frames=False, tail_calls=False):
+        """
+        :param layout: lay blocks out so that jumps to the next block can be left out, instead of in
+                       reverse postorder
+        :param block_frequencies: optional map from function name to the profile counts of its blocks,
+                                  by block name, to lay it out by
+        :param literal_pools: load long constants and addresses from per-function literal pools, and
+                              globals in reach directly, instead of jumping over the data in the code
+        :param minimal_frames: only save the registers a function writes, and only set up a frame pointer
+                               if it has something on the stack
+        :param tail_calls: jump to the function a call in tail position calls, after taking the caller's
+                           frame down, where the calling convention allows
+        """
         assert all(map(lambda e: type(e) == il.GlobalName, names))
+        if regalloc not in self.regalloc_modes:
+            raise BackendError('unknown register allocator ' + regalloc)
 
         # input
         self.enable_symbols = with_symbols
+        self.artifacts = artifacts
+        self.regalloc = regalloc
+        self.layout = layout
+        self.block_frequencies = block_frequencies or {}
+        self.literal_pools = literal_pools
+        self.minimal_frames = minimal_frames
+        self.tail_calls = tail_calls
         self._global_names = names
         self._global_vars = {glob.value: glob for glob in self._global_names if type(glob.value) == il.Variable}
 
@@ -308,6 +555,18 @@ class LC3(object):
         self._cur_orig = None
         self._label_cache = {}
         self._cur_sp = None
+        self._next_block = None  # block laid out after the one being emitted, if jumps to it can be left out
+        self._pool = None  # literal pool of the function being emitted, if it gets one
+        self._num_pool_entries = 0
+        self._clobbered = None  # registers the function being emitted writes, if known
+        self._saved_regs = None  # registers its prologue pushes after the return value slot, in order
+        self._has_frame = True  # whether it points bp at its frame
+        self._ret_reg = self.retval_reg  # register its return value goes to the epilogue in
+        self._convention = il.CallingConvention.Stack  # how it is called
+        self._tail_calls = {}  # its calls in tail position -> name of the function called, if known
+        self._tail_jumps = set()  # the ones lowered to jumps
+        self._peephole = PeepholeOptimizer(self._write_line) if peephole else None
+        self.peephole_hits = {}  # rule name -> times applied, once compiled
 
         # output
         self._compiled = False
@@ -343,6 +602,7 @@ class LC3(object):
     def place_relocation(self, name):
         self.emit_newline()
         self.emit_comment('------- symbol: %s' % (name,) + ' --------')
+        self.flush_peephole()
         self._mappings[name] = self._cur_binary_loc
 
     def is_name_mapped(self, name):
@@ -351,21 +611,38 @@ class LC3(object):
     def get_binary_location(self, name):
         return self._mappings[name]
 
+    def emit_verbatim(self, gen_func, *args):
+        """
+        Emits what gen_func generates past the peephole optimizer, which only knows about forward
+        offsets and would break code that branches back into itself.
+        """
+        self.flush_peephole()
+        peephole, self._peephole = self._peephole, None
+        binary_loc_start = self._cur_binary_loc
+        gen_func(*args)
+        self._peephole = peephole
+        if peephole:
+            peephole.skip(self._cur_binary_loc - binary_loc_start)
+
     def make_reloc(self, gen_func, *args):
+        self.flush_peephole()
         asm_idx_start = len(self._asm)
+        binary_loc = self._cur_binary_loc
         unwrapped_args = list(args)
         for i in range(len(unwrapped_args)):
             if type(unwrapped_args[i]) == Relocation.Resolved:
-                unwrapped_args[i] = 0
-        gen_func(*unwrapped_args)
+                unwrapped_args[i] = binary_loc  # keeps pc-relative placeholders in reach
+        # relocated code is regenerated in place later, so it goes out as is
+        self.emit_verbatim(gen_func, *unwrapped_args)
         asm_idx_end = len(self._asm)
-        reloc = Relocation(asm_idx_start, asm_idx_end - asm_idx_start, gen_func, *args)
+        reloc = Relocation(asm_idx_start, asm_idx_end - asm_idx_start, binary_loc, gen_func, *args)
         self._deferred_relocations.append(reloc)
 
     def _apply_reloc(self, reloc):
         asm_bak = self._asm
         cur_binary_loc_bak = self._cur_binary_loc
         self._asm = []
+        self._cur_binary_loc = reloc.binary_loc
 
         gen_args = list(reloc.gen_args)
         for i in range(len(gen_args)):
@@ -384,17 +661,30 @@ class LC3(object):
             self._apply_reloc(reloc)
 
     def _emit_line(self, line, binary_len):
+        if self._peephole:
+            self._peephole.emit(line, binary_len)
+        else:
+            self._write_line(line, binary_len)
+
+    def _write_line(self, line, binary_len):
+        if binary_len is None:
+            self._asm.append(line)
+            return
         line += (' ' * max(0, 40 - len(line))) + '; loc=%02x' % (self._cur_binary_loc,)
         self._asm.append(line)
         self._cur_binary_loc += binary_len
 
+    def flush_peephole(self):
+        if self._peephole:
+            self._peephole.flush()
+
     def emit_newline(self):
         if self.enable_symbols:
-            self._asm.append('')
+            self._emit_line('', None)
 
     def emit_comment(self, line):
         if self.enable_symbols:
-            self._asm.append('; ' + line)
+            self._emit_line('; ' + line, None)
 
     def emit_insn(self, insn):
         self._emit_line(insn, 1)
@@ -409,6 +699,7 @@ class LC3(object):
         self._emit_line(name, 0)
 
     def emit_fill(self, value, name=''):
+        value &= 0xffff
         if name:
             self._emit_line('%s .fill x%x' % (name, value), 1)
         else:
@@ -448,6 +739,26 @@ class LC3(object):
         self.emit_comment('mov ' + dst_reg + ', ' + src_reg)
         self.emit_insn('add %s, %s, #0' % (dst_reg, src_reg))
 
+    def cl_parallel_move(self, moves):
+        """
+        Copies registers into other registers as if all at once.
+        :param moves: map from destination register to source register
+        """
+        pending = {dst: src for dst, src in moves.items() if dst != src}
+        parked = []
+        while pending:
+            ready = [dst for dst in pending if dst not in pending.values()]
+            if ready:
+                dst = min(ready)
+                self.cl_move(dst, pending.pop(dst))
+            else:
+                # only cycles are left, one of their values waits on the stack
+                dst = min(pending)
+                self.cl_push(pending.pop(dst))
+                parked.append(dst)
+        for dst in reversed(parked):
+            self.cl_pop(dst)
+
     def cl_sub(self, dst_reg, src_reg):
         # self.emit_comment('sub ' + dst_reg + ', ' + src_reg)
         self.cl_twos(src_reg)
@@ -474,6 +785,9 @@ class LC3(object):
             self.cl_zero_reg(reg)
             if value != 0:
                 self.emit_insn('add %s, %s, #%d' % (reg, reg, value))
+        elif self._pool is not None:
+            self.emit_comment('load long: %s <- %d (0x%02x)' % (reg, value, value))
+            self.cl_load_pool(reg, ('value', value & 0xffff))
         else:
             self.emit_comment('load long: %s <- %d (0x%02x)' % (reg, value, value))
             self.emit_insn('LD %s, #1' % (reg,))
@@ -507,7 +821,7 @@ class LC3(object):
         self.emit_insn('BRn #12')  # if b negative, branch to TRUE
         self.emit_insn('BR #2')  # jump to COMPARE
         self.cl_test(src_reg)  # A_NEGATIVE
-        self.emit_insn('BRzp #9')  # if b non-negative, branch to FALSE
+        self.emit_insn('BRzp #7')  # if b non-negative, branch to FALSE
         self.cl_sub(dst_reg, src_reg)  # COMPARE: (THIS IS 5 INSTRUCTIONS.)
         self.cl_test(dst_reg)
         self.emit_insn('BRn #2')  # branch to TRUE
@@ -534,7 +848,14 @@ class LC3(object):
         # END:
 
     def reloc_load_address(self, reg, name):
-        if self.is_name_mapped(name):
+        if self._pool is not None:
+            if self.near_symbol(name):
+                self.emit_comment('load: ' + name)
+                self.cl_pc_relative('LEA', reg, self.get_binary_location(name))
+            else:
+                self.emit_comment('load from pool: %s <- %s' % (reg, name))
+                self.cl_load_pool(reg, ('address', name))
+        elif self.is_name_mapped(name):
             self.emit_comment('load: ' + name)
             self.cl_load_reg(reg, self.get_binary_location(name))
         else:
@@ -549,17 +870,138 @@ class LC3(object):
             self.emit_comment('relocated address: ' + name)
             self.make_reloc(self.emit_fill, Relocation.Resolved(name), asm_label)
 
+    def cl_load_global(self, reg, name):
+        if self._pool is not None and self.near_symbol(name):
+            self.emit_comment('load: %s <- [%s]' % (reg, name))
+            self.cl_pc_relative('LD', reg, self.get_binary_location(name))
+        else:
+            self.reloc_load_address(reg, name)
+            self.emit_insn('LDR %s, %s, #0' % (reg, reg))
+
+    def cl_store_global(self, src_reg, name, get_tmp):
+        if self._pool is not None:
+            if self.near_symbol(name):
+                self.emit_comment('store: [%s] <- %s' % (name, src_reg))
+                self.cl_pc_relative('ST', src_reg, self.get_binary_location(name))
+            else:
+                tmp_reg = get_tmp()
+                self.reloc_load_address(tmp_reg, name)
+                self.emit_insn('STR %s, %s, #0' % (src_reg, tmp_reg))
+        else:
+            tmp_reg = get_tmp()
+            self.emit_insn('LD %s, #2' % (tmp_reg,))
+            self.emit_insn('STR %s, %s, #0' % (src_reg, tmp_reg))
+            self.emit_insn('BR #1')
+            self.reloc_dump_address(name)
+
+    def near_symbol(self, name):
+        """
+        :return: whether name is laid out close enough before the current location for a pc-relative
+                 access. If it is, the peephole optimizer has been flushed so the location is exact.
+        """
+        if not self.is_name_mapped(name):
+            return False
+        self.flush_peephole()
+        return PC9.holds(self.get_binary_location(name) - (self._cur_binary_loc + 1))
+
+    def cl_pc_relative(self, op, reg, target):
+        """
+        Emits op with reg and a pc-relative offset to target.
+        """
+        offset = target - (self._cur_binary_loc + 1)
+        if not PC9.holds(offset):
+            raise BackendError('x%04x is out of reach of %s at x%04x' % (target, op, self._cur_binary_loc))
+        self.emit_insn('%s %s, #%d' % (op, reg, offset))
+
+    def pool_entry(self, key):
+        """
+        :return: name of the entry of the literal pool that holds key, which is added if it isn't there
+        """
+        name = self._pool.names.get(key)
+        if name is None:
+            name = self._pool.names[key] = '.pool%d' % (self._num_pool_entries,)
+            self._num_pool_entries += 1
+            self._pool.entries.append((key, name))
+        return name
+
+    def cl_load_pool(self, reg, key):
+        self.flush_peephole()
+        if self._pool.first_use is None:
+            self._pool.first_use = self._cur_binary_loc
+        self.make_reloc(self.cl_pc_relative, 'LD', reg, Relocation.Resolved(self.pool_entry(key)))
+
+    def check_literal_pool(self):
+        """
+        Writes the literal pool out here, with a branch around it, if the code to come might take its
+        entries out of reach of the first load from it.
+        """
+        pool = self._pool
+        if not pool or self._cur_binary_loc + len(pool) + POOL_SLACK <= pool.first_use + 1 + PC9.max_value:
+            return
+        self.flush_peephole()
+        self.emit_insn('BR #%d' % (len(pool),))
+        self.emit_literal_pool()
+
+    def emit_literal_pool(self):
+        pool = self._pool
+        if not pool:
+            return
+        self.emit_comment('literal pool')
+        self.flush_peephole()
+        for (kind, value), name in pool.entries:
+            self._mappings[name] = self._cur_binary_loc
+            if kind == 'value':
+                self.emit_fill(value)
+            else:
+                self.reloc_dump_address(value)
+        self._pool = LiteralPool()
+
     def emit_stub(self):
         """
         Emits a compiler-generated stub to setup the stack and shit
         """
         self.cl_load_reg(LC3.bp, 0xbfff)
         self.cl_move(LC3.sp, LC3.bp)
-        self.emit_insn('LD %s, #2' % (self.rp,))
-        self.emit_insn('JSRR %s' % (self.rp,))
+        conventions = [glob.value.convention for glob in self._global_names
+                       if glob.name == 'main' and type(glob.value) == il.Function]
+        if conventions and conventions[0] is il.CallingConvention.Register:
+            self.emit_insn('LD %s, #4' % (self.rp,))
+            self.emit_insn('JSRR %s' % (self.rp,))
+            # leave the return value on top of the stack, where the stack convention puts it
+            self.cl_push(self.retval_reg)
+        else:
+            self.emit_insn('LD %s, #2' % (self.rp,))
+            self.emit_insn('JSRR %s' % (self.rp,))
         self.emit_insn('HALT')
         self.reloc_dump_address('main')
 
+    def find_runtime_routines(self):
+        """
+        :return: names of the runtime routines the functions call
+        """
+        names = set()
+        for glob in self._global_names:
+            if type(glob.value) != il.Function:
+                continue
+            constants = self.find_constants(glob.value)
+            for bb in glob.value.cfg.basic_blocks:
+                for stmt in bb.stmts:
+                    routine = self.runtime_routine(stmt, constants)
+                    if routine:
+                        names.add(routine)
+        return names
+
+    def emit_runtime(self, names):
+        for routine in lc3_runtime.closure(names):
+            self.place_relocation(routine.name)
+            self.emit_comment(routine.doc)
+            self.emit_label(routine.name)
+            self.emit_verbatim(self.emit_routine, routine)
+
+    def emit_routine(self, routine):
+        for insn in lc3_runtime.assemble(routine.code):
+            self.emit_insn(insn)
+
     def emit_global_variable(self, glob):
         self.place_relocation(glob.name)
 
@@ -582,27 +1024,26 @@ class LC3(object):
             self.emit_blkw(asm_name, 1)
 
     def vl_shift_bp(self, bp_offset, callback):
+        # LDR and STR reach bp-32 to bp+31, so bp is moved toward slots past that and back afterwards
         bp_delta = 0  # how much the bp moved, so how much we have to unshift it by
-        while bp_offset < -32:
-            self.emit_insn('add %s, %s, #-16' % (self.bp, self.bp))
-            bp_offset -= -16
-            bp_delta -= 16
-        while bp_offset > 31:
-            self.emit_insn('add %s, %s, #15' % (self.bp, self.bp))
+        while bp_offset > 32:
+            self.emit_insn('add %s, %s, #-15' % (self.bp, self.bp))
             bp_offset -= 15
+            bp_delta -= 15
+        while bp_offset < -31:
+            self.emit_insn('add %s, %s, #15' % (self.bp, self.bp))
+            bp_offset += 15
             bp_delta += 15
 
         callback(bp_offset)
 
         # move bp back
-        while bp_delta > 16:
-            self.emit_insn('add %s, %s, #-16' % (self.bp, self.bp))
-            bp_delta -= 16
-        while bp_delta < -15:
+        while bp_delta < 0:
             self.emit_insn('add %s, %s, #15' % (self.bp, self.bp))
             bp_delta += 15
-        if bp_delta:
-            self.emit_insn('add %s, %s, #-%d' % (self.bp, self.bp, bp_delta))
+        while bp_delta > 0:
+            self.emit_insn('add %s, %s, #-15' % (self.bp, self.bp))
+            bp_delta -= 15
 
     def vl_load_local(self, dst_reg, bp_offset):
         self.emit_comment('mov %s, [bp-%d]' % (dst_reg, bp_offset))
@@ -619,110 +1060,490 @@ class LC3(object):
             self._cur_sp = spill_loc.bp_offset
 
     def emit_function(self, glob):
+        func = glob.value
+        self._convention = func.convention
+        # code written in assembly calls an entry with the stack convention, which goes after the function
+        stack_entry = func.convention is il.CallingConvention.Register and glob.linkage == 'asm'
+
         self.place_relocation(glob.name)
+        self.emit_label(self.mangle_name_c(glob.name) if stack_entry else self.mangle_globalname(glob))
 
-        asm_name = self.mangle_globalname(glob)
-        self.emit_label(asm_name)
+        if alloc_tracer.active:
+            alloc_tracer.event('function', '\nallocating %(function)s', function=func.name)
 
-        func = glob.value
+        # linearize the cfg
+        if self.layout:
+            blocks = BlockLayout(func, self.block_frequencies.get(func.name)).order()
+        else:
+            blocks = cfg.topoorder(func.cfg)
+
+        # let's cop liveness, once for the whole function
+        liveness = BitVectorLiveness(func)
+        stmt_liveness = StatementLiveness(func, liveness)
+
+        if self.artifacts.wants('liveness'):
+            with self.artifacts.open('liveness', func.name) as fd:
+                self.dump_liveness(fd, func, blocks, liveness)
+
+        self._constants = self.find_constants(func)
+        self._tail_calls = {}
+        if self.tail_calls:
+            callees = func.direct_calls()
+            self._tail_calls = {call: callees.get(call) for call in find_tail_calls(func)}
+        self._clobbered = None
+        if self.minimal_frames and self.regalloc == 'local':
+            self._clobbered = self.find_clobbered(func, blocks, liveness, stmt_liveness)
+        self.emit_body(func, blocks, liveness, stmt_liveness)
 
-        # print func.pretty_print()
-        # with open('tmp_cfg_func_%s.dot' % func.name, 'w') as f:
-        #     func.dump_graph(fd=f)
-        def liveness_set_to_str(live):
-            return '(' + ', '.join(map(lambda v: v.name, live)) + ')'
+        self.place_relocation(self.name_return_block(func))
+        self.emit_func_epilogue()
+        self.emit_literal_pool()  # nothing runs into it after the RET
+        self._pool = None
+        if stack_entry:
+            self.emit_stack_entry(glob)
+
+    def emit_stack_entry(self, glob):
+        self.emit_newline()
+        self.emit_comment('------- stack convention entry: %s --------' % (glob.name,))
+        self.emit_label(self.mangle_globalname(glob))
+        self.emit_verbatim(self.cl_stack_entry, glob.value, self.get_binary_location(glob.name))
+
+    def cl_stack_entry(self, func, target):
+        """
+        Calls the function at target, which follows the register convention, from the stack convention:
+        loads the arguments from the stack, and stores the return value into its slot. Every register
+        is preserved.
+        """
+        saved = [self.rp] + list(self.arg_regs)
+        num_reg_args = min(len(func.params), len(self.arg_regs))
+        num_stack_args = len(func.params) - num_reg_args
+        frame = 1 + len(saved)  # the return value slot, then the saved registers
+        self.emit_insn('ADD %s, %s, #-%d' % (self.sp, self.sp, frame))
+        for i, reg in enumerate(saved):
+            self.emit_insn('STR %s, %s, #%d' % (reg, self.sp, frame - 2 - i))
+
+        # the arguments start right above the frame
+        if num_stack_args:
+            self.emit_insn('ADD %s, %s, #-%d' % (self.sp, self.sp, num_stack_args))
+            for i in range(num_stack_args):
+                self.emit_insn('LDR %s, %s, #%d' % (self.rp, self.sp, num_stack_args + frame + num_reg_args + i))
+                self.emit_insn('STR %s, %s, #%d' % (self.rp, self.sp, i))
+        for i in range(num_reg_args):
+            self.emit_insn('LDR %s, %s, #%d' % (self.arg_regs[i], self.sp, num_stack_args + frame + i))
+
+        offset = target - (self._cur_binary_loc + 1)
+        if PC11.holds(offset):
+            self.emit_insn('JSR #%d' % (offset,))
+        else:
+            self.emit_insn('LD %s, #2' % (self.rp,))
+            self.emit_insn('JSRR %s' % (self.rp,))
+            self.emit_insn('BR #1')
+            self.emit_fill(target)
+        if num_stack_args:
+            self.emit_insn('ADD %s, %s, #%d' % (self.sp, self.sp, num_stack_args))
+
+        self.emit_insn('STR %s, %s, #%d' % (self.retval_reg, self.sp, frame - 1))
+        for i, reg in reversed(list(enumerate(saved))):
+            self.emit_insn('LDR %s, %s, #%d' % (reg, self.sp, frame - 2 - i))
+        self.emit_insn('ADD %s, %s, #%d' % (self.sp, self.sp, frame - 1))
+        self.emit_insn('RET')
 
+    def emit_body(self, func, blocks, liveness, stmt_liveness):
+        self._frame_locals = set(func.locals)
+        self._tail_jumps = set()
+        self._pool = LiteralPool() if self.literal_pools else None
+        if self.regalloc == 'local':
+            self.emit_function_body(func, blocks, stmt_liveness)
+        else:
+            self.emit_function_body_assigned(func, blocks, liveness, stmt_liveness)
+
+    def find_clobbered(self, func, blocks, liveness, stmt_liveness):
+        """
+        Finds the registers the body of func writes by emitting it with every register saved, then
+        throwing that away. The real prologue can only be shorter, which brings the body closer to the
+        symbols before it, and reaching those directly never takes more registers. Only needed for the
+        local allocator, which picks registers as it goes. Calls to runtime routines don't show what the
+        routine writes, so cl_call_runtime saves the registers it needs itself.
+        :return: set of registers
+        """
+        self.flush_peephole()
+        asm_len, binary_loc = len(self._asm), self._cur_binary_loc
+        mappings = dict(self._mappings)
+        num_relocations = len(self._deferred_relocations)
+        peephole = self._peephole
+        tracing = tracer.active, alloc_tracer.active
+        if peephole:
+            self._peephole = PeepholeOptimizer(self._write_line, peephole.rules)
+        tracer.active = alloc_tracer.active = False
+        try:
+            self.emit_body(func, blocks, liveness, stmt_liveness)
+            self.flush_peephole()
+        finally:
+            self._peephole = peephole
+            tracer.active, alloc_tracer.active = tracing
+
+        clobbered = set()
+        for line in self._asm[asm_len:]:
+            text = line.split(';')[0].strip()
+            insn = Insn.parse(text) if text else None
+            if insn and insn.writes():
+                clobbered.add(insn.writes())
+
+        del self._asm[asm_len:]
+        self._cur_binary_loc = binary_loc
+        self._mappings = mappings
+        del self._deferred_relocations[num_relocations:]
+        return clobbered
+
+    def find_assigned_clobbered(self, func, homes):
+        """
+        Finds the registers the body of func may write once its variables have their homes: theirs, the
+        scratch register, the one the return value leaves through, and under the register convention the
+        ones a call overwrites. AssignedLocations takes temporaries from these alone.
+        :return: set of registers
+        """
+        clobbered = set(home.reg for home in homes.values() if type(home) == RegisterLocation)
+        clobbered.update([AssignedLocations.scratch_reg, self._ret_reg])
+        if func.convention is il.CallingConvention.Register and \
+                any(type(stmt) == il.CallStmt for bb in func.cfg.basic_blocks for stmt in bb.stmts):
+            clobbered.update(self.call_clobbered)
+        return clobbered
+
+    def plan_frame(self, func, has_frame):
+        """
+        Picks what the prologue saves: every register the calling convention preserves until the ones
+        the function writes are known, then only those, along with bp if the function has a frame.
+        """
+        if self._convention is il.CallingConvention.Register:
+            preserved = ['r3', 'r4']  # the callee may overwrite the others
+        else:
+            preserved = ['r0', 'r1', 'r2', 'r3', 'r4']
+        if self._clobbered is None:
+            self._saved_regs = [self.rp, self.bp] + preserved
+            self._has_frame = True
+        else:
+            self._saved_regs = [reg for reg in [self.rp] if reg in self._clobbered]
+            self._saved_regs += [self.bp] if has_frame else []
+            self._saved_regs += [reg for reg in preserved if reg in self._clobbered]
+            self._has_frame = has_frame
+
+    def register_params(self, func):
+        """
+        :return: (parameter, register) for the parameters of func that are passed in registers
+        """
+        if func.convention is not il.CallingConvention.Register:
+            return []
+        return zip(func.params, self.arg_regs)
+
+    def register_hints(self, func):
+        """
+        :return: map from variable to the register it arrives in or leaves through under the register
+                 calling convention, for the allocators to prefer
+        """
+        hints = dict(self.register_params(func))
+        hints.setdefault(func.retval, self.retval_reg)
+        for bb in func.cfg.basic_blocks:
+            for stmt in bb.stmts:
+                if type(stmt) == il.CallStmt:
+                    for arg, reg in zip(stmt.args, self.arg_regs):
+                        hints.setdefault(arg, reg)
+                    hints.setdefault(stmt.dst, self.retval_reg)
+        return hints
+
+    def param_bp_offset(self, i):
+        """
+        :return: bp offset of the i-th parameter that is passed on the stack, past the saved registers
+                 and the return value slot if there is one
+        """
+        if self._convention is il.CallingConvention.Register:
+            return -(len(self._saved_regs) + i - len(self.arg_regs))
+        return -(len(self._saved_regs) + 1 + i)
+
+    @staticmethod
+    def find_constants(func):
+        """
+        :return: map from the locals of func that are only ever assigned one integer constant to its value
+        """
+        defs = defaultdict(list)
+        addressed = set()
+        for bb in func.cfg.basic_blocks:
+            for stmt in bb.stmts:
+                dst = il.defed_var(stmt)
+                if dst:
+                    defs[dst].append(stmt)
+                if type(stmt) == il.RefStmt:
+                    addressed.add(stmt.var)
+        constants = {}
+        for var, stmts in defs.iteritems():
+            if len(stmts) == 1 and type(stmts[0]) == il.ConstantStmt and var in func.variables and \
+                    var not in func.params and var not in addressed and \
+                    stmts[0].imm.value.type == il.CompiledValueType.Integer:
+                constants[var] = to_word(stmts[0].imm.value.value)
+        return constants
+
+    def emit_function_body(self, func, blocks, stmt_liveness):
+        """
+        Emits a function using the descriptor-based RegisterAllocator, which decides statement by statement.
+        """
         spill_callback = self.spill_callback
         reg_alloc = RegisterAllocator(spill_callback)
 
         for global_name in self._global_names:
             reg_alloc.add_global(global_name, MemoryLocation(global_name.name))
 
-        for i, param in enumerate(func.params):
-            reg_alloc.address_desc[param].add(StackLocation(-i - 8))
+        self.plan_frame(func, True)
+        self._ret_reg = self.retval_reg
+        reg_params = self.register_params(func)
+        # parameters passed in registers get a frame slot, like named locals
+        stack_params = func.params[len(reg_params):]
+        for i, param in enumerate(stack_params, len(reg_params)):
+            reg_alloc.address_desc[param].add(StackLocation(self.param_bp_offset(i)))
+
+        # the register descriptors only hold for straight-line code, so temporaries that optimizations
+        # left live across blocks get a frame slot like named locals
+        frame_locals = list(func.locals)
+        for bb in blocks:
+            for var in sorted(stmt_liveness.liveness.live_in(bb), key=lambda var: var.id):
+                if var not in self._global_vars and var not in self._frame_locals:
+                    self._frame_locals.add(var)
+                    frame_locals.append(var)
 
-        for local in func.locals:
-            if local not in func.params:
+        for local in frame_locals:
+            if local not in stack_params:
                 reg_alloc.alloc_stack(local)
 
         # function prologue
         self.emit_func_prologue(reg_alloc.cur_bp_offset)
         self._cur_sp = reg_alloc.cur_bp_offset
+        for param, reg in reg_params:
+            self.vl_store_local(reg, reg_alloc.get_loc(param).bp_offset)
 
-        # linearize the cfg
-        blocks = cfg.topoorder(func.cfg)
+        for i, bb in enumerate(blocks):
+            self._next_block = blocks[i + 1] if self.layout and i + 1 < len(blocks) else None
+            reg_alloc.forget_registers()
+            self.emit_basic_block(bb, func, stmt_liveness, reg_alloc)
 
-        # let's cop liveness
-        liveness = LivenessAnalysis(func).compute_liveness()
+    def emit_function_body_assigned(self, func, blocks, liveness, stmt_liveness):
+        """
+        Emits a function whose variables get one home each for the whole function, by linear scan or
+        by graph coloring.
+        """
+        registers = [reg for reg in RegisterAllocator.register_set if reg != AssignedLocations.scratch_reg]
+        intervals = build_intervals(blocks, liveness, stmt_liveness, ignore=self._global_vars)
+        if func.convention is il.CallingConvention.Register:
+            # variables live across a call stay out of the registers it overwrites
+            call_clobbered = self.call_clobbered
+            hints = self.register_hints(func)
+        else:
+            call_clobbered, hints = (), {}
+        if self.regalloc == 'coloring':
+            # the intervals still tell which registers are free for temporaries at each statement
+            coloring = IteratedCoalescing(func, blocks, stmt_liveness, registers, LoopNesting(func),
+                                          ignore=self._global_vars, commutative_ops=self.commutative_ops,
+                                          call_clobbered=call_clobbered, hints=hints)
+            colors = coloring.allocate()
+            if alloc_tracer.active:
+                alloc_tracer.event('coloring', '%(coalesced)d moves coalesced, %(spilled)d variables spilled',
+                                   coalesced=len(coloring.coalesced_moves), spilled=len(coloring.spilled))
+            for interval in intervals.values():
+                interval.reg = colors.get(interval.var)
+            spilled = [interval for interval in intervals.values() if not interval.reg]
+        else:
+            for var, reg in hints.items():
+                if var in intervals:
+                    intervals[var].preferred = reg
+            spilled = linear_scan(intervals.values(), registers, call_clobbered)
+
+        homes = {}
+        for global_var, global_name in self._global_vars.items():
+            homes[global_var] = MemoryLocation(global_name.name)
+        for interval in intervals.values():
+            if interval.reg:
+                homes[interval.var] = RegisterLocation(interval.reg)
+        retval_home = homes.get(func.retval)
+        self._ret_reg = retval_home.reg if self.minimal_frames and type(retval_home) == RegisterLocation \
+            else self.retval_reg
+        if self.minimal_frames:
+            self._clobbered = self.find_assigned_clobbered(func, homes)
+        # only stack homes need a frame, parameters in registers are loaded off sp
+        self.plan_frame(func, bool(spilled) or not self.minimal_frames)
+        reg_params = self.register_params(func)
+        param_offsets = {param: self.param_bp_offset(i) for i, param in enumerate(func.params)
+                         if i >= len(reg_params)}
+        frame_size = 1  # bp points to the last saved register
+        for interval in sorted(spilled, key=lambda iv: iv.start):
+            if interval.var in param_offsets:
+                homes[interval.var] = StackLocation(param_offsets[interval.var])
+            else:
+                homes[interval.var] = StackLocation(frame_size)
+                frame_size += ABI.sizeof(interval.var.type)
+
+        if alloc_tracer.active:
+            for interval in sorted(intervals.values(), key=lambda iv: iv.start):
+                alloc_tracer.event('interval', '%(var)s [%(start)d, %(end)d] -> %(loc)s', var=interval.var.name,
+                                   start=interval.start, end=interval.end, loc=repr(homes[interval.var]))
+
+        self.emit_func_prologue(frame_size)
+        self._cur_sp = frame_size
+        entry_live = liveness.live_in(func.cfg.entry)
+        moves = {}
+        for param, reg in reg_params:
+            home = homes.get(param)
+            if param in entry_live and type(home) == RegisterLocation:
+                moves[home.reg] = reg
+            elif param in entry_live and type(home) == StackLocation:
+                self.vl_store_local(reg, home.bp_offset)
+        self.cl_parallel_move(moves)
+        for param, offset in param_offsets.items():
+            # a dead parameter may share its register with a live one
+            if param in entry_live and type(homes.get(param)) == RegisterLocation:
+                if self._has_frame:
+                    self.vl_load_local(homes[param].reg, offset)
+                else:
+                    self.emit_insn('LDR %s, %s, #%d' % (homes[param].reg, self.sp, -offset))
+
+        locations = AssignedLocations(self, intervals.values(), homes, registers, self._clobbered)
+        for i, bb in enumerate(blocks):
+            self._next_block = blocks[i + 1] if self.layout and i + 1 < len(blocks) else None
+            self.emit_basic_block_assigned(bb, func, stmt_liveness, locations)
+
+    def emit_basic_block_assigned(self, bb, func, stmt_liveness, locations):
+        self.place_relocation(self.name_basic_block(func, bb))
 
-        # debug print the statement liveness
-        fd = open('tmp_liveness_debug.dot', 'w')
-        print >> fd, "digraph \"%s\" {" % ('CFG',)
+        fused = None
+        returned = False
+        for i, stmt in enumerate(bb.stmts):
+            self.check_literal_pool()
+            locations.begin_statement(stmt)
+            if stmt is fused:
+                locations.end_statement()  # lowered along with the comparison it tests
+                continue
+            if returned:
+                locations.end_statement()  # the callee of a tail call returned in its place
+                continue
+            self.emit_comment(str(stmt))
+            # the result of a fused comparison is computed in its register, so it needs one
+            fused = self.fused_branch(bb, i, stmt_liveness)
+            if fused and not locations.reg_of(stmt.dst):
+                fused = None
+
+            dst_local = il.defed_var(stmt)
+            src_locals = il.used_vars(stmt)
+            b_local = src_locals[0] if src_locals else None
+            c_local = src_locals[1] if len(src_locals) > 1 else None
+            if type(stmt) == il.BinaryStmt and stmt.op in self.commutative_ops \
+                    and dst_local and locations.reg_of(dst_local) == locations.reg_of(c_local):
+                b_local, c_local = c_local, b_local  # the result can be computed in place
+                # lowerings expect srcA in dst_reg and srcB in c_reg
+                stmt = il.BinaryStmt(stmt.dst, stmt.op, stmt.srcB, stmt.srcA, coord=stmt.coord)
+
+            # pick the register the statement computes in. it holds the first operand on entry.
+            dst_reg = locations.reg_of(dst_local) if dst_local else None
+            if dst_local is None:
+                dst_reg = locations.reg_of(b_local) if b_local else None  # the operand is only read
+                if b_local and not dst_reg:
+                    dst_reg = locations.getreg(None, None, [])
+                    self.load_reg_from_loc(dst_reg, locations.get_loc(b_local))
+            else:
+                # the other operands must not be clobbered while the first is copied into dst
+                if dst_reg is None or any(var is not b_local and locations.reg_of(var) == dst_reg
+                                          for var in src_locals):
+                    dst_reg = locations.getreg(None, None, [])
+                else:
+                    locations.take(dst_reg)
+                if b_local and locations.reg_of(b_local) != dst_reg:
+                    self.load_reg_from_loc(dst_reg, locations.get_loc(b_local))
+
+            c_reg = locations.reg_of(c_local) if c_local else None
+            if c_local and (c_reg is None or c_reg == dst_reg):
+                c_reg = locations.getreg(None, None, [dst_reg])
+                self.load_reg_from_loc(c_reg, locations.get_loc(c_local))
+
+            self.emit_comment('    dst = %s, operand = %s' % (dst_reg, c_reg if c_reg else 'None'))
+
+            if fused:
+                self.lower_compare_branch(stmt, fused, func, dst_reg, c_reg)
+            else:
+                lower = self.stmt_lowering.get(type(stmt))
+                if lower is None:
+                    raise UnsupportedFeatureError('unsupported statement ' + str(stmt))
+                lower(self, stmt, func, locations, stmt_liveness.live_out(bb, i), dst_reg, c_reg)
+            if stmt in self._tail_jumps:
+                returned = True
+                locations.end_statement()
+                continue
+
+            # move the result home
+            if dst_local and not fused:
+                home = locations.get_loc(dst_local)
+                if type(home) == RegisterLocation:
+                    if home.reg != dst_reg:
+                        self.cl_move(home.reg, dst_reg)
+                elif type(home) == StackLocation:
+                    self.vl_store_local(dst_reg, home.bp_offset)
+                else:
+                    self.cl_store_global(dst_reg, self.mangle_globalname(self._global_vars[dst_local]),
+                                         lambda: locations.getreg(None, None, [dst_reg, c_reg]))
+
+            locations.end_statement()
+            self.emit_newline()
+
+    @staticmethod
+    def dump_liveness(fd, func, blocks, liveness):
+        """
+        Writes the cfg as a dot graph, annotated with each block's live-in and live-out sets.
+        """
+        def liveness_set_to_str(live):
+            return '(' + ', '.join(map(lambda v: v.name, live)) + ')'
+
+        print >> fd, "digraph \"%s\" {" % (func.name,)
         for bb in blocks:
-            stmt_liveness = [set() for _ in range(len(bb.stmts))]
-            stmt_liveness[-1].update(liveness.live_out(bb))
-            for i in range(len(bb.stmts) - 1, 0, -1):
-                stmt = bb.stmts[i]
-                stmt_liveness[i - 1].update(stmt_liveness[i])
-                stmt_liveness[i - 1].discard(il.defed_var(stmt))
-                stmt_liveness[i - 1].update(il.used_vars(stmt))
-                if type(stmt) == il.ReturnStmt:
-                    stmt_liveness[i - 1].add(func.retval)
             label = "== Block %s ==" % bb.name + '\\l'
             label += 'LIVE IN: ' + liveness_set_to_str(liveness.live_in(bb)) + '\\l'
-            for i in range(len(bb.stmts)):
-                label += str(bb.stmts[i]) + '\\l'
-                # label += '    ' + liveness_set_to_str(stmt_liveness[i]) + '\\l'
+            for stmt in bb.stmts:
+                label += str(stmt).replace('"', '\\"') + '\\l'
             label += 'LIVE OUT: ' + liveness_set_to_str(liveness.live_out(bb)) + '\\l'
             print >> fd, "    %s [shape=box, label=\"%s\"]" % (bb.name, label)
         for bb in func.cfg.basic_blocks:
-            for edge in func.cfg.get_edges(bb):
-                print >> fd, "%s -> %s;" % (edge.src, edge.dst)
+            for succ in func.cfg.successors(bb):
+                print >> fd, "%s -> %s;" % (bb, succ)
         print >> fd, "}\n"
-        fd.close()
-
-        for bb in cfg.topoorder(func.cfg):
-            self.emit_basic_block(bb, func, liveness, reg_alloc)
 
-        self.place_relocation(self.name_return_block(func))
-        self.emit_func_epilogue()
+    def load_reg_from_loc(self, dst_reg, src_loc):
+        if tracer.active:
+            tracer.debug('loading %s from %s', dst_reg, src_loc)
+        if type(src_loc) == StackLocation:
+            self.vl_load_local(dst_reg, src_loc.bp_offset)
+        elif type(src_loc) == RegisterLocation:
+            if dst_reg != src_loc.reg:
+                self.cl_move(dst_reg, src_loc.reg)
+        elif type(src_loc) == MemoryLocation:
+            self.cl_load_global(dst_reg, src_loc.name)
+        else:
+            assert False
 
-    def emit_basic_block(self, bb, func, liveness, reg_alloc):
-        print '\nemitting ' + str(bb)
+    def emit_basic_block(self, bb, func, stmt_liveness, reg_alloc):
+        if tracer.active:
+            tracer.info('\nemitting %s', bb)
         # place this block's label
         self.place_relocation(self.name_basic_block(func, bb))
 
         def liveness_set_to_str(live):
             return '(' + ', '.join(map(lambda v: v.name, live)) + ')'
 
-        # statement-level live-out sets
-        stmt_liveness = [set() for _ in range(len(bb.stmts))]
-        stmt_liveness[-1].update(liveness.live_out(bb))
-        for i in range(len(bb.stmts) - 1, 0, -1):
-            stmt = bb.stmts[i]
-            stmt_liveness[i - 1].update(stmt_liveness[i])
-            stmt_liveness[i - 1].discard(il.defed_var(stmt))
-            stmt_liveness[i - 1].update(il.used_vars(stmt))
-            if type(stmt) == il.ReturnStmt:
-                stmt_liveness[i - 1].add(func.retval)
-
-        def load_reg_from_loc(dst_reg, src_loc):
-            print 'loading %s from %s' % (dst_reg, src_loc)
-            if type(src_loc) == StackLocation:
-                self.vl_load_local(dst_reg, src_loc.bp_offset)
-            elif type(src_loc) == RegisterLocation:
-                if dst_reg != src_loc.reg:
-                    self.cl_move(dst_reg, src_loc.reg)
-            elif type(src_loc) == MemoryLocation:
-                self.reloc_load_address(dst_reg, src_loc.name)
-                self.emit_insn('LDR %s, %s, #0' % (dst_reg, dst_reg))
-            else:
-                assert False
-
+        fused = None
         for i, stmt in enumerate(bb.stmts):
-            live_out = stmt_liveness[i]
-            print '\nSCHEDULING ' + str(stmt)
-            print 'Live out: ' + liveness_set_to_str(live_out)
+            if stmt is fused:
+                continue  # lowered along with the comparison it tests
+            self.check_literal_pool()
+            fused = self.fused_branch(bb, i, stmt_liveness)
+            live_out = stmt_liveness.live_out(bb, i + 1 if fused else i)
+            if tracer.active:
+                tracer.debug('\nSCHEDULING %s', stmt)
+                tracer.debug('Live out: %s', liveness_set_to_str(live_out))
+            if alloc_tracer.active:
+                alloc_tracer.event('stmt', '%(stmt)s', block=bb.name, index=i, stmt=str(stmt),
+                                   live_out=sorted(var.name for var in live_out))
             self.emit_comment(str(stmt))
 
             # Register scheduling
@@ -734,9 +1555,9 @@ class LC3(object):
                     b_local = src_locals[0]
                     dst_reg = reg_alloc.getreg(live_out, b_local, [])
                     b_loc = reg_alloc.get_loc(b_local)
-                    load_reg_from_loc(dst_reg, b_loc)
+                    self.load_reg_from_loc(dst_reg, b_loc)
                     if b_local not in live_out:
-                        reg_alloc.free_local(b_local, free_stack=b_local not in func.locals)
+                        reg_alloc.free_local(b_local, free_stack=b_local not in self._frame_locals)
                 else:
                     dst_reg = reg_alloc.getreg(live_out, None, [])
                 if dst_local in live_out:
@@ -748,203 +1569,34 @@ class LC3(object):
                 c_local = src_locals[1]
                 c_loc = reg_alloc.get_loc(c_local)
                 c_reg = reg_alloc.getreg(live_out, None, [dst_reg])
-                load_reg_from_loc(c_reg, c_loc)
+                self.load_reg_from_loc(c_reg, c_loc)
                 if c_local in live_out:
                     reg_alloc.store_reg(RegisterLocation(c_reg), c_local)
                 else:
-                    reg_alloc.free_local(c_local, free_stack=c_local not in func.locals)
+                    reg_alloc.free_local(c_local, free_stack=c_local not in self._frame_locals)
             else:
                 c_reg = None
 
-            print 'dst = %s, operand = %s' % (dst_reg, c_reg if c_reg else 'None')
+            if tracer.active:
+                tracer.debug('dst = %s, operand = %s', dst_reg, c_reg if c_reg else 'None')
             self.emit_comment('    dst = %s, operand = %s' % (dst_reg, c_reg if c_reg else 'None'))
 
-            typ = type(stmt)
-            if typ == il.BinaryStmt:
-                dst_local = reg_alloc
-                if stmt.op == il.BinaryOp.Add:
-                    self.emit_insn("add %s, %s, %s" % (dst_reg, dst_reg, c_reg))
-                elif stmt.op == il.BinaryOp.Sub:
-                    self.cl_sub(dst_reg, c_reg)
-                elif stmt.op == il.BinaryOp.And:
-                    self.emit_insn("AND %s, %s, %s" % (dst_reg, dst_reg, c_reg))
-                elif stmt.op == il.BinaryOp.Or:
-                    self.cl_or(dst_reg, c_reg)
-                elif stmt.op == il.BinaryOp.Xor:
-                    tmp_reg = reg_alloc.getreg(live_out, None, [dst_reg, c_reg])
-                    self.cl_or(dst_reg, c_reg)
-                    self.cl_nand(tmp_reg, dst_reg, c_reg)
-                    self.emit_insn("AND %s, %s, %s" % (dst_reg, dst_reg, tmp_reg))
-                elif stmt.op == il.BinaryOp.Lt:
-                    if il.Types.is_unsigned(stmt.srcA.type):
-                        self.cl_lt_unsigned(dst_reg, c_reg)
-                    else:
-                        self.cl_lt_signed(dst_reg, c_reg)
-                elif stmt.op == il.BinaryOp.Gt:
-                    tmp_reg = reg_alloc.getreg(live_out, None, [dst_reg, c_reg])
-                    print 'tmpreg = ' + tmp_reg
-                    self.cl_move(tmp_reg, dst_reg)
-                    if il.Types.is_unsigned(stmt.srcA.type):
-                        self.cl_lt_unsigned(dst_reg, c_reg)
-                    else:
-                        self.cl_lt_signed(dst_reg, c_reg)
-                    self.cl_logical_not(dst_reg)
-                    self.cl_sub(tmp_reg, c_reg)
-                    self.cl_test(tmp_reg)
-                    self.emit_insn('BRnp #1')
-                    self.cl_zero_reg(dst_reg)
-                elif stmt.op == il.BinaryOp.LogicalAnd:
-                    self.cl_test(dst_reg)
-                    self.emit_insn('BRz #5')  # branch to FALSE
-                    self.cl_test(c_reg)
-                    self.emit_insn('BRz #3')
-                    self.cl_zero_reg(dst_reg)  # TRUE
-                    self.emit_insn('ADD %s, %s, #1' % (dst_reg, dst_reg))
-                    self.emit_insn('BR #1')
-                    self.cl_zero_reg(dst_reg)  # FALSE
-                elif stmt.op == il.BinaryOp.LogicalOr:
-                    self.cl_test(dst_reg)
-                    self.emit_insn('BRnp #2')  # branch to TRUE
-                    self.cl_test(c_reg)
-                    self.emit_insn('BRz #3')  # branch to FALSE
-                    self.cl_zero_reg(dst_reg)  # TRUE
-                    self.emit_insn('ADD %s, %s, #1' % (dst_reg, dst_reg))
-                    self.emit_insn('BR #1')
-                    self.cl_zero_reg(dst_reg)  # FALSE
-                elif stmt.op == il.BinaryOp.Equ:
-                    self.cl_eq(dst_reg, c_reg)
-                elif stmt.op == il.BinaryOp.Neq:
-                    self.cl_eq(dst_reg, c_reg)
-                    self.cl_logical_not(dst_reg)
-                elif stmt.op == il.BinaryOp.Mul:
-                    tmp_mask = reg_alloc.getreg(live_out, None, [dst_reg, c_reg])
-                    tmp_multiplicand = reg_alloc.getreg(live_out, None, [dst_reg, c_reg, tmp_mask])
-                    self.cl_move(tmp_multiplicand, dst_reg)
-                    self.cl_zero_reg(dst_reg)
-                    self.cl_push(c_reg) # save operand value
-                    self.cl_zero_reg(tmp_mask)
-                    self.emit_insn('ADD %s, %s, #1' % (tmp_mask, tmp_mask))
-
-                    for bit in range(0,16):
-                        self.cl_push(tmp_mask) # save mask value
-                        self.emit_insn('AND %s, %s, %s' % (tmp_mask, tmp_mask, tmp_multiplicand))
-                        self.cl_twos(tmp_mask)
-                        self.emit_insn('AND %s, %s, %s' % (tmp_mask, tmp_mask, c_reg)) # mask addend if 0
-                        self.emit_insn('ADD %s, %s, %s' % (dst_reg, dst_reg, tmp_mask)) # add
-                        self.cl_pop(tmp_mask) # restore mask
-
-                        # shift left
-                        self.emit_insn('ADD %s, %s, %s' % (tmp_mask, tmp_mask, tmp_mask))
-                        self.emit_insn('ADD %s, %s, %s' % (c_reg, c_reg, c_reg))
-
-                    self.cl_pop(c_reg)
-                else:
-                    raise UnsupportedFeatureError('unsupported binary operation ' + str(stmt.op))
-            elif typ == il.UnaryStmt:
-                if stmt.op == il.UnaryOp.Identity:  # this is a MOVE!!!!!
-                    if dst_local in live_out and stmt.src not in func.locals:
-                        reg_alloc.store_reg(RegisterLocation(dst_reg), stmt.src)  # THIS MOVE HAS SPECIAL SEMANTIC
-                elif stmt.op == il.UnaryOp.Minus:
-                    self.cl_twos(dst_reg)
-                elif stmt.op == il.UnaryOp.Negate:
-                    self.cl_ones(dst_reg)
-                elif stmt.op == il.UnaryOp.LogicalNot:
-                    self.cl_test(dst_reg)
-                    self.emit_insn('BRnp #3')
-                    self.emit_insn('AND %s, %s, #0' % (dst_reg, dst_reg))
-                    self.emit_insn('ADD %s, %s, #1' % (dst_reg, dst_reg))
-                    self.emit_insn('BRnzp #1')
-                    self.emit_insn('AND %s, %s, #0' % (dst_reg, dst_reg))
-                else:
-                    raise UnsupportedFeatureError('unsupported unary operation ' + str(stmt.op))
-            elif typ == il.ConstantStmt:
-                if stmt.imm.value.type == il.CompiledValueType.Integer:
-                    self.cl_load_reg(dst_reg, stmt.imm.value.value)
-                elif stmt.imm.value.type == il.CompiledValueType.Pointer:
-                    self.emit_insn('LD %s, #1' % (dst_reg,))
-                    self.emit_insn('BR #1')
-                    self.reloc_dump_address(stmt.imm.value.value)
-                else:
-                    raise RuntimeError('unsupported compiled constant type')
-
-            elif typ == il.ReturnStmt:
-                retvar_loc = reg_alloc.get_loc(func.retval)
-                load_reg_from_loc(self.retval_reg, retvar_loc)
-                tmp_reg = reg_alloc.getreg(live_out, None, [self.retval_reg])
-                self.emit_insn('LD %s, #1' % (tmp_reg,))
-                self.emit_insn('JMP %s' % (tmp_reg,))
-                self.reloc_dump_address(self.name_return_block(func))
-                reg_alloc.free_local(func.retval)
-            elif typ == il.GotoStmt:
-                tmp_reg = reg_alloc.getreg(live_out, None, [])
-                self.emit_insn('LD %s, #1' % (tmp_reg,))
-                self.emit_insn('JMP %s' % (tmp_reg,))
-                dst_label = self.name_basic_block(func, stmt.dst_block)
-                self.reloc_dump_address(dst_label)
-            elif typ == il.CondJumpStmt:
-                if stmt.imm.value.value != 0:
-                    raise RuntimeError('unsupported (nonzero) comparison constant ' + str(stmt.imm.value.value))
-
-                # set cc flags
-                self.cl_test(dst_reg)
-
-                # load destination pc-relative after the two jumps
-                # layout:
-                # CMP
-                # BR #3
-                # LD tmp, #1
-                # JMP false
-                # false_addr
-                # LD tmp, #1
-                # JMP true
-                # true_addr
-                tmp_reg = reg_alloc.getreg(live_out, None, [dst_reg])
-
-                # true branch insn
-                if stmt.op == il.ComparisonOp.Equ:
-                    self.emit_insn('BRz #3')
-                elif stmt.op == il.ComparisonOp.Neq:
-                    self.emit_insn('BRnp #3')
-                else:
-                    raise UnsupportedFeatureError('unsupported comparison operator ' + str(stmt.op))
-
-                # false branch load and jump
-                self.emit_insn('LD %s, #1' % (tmp_reg,))
-                self.emit_insn('JMP %s' % (tmp_reg,))
-                false_label = self.name_basic_block(func, stmt.false_block)
-                self.reloc_dump_address(false_label)
-
-                # true branch load and jump
-                self.emit_insn('LD %s, #1' % (tmp_reg,))
-                self.emit_insn('JMP %s' % (tmp_reg,))
-                true_label = self.name_basic_block(func, stmt.true_block)
-                self.reloc_dump_address(true_label)
-            elif typ == il.CastStmt:
-                from_type = stmt.src.type
-                to_type = stmt.dst.type
-                if ABI.sizeof(from_type) == ABI.sizeof(to_type):
-                    pass
-                else:
-                    raise UnsupportedFeatureError('unsupported cast %s to %s' % (from_type, to_type))
-            elif typ == il.DerefReadStmt:
-                self.emit_insn('LDR %s, %s, #0' % (dst_reg, dst_reg))
-            elif typ == il.DerefWriteStmt:
-                self.emit_insn('STR %s, %s, #0' % (c_reg, dst_reg))
-            elif typ == il.CommentStmt:
-                pass
-            elif typ == il.ParamStmt:
-                self.cl_push(dst_reg)
-            elif typ == il.CallStmt:
-                self.emit_insn('JSRR %s' % (dst_reg,))
-                self.cl_pop(dst_reg)
-                # pop args
-                for i in range(stmt.nargs):
-                    self.emit_insn('add %s, %s, #1' % (self.sp, self.sp))
+            if fused:
+                self.lower_compare_branch(stmt, fused, func, dst_reg, c_reg)
             else:
-                raise UnsupportedFeatureError('unsupported statement ' + str(stmt))
-
-            if dst_local in func.locals and dst_local in live_out:
-                print 'spilling %s back to stack' % (str(dst_local),)
+                lower = self.stmt_lowering.get(type(stmt))
+                if lower is None:
+                    raise UnsupportedFeatureError('unsupported statement ' + str(stmt))
+                lower(self, stmt, func, reg_alloc, live_out, dst_reg, c_reg)
+            if stmt in self._tail_jumps:
+                break  # the callee returns in place of the rest of the block
+
+            if dst_local:
+                reg_alloc.invalidate_copies(dst_local, dst_reg)
+
+            if dst_local in self._frame_locals and dst_local in live_out:
+                if tracer.active:
+                    tracer.debug('spilling %s back to stack', dst_local)
                 reg_alloc.free_local_reg(dst_local, dst_reg)
                 self.vl_store_local(dst_reg, reg_alloc.get_loc(dst_local).bp_offset)
 
@@ -952,45 +1604,817 @@ class LC3(object):
                 reg_alloc.free_local(c_local)
 
             if dst_local in self._global_vars:
-                print 'writing %s back to global' % (str(dst_local),)
+                if tracer.active:
+                    tracer.debug('writing %s back to global', dst_local)
                 tmp_reg = reg_alloc.getreg(live_out, None, [dst_reg, c_reg])
                 reg_alloc.free_local(dst_local)
-                self.emit_insn('LD %s, #2' % (tmp_reg,))
-                self.emit_insn('STR %s, %s, #0' % (dst_reg, tmp_reg))
-                self.emit_insn('BR #1')
-                self.reloc_dump_address(self.mangle_globalname(self._global_vars[dst_local]))
+                self.cl_store_global(dst_reg, self.mangle_globalname(self._global_vars[dst_local]),
+                                     lambda: tmp_reg)
             self.emit_newline()
 
+    # --- statement lowering ---
+    # every lowering takes (stmt, func, reg_alloc, live_out, dst_reg, c_reg). dst_reg holds the first
+    # operand on entry and the result on exit, c_reg holds the second operand if there is one.
+
+    def lower_binary(self, stmt, func, reg_alloc, live_out, dst_reg, c_reg):
+        lower = self.binary_op_lowering.get(stmt.op)
+        if lower is None:
+            raise UnsupportedFeatureError('unsupported binary operation ' + str(stmt.op))
+        lower(self, stmt, reg_alloc, live_out, dst_reg, c_reg)
+
+    def lower_add(self, stmt, reg_alloc, live_out, dst_reg, c_reg):
+        self.emit_insn("add %s, %s, %s" % (dst_reg, dst_reg, c_reg))
+
+    def lower_sub(self, stmt, reg_alloc, live_out, dst_reg, c_reg):
+        self.cl_sub(dst_reg, c_reg)
+
+    def lower_and(self, stmt, reg_alloc, live_out, dst_reg, c_reg):
+        self.emit_insn("AND %s, %s, %s" % (dst_reg, dst_reg, c_reg))
+
+    def lower_or(self, stmt, reg_alloc, live_out, dst_reg, c_reg):
+        self.cl_or(dst_reg, c_reg)
+
+    def lower_xor(self, stmt, reg_alloc, live_out, dst_reg, c_reg):
+        tmp_reg = reg_alloc.getreg(live_out, None, [dst_reg, c_reg])
+        self.cl_or(dst_reg, c_reg)
+        self.cl_nand(tmp_reg, dst_reg, c_reg)
+        self.emit_insn("AND %s, %s, %s" % (dst_reg, dst_reg, tmp_reg))
+
+    def lower_lt(self, stmt, reg_alloc, live_out, dst_reg, c_reg):
+        if il.Types.is_unsigned(stmt.srcA.type):
+            self.cl_lt_unsigned(dst_reg, c_reg)
+        else:
+            self.cl_lt_signed(dst_reg, c_reg)
+
+    def lower_gt(self, stmt, reg_alloc, live_out, dst_reg, c_reg):
+        tmp_reg = reg_alloc.getreg(live_out, None, [dst_reg, c_reg])
+        if tracer.active:
+            tracer.debug('tmpreg = %s', tmp_reg)
+        self.cl_move(tmp_reg, dst_reg)
+        if il.Types.is_unsigned(stmt.srcA.type):
+            self.cl_lt_unsigned(dst_reg, c_reg)
+        else:
+            self.cl_lt_signed(dst_reg, c_reg)
+        self.cl_logical_not(dst_reg)
+        self.cl_sub(tmp_reg, c_reg)
+        self.cl_test(tmp_reg)
+        self.emit_insn('BRnp #1')
+        self.cl_zero_reg(dst_reg)
+
+    def lower_leq(self, stmt, reg_alloc, live_out, dst_reg, c_reg):
+        self.lower_gt(stmt, reg_alloc, live_out, dst_reg, c_reg)
+        self.cl_logical_not(dst_reg)
+
+    def lower_geq(self, stmt, reg_alloc, live_out, dst_reg, c_reg):
+        self.lower_lt(stmt, reg_alloc, live_out, dst_reg, c_reg)
+        self.cl_logical_not(dst_reg)
+
+    def lower_logical_and(self, stmt, reg_alloc, live_out, dst_reg, c_reg):
+        self.cl_test(dst_reg)
+        self.emit_insn('BRz #5')  # branch to FALSE
+        self.cl_test(c_reg)
+        self.emit_insn('BRz #3')
+        self.cl_zero_reg(dst_reg)  # TRUE
+        self.emit_insn('ADD %s, %s, #1' % (dst_reg, dst_reg))
+        self.emit_insn('BR #1')
+        self.cl_zero_reg(dst_reg)  # FALSE
+
+    def lower_logical_or(self, stmt, reg_alloc, live_out, dst_reg, c_reg):
+        self.cl_test(dst_reg)
+        self.emit_insn('BRnp #2')  # branch to TRUE
+        self.cl_test(c_reg)
+        self.emit_insn('BRz #3')  # branch to FALSE
+        self.cl_zero_reg(dst_reg)  # TRUE
+        self.emit_insn('ADD %s, %s, #1' % (dst_reg, dst_reg))
+        self.emit_insn('BR #1')
+        self.cl_zero_reg(dst_reg)  # FALSE
+
+    def lower_equ(self, stmt, reg_alloc, live_out, dst_reg, c_reg):
+        self.cl_eq(dst_reg, c_reg)
+
+    def lower_neq(self, stmt, reg_alloc, live_out, dst_reg, c_reg):
+        self.cl_eq(dst_reg, c_reg)
+        self.cl_logical_not(dst_reg)
+
+    def lower_mul(self, stmt, reg_alloc, live_out, dst_reg, c_reg):
+        a = self._constants.get(stmt.srcA)
+        b = self._constants.get(stmt.srcB)
+        if a is not None and b is not None:
+            self.cl_load_reg(dst_reg, to_word(a * b))
+        elif b is not None:
+            self.cl_mul_const(dst_reg, dst_reg, b, lambda: reg_alloc.getreg(live_out, None, [dst_reg, c_reg]))
+        elif a is not None:
+            self.cl_mul_const(dst_reg, c_reg, a, None)
+        else:
+            tmp_multiplicand = reg_alloc.getreg(live_out, None, [dst_reg, c_reg])
+            tmp_mask = reg_alloc.getreg(live_out, None, [dst_reg, c_reg, tmp_multiplicand])
+            self.cl_push(c_reg)  # save operand value
+            self.emit_verbatim(self.cl_mul, dst_reg, c_reg, tmp_multiplicand, tmp_mask)
+            self.cl_pop(c_reg)
+
+    def cl_mul_const(self, dst_reg, src_reg, value, get_tmp):
+        """
+        dst = src * value, by shifts and adds over the binary or canonical signed-digit form of value,
+        whichever is shorter.
+        :param get_tmp: returns a scratch register, needed if src_reg is dst_reg
+        """
+        self.emit_comment('mul %s, %s, %d' % (dst_reg, src_reg, value))
+        negate = value < 0
+        value = abs(value)
+        if value == 0:
+            self.cl_zero_reg(dst_reg)
+            return
+        digits = min(binary_digits(value), csd_digits(value), key=shift_add_cost)
+
+        operand = src_reg
+        if src_reg != dst_reg:
+            self.cl_move(dst_reg, src_reg)
+        elif any(digits[:-1]):
+            operand = get_tmp()
+            self.cl_move(operand, src_reg)
+        # Horner's rule from the most significant digit, which is always 1
+        for digit in reversed(digits[:-1]):
+            self.emit_insn('ADD %s, %s, %s' % (dst_reg, dst_reg, dst_reg))
+            if digit == 1:
+                self.emit_insn('ADD %s, %s, %s' % (dst_reg, dst_reg, operand))
+            elif digit == -1:
+                # dst - x = ~(~dst + x)
+                self.cl_ones(dst_reg)
+                self.emit_insn('ADD %s, %s, %s' % (dst_reg, dst_reg, operand))
+                self.cl_ones(dst_reg)
+        if negate:
+            self.cl_twos(dst_reg)
+
+    def cl_mul(self, dst_reg, src_reg, tmp_multiplicand, tmp_mask):
+        """
+        dst = dst * src, going over the bits of src from the top and skipping its leading zeros.
+        src is shifted away. tmp_mask counts the 16 bits.
+        """
+        self.cl_move(tmp_multiplicand, dst_reg)
+        self.cl_zero_reg(dst_reg)
+        self.cl_zero_reg(tmp_mask)
+        self.emit_insn('ADD %s, %s, #1' % (tmp_mask, tmp_mask))
+        self.cl_test(src_reg)
+        self.emit_insn('BRz #11')  # to the end, the product is 0
+        # skip the leading zeros of src
+        self.emit_insn('BRn #3')
+        self.emit_insn('ADD %s, %s, %s' % (tmp_mask, tmp_mask, tmp_mask))
+        self.emit_insn('ADD %s, %s, %s' % (src_reg, src_reg, src_reg))
+        self.emit_insn('BRnzp #-4')
+        # dst = dst * 2 + (top bit of src) * multiplicand
+        self.emit_insn('ADD %s, %s, %s' % (dst_reg, dst_reg, dst_reg))
+        self.cl_test(src_reg)
+        self.emit_insn('BRzp #1')
+        self.emit_insn('ADD %s, %s, %s' % (dst_reg, dst_reg, tmp_multiplicand))
+        self.emit_insn('ADD %s, %s, %s' % (src_reg, src_reg, src_reg))
+        self.emit_insn('ADD %s, %s, %s' % (tmp_mask, tmp_mask, tmp_mask))
+        self.emit_insn('BRnp #-7')
+
+    runtime_ops = frozenset([il.BinaryOp.Div, il.BinaryOp.Rem, il.BinaryOp.Shl, il.BinaryOp.Shr])
+
+    @staticmethod
+    def constant_operand(stmt, constants):
+        """
+        :return: the value of the second operand of stmt if it is a constant, read as unsigned if stmt is
+        """
+        value = constants.get(stmt.srcB)
+        if value is not None and il.Types.is_unsigned(stmt.dst.type):
+            value &= 0xffff
+        return value
+
+    @classmethod
+    def runtime_routine(cls, stmt, constants):
+        """
+        :return: name of the runtime routine stmt is lowered to a call of, or None if it is done inline
+        """
+        if type(stmt) != il.BinaryStmt or stmt.op not in cls.runtime_ops:
+            return None
+        unsigned = il.Types.is_unsigned(stmt.dst.type)
+        value = cls.constant_operand(stmt, constants)
+        if stmt.op in (il.BinaryOp.Div, il.BinaryOp.Rem):
+            shift = log2(value) if value is not None else None
+            if shift is None:
+                return '__gwcc_udivmod' if unsigned else '__gwcc_divmod'
+            if stmt.op == il.BinaryOp.Rem:
+                return None
+            value = shift
+        elif stmt.op == il.BinaryOp.Shl:
+            return None if value is not None else '__gwcc_shl'
+        if value is not None and (value <= 0 or 16 - value <= INLINE_SHIFT_BITS):
+            return None
+        return '__gwcc_shr' if unsigned else '__gwcc_sar'
+
+    def lower_div(self, stmt, reg_alloc, live_out, dst_reg, c_reg):
+        routine = self.runtime_routine(stmt, self._constants)
+        if routine in ('__gwcc_udivmod', '__gwcc_divmod'):
+            self.cl_call_runtime(routine, dst_reg, c_reg, 'r0')
+            return
+        # by a power of two
+        shift = log2(self.constant_operand(stmt, self._constants))
+        signed = not il.Types.is_unsigned(stmt.dst.type)
+        get_tmp = lambda: reg_alloc.getreg(live_out, None, [dst_reg, c_reg])
+        if signed and shift:
+            # shifting rounds down, so negative dividends get biased to round toward zero
+            bias = (1 << shift) - 1
+            if IMM5.holds(bias):
+                self.cl_test(dst_reg)
+                self.emit_insn('BRzp #1')
+                self.emit_insn('ADD %s, %s, #%d' % (dst_reg, dst_reg, bias))
+            else:
+                tmp_reg = get_tmp()
+                self.cl_load_reg(tmp_reg, bias)
+                self.cl_test(dst_reg)
+                self.emit_insn('BRzp #1')
+                self.emit_insn('ADD %s, %s, %s' % (dst_reg, dst_reg, tmp_reg))
+        if routine:
+            self.cl_call_runtime(routine, dst_reg, shift, 'r0')
+        elif shift:
+            self.cl_shr_const(dst_reg, shift, signed, get_tmp())
+
+    def lower_rem(self, stmt, reg_alloc, live_out, dst_reg, c_reg):
+        routine = self.runtime_routine(stmt, self._constants)
+        if routine:
+            self.cl_call_runtime(routine, dst_reg, c_reg, 'r1')
+            return
+        # by a power of two
+        mask = self.constant_operand(stmt, self._constants) - 1
+        if IMM5.holds(mask):
+            mask_operand = '#%d' % (mask,)
+        else:
+            mask_operand = reg_alloc.getreg(live_out, None, [dst_reg, c_reg])
+            self.cl_load_reg(mask_operand, mask)
+        if il.Types.is_unsigned(stmt.dst.type):
+            self.emit_insn('AND %s, %s, %s' % (dst_reg, dst_reg, mask_operand))
+            return
+        # the remainder has the sign of the dividend: x % n = -(-x % n) for negative x
+        self.cl_test(dst_reg)
+        self.emit_insn('BRn #2')
+        self.emit_insn('AND %s, %s, %s' % (dst_reg, dst_reg, mask_operand))
+        self.emit_insn('BR #5')
+        self.cl_twos(dst_reg)
+        self.emit_insn('AND %s, %s, %s' % (dst_reg, dst_reg, mask_operand))
+        self.cl_twos(dst_reg)
+
+    def lower_shl(self, stmt, reg_alloc, live_out, dst_reg, c_reg):
+        routine = self.runtime_routine(stmt, self._constants)
+        if routine:
+            self.cl_call_runtime(routine, dst_reg, c_reg, 'r0')
+            return
+        shift = self.constant_operand(stmt, self._constants)
+        if shift >= 16:
+            self.cl_zero_reg(dst_reg)
+            return
+        for _ in range(max(0, shift)):
+            self.emit_insn('ADD %s, %s, %s' % (dst_reg, dst_reg, dst_reg))
+
+    def lower_shr(self, stmt, reg_alloc, live_out, dst_reg, c_reg):
+        routine = self.runtime_routine(stmt, self._constants)
+        shift = self.constant_operand(stmt, self._constants)
+        if routine:
+            self.cl_call_runtime(routine, dst_reg, c_reg if shift is None else shift, 'r0')
+        elif shift > 0:
+            self.cl_shr_const(dst_reg, shift, not il.Types.is_unsigned(stmt.dst.type),
+                              reg_alloc.getreg(live_out, None, [dst_reg, c_reg]))
+
+    def cl_shr_const(self, dst_reg, shift, signed, tmp_reg):
+        """
+        dst = dst >> shift, by copying the bits that are kept into tmp one at a time from the top
+        """
+        self.emit_comment('shr %s, %d' % (dst_reg, shift))
+        self.cl_zero_reg(tmp_reg)
+        if signed:
+            self.cl_test(dst_reg)
+            self.emit_insn('BRzp #1')
+            self.emit_insn('ADD %s, %s, #-1' % (tmp_reg, tmp_reg))
+        bits = 16 - shift
+        if bits > 0:
+            self.emit_insn('ADD %s, %s, %s' % (tmp_reg, tmp_reg, tmp_reg))
+            self.cl_test(dst_reg)
+        for i in range(bits):
+            # the condition codes hold the top bit of what is left of dst
+            self.emit_insn('BRzp #1')
+            self.emit_insn('ADD %s, %s, #1' % (tmp_reg, tmp_reg))
+            if i < bits - 1:
+                self.emit_insn('ADD %s, %s, %s' % (tmp_reg, tmp_reg, tmp_reg))
+                self.emit_insn('ADD %s, %s, %s' % (dst_reg, dst_reg, dst_reg))
+        self.cl_move(dst_reg, tmp_reg)
+
+    def cl_call_runtime(self, routine, dst_reg, operand, result_reg):
+        """
+        dst = result_reg after calling routine with dst in r0 and operand in r1. operand is a register or
+        a constant. Only r0, r1 and r7 need saving around the call.
+        """
+        self.emit_comment('call %s' % (routine,))
+        saved = [reg for reg in ('r0', 'r1', self.rp) if reg != dst_reg]
+        self.emit_insn('ADD %s, %s, #-%d' % (self.sp, self.sp, len(saved)))
+        for i, reg in enumerate(saved):
+            self.emit_insn('STR %s, %s, #%d' % (reg, self.sp, i))
+        if operand == 'r0' and dst_reg == 'r1':
+            self.cl_move(self.rp, 'r0')
+            self.cl_move('r0', 'r1')
+            self.cl_move('r1', self.rp)
+        elif operand == 'r0':
+            self.cl_move('r1', 'r0')
+            if dst_reg != 'r0':
+                self.cl_move('r0', dst_reg)
+        else:
+            if dst_reg != 'r0':
+                self.cl_move('r0', dst_reg)
+            if type(operand) == int:
+                self.cl_load_reg('r1', operand)
+            elif operand != 'r1':
+                self.cl_move('r1', operand)
+        self.reloc_load_address(self.rp, routine)
+        self.emit_insn('JSRR %s' % (self.rp,))
+        if dst_reg != result_reg:
+            self.cl_move(dst_reg, result_reg)
+        for i, reg in enumerate(saved):
+            self.emit_insn('LDR %s, %s, #%d' % (reg, self.sp, i))
+        self.emit_insn('ADD %s, %s, #%d' % (self.sp, self.sp, len(saved)))
+
+    commutative_ops = frozenset([il.BinaryOp.Add, il.BinaryOp.And, il.BinaryOp.Or, il.BinaryOp.Xor,
+                                 il.BinaryOp.Equ, il.BinaryOp.Neq, il.BinaryOp.Mul])
+
+    binary_op_lowering = {
+        il.BinaryOp.Add: lower_add,
+        il.BinaryOp.Sub: lower_sub,
+        il.BinaryOp.And: lower_and,
+        il.BinaryOp.Or: lower_or,
+        il.BinaryOp.Xor: lower_xor,
+        il.BinaryOp.Lt: lower_lt,
+        il.BinaryOp.Gt: lower_gt,
+        il.BinaryOp.Leq: lower_leq,
+        il.BinaryOp.Geq: lower_geq,
+        il.BinaryOp.LogicalAnd: lower_logical_and,
+        il.BinaryOp.LogicalOr: lower_logical_or,
+        il.BinaryOp.Equ: lower_equ,
+        il.BinaryOp.Neq: lower_neq,
+        il.BinaryOp.Mul: lower_mul,
+        il.BinaryOp.Div: lower_div,
+        il.BinaryOp.Rem: lower_rem,
+        il.BinaryOp.Shl: lower_shl,
+        il.BinaryOp.Shr: lower_shr,
+    }
+
+    def lower_unary(self, stmt, func, reg_alloc, live_out, dst_reg, c_reg):
+        if stmt.op == il.UnaryOp.Identity:  # this is a MOVE!!!!!
+            if stmt.dst in live_out and stmt.src not in self._frame_locals:
+                reg_alloc.store_reg(RegisterLocation(dst_reg), stmt.src)  # THIS MOVE HAS SPECIAL SEMANTIC
+        elif stmt.op == il.UnaryOp.Minus:
+            self.cl_twos(dst_reg)
+        elif stmt.op == il.UnaryOp.Negate:
+            self.cl_ones(dst_reg)
+        elif stmt.op == il.UnaryOp.LogicalNot:
+            self.cl_test(dst_reg)
+            self.emit_insn('BRnp #3')
+            self.emit_insn('AND %s, %s, #0' % (dst_reg, dst_reg))
+            self.emit_insn('ADD %s, %s, #1' % (dst_reg, dst_reg))
+            self.emit_insn('BRnzp #1')
+            self.emit_insn('AND %s, %s, #0' % (dst_reg, dst_reg))
+        else:
+            raise UnsupportedFeatureError('unsupported unary operation ' + str(stmt.op))
+
+    def lower_constant(self, stmt, func, reg_alloc, live_out, dst_reg, c_reg):
+        if stmt.imm.value.type == il.CompiledValueType.Integer:
+            self.cl_load_reg(dst_reg, stmt.imm.value.value)
+        elif stmt.imm.value.type == il.CompiledValueType.Pointer and self._pool is not None:
+            self.reloc_load_address(dst_reg, stmt.imm.value.value)
+        elif stmt.imm.value.type == il.CompiledValueType.Pointer:
+            self.emit_insn('LD %s, #1' % (dst_reg,))
+            self.emit_insn('BR #1')
+            self.reloc_dump_address(stmt.imm.value.value)
+        else:
+            raise RuntimeError('unsupported compiled constant type')
+
+    def lower_return(self, stmt, func, reg_alloc, live_out, dst_reg, c_reg):
+        retvar_loc = reg_alloc.get_loc(func.retval)
+        self.load_reg_from_loc(self._ret_reg, retvar_loc)
+        if not self.layout or self._next_block is not None:  # the last block runs into the epilogue
+            tmp_reg = reg_alloc.getreg(live_out, None, [self._ret_reg])
+            self.emit_insn('LD %s, #1' % (tmp_reg,))
+            self.emit_insn('JMP %s' % (tmp_reg,))
+            self.reloc_dump_address(self.name_return_block(func))
+        reg_alloc.free_local(func.retval, free_stack=func.retval not in self._frame_locals)
+
+    def lower_goto(self, stmt, func, reg_alloc, live_out, dst_reg, c_reg):
+        if stmt.dst_block is self._next_block:
+            return
+        tmp_reg = reg_alloc.getreg(live_out, None, [])
+        self.cl_jump('BRnzp', func, stmt.dst_block, tmp_reg)
+
+    def lower_cond_jump(self, stmt, func, reg_alloc, live_out, dst_reg, c_reg):
+        if stmt.imm.value.value != 0:
+            raise RuntimeError('unsupported (nonzero) comparison constant ' + str(stmt.imm.value.value))
+
+        # set cc flags
+        self.cl_test(dst_reg)
+
+        branch = self.cond_branch_insns.get(stmt.op)
+        if branch is None:
+            raise UnsupportedFeatureError('unsupported comparison operator ' + str(stmt.op))
+        tmp_reg = reg_alloc.getreg(live_out, None, [dst_reg])
+        self.cl_branch(branch, func, stmt.true_block, stmt.false_block, tmp_reg)
+
+    def cl_branch(self, branch, func, true_block, false_block, tmp_reg):
+        """
+        Jumps to true_block if branch is taken on the current condition codes, to false_block otherwise.
+        """
+        if self.layout:
+            self.flush_peephole()  # jumps back need the exact location
+        for jump_branch, block in self.branch_jumps(branch, func, true_block, false_block, self._cur_binary_loc):
+            self.cl_jump(jump_branch, func, block, tmp_reg)
+
+    def branch_jumps(self, branch, func, true_block, false_block, loc):
+        """
+        :return: the jumps cl_branch emits at loc, as (branch, block). Without a layout, that's a branch
+                 over a far jump to false_block, then a far jump to true_block.
+        """
+        if false_block is self._next_block:
+            return [(branch, true_block)]
+        if true_block is self._next_block:
+            return [(self.inverted_branches[branch], false_block)]
+        if self.near_offset(func, true_block, loc) is not None:
+            return [(branch, true_block), ('BRnzp', false_block)]
+        return [(self.inverted_branches[branch], false_block), ('BRnzp', true_block)]
+
+    def branch_entries(self, branch, func, true_block, false_block, loc):
+        """
+        :return: map from the blocks cl_branch at loc goes to, to where in its code control goes there
+                 unconditionally: the start of a far jump, or the end if the block comes next
+        """
+        entries = {}
+        for jump_branch, block in self.branch_jumps(branch, func, true_block, false_block, loc):
+            size = self.jump_size(jump_branch, func, block, loc)
+            if size >= 3:
+                entries.setdefault(block, loc + size - 3)
+            loc += size
+        if self._next_block is not None:
+            entries.setdefault(self._next_block, loc)
+        return entries
+
+    def near_offset(self, func, block, loc):
+        """
+        :return: the offset for a branch at loc to block if the block is laid out before it and close
+                 enough, otherwise None
+        """
+        name = self.name_basic_block(func, block)
+        if not self.layout or not self.is_name_mapped(name):
+            return None
+        offset = self.get_binary_location(name) - (loc + 1)
+        return offset if PC9.holds(offset) else None
+
+    def jump_size(self, branch, func, block, loc):
+        """
+        :return: the words cl_jump emits at loc
+        """
+        if block is self._next_block:
+            return 0
+        if self.near_offset(func, block, loc) is not None:
+            return 1
+        return 3 if branch == 'BRnzp' else 4
+
+    def cl_jump(self, branch, func, block, tmp_reg):
+        """
+        Jumps to block if branch is taken on the current condition codes: not at all if it is the next
+        block, with the branch itself if it is close enough behind, otherwise by loading its address.
+        """
+        if block is self._next_block:
+            return
+        if self.layout and self.is_name_mapped(self.name_basic_block(func, block)):
+            self.flush_peephole()
+            offset = self.near_offset(func, block, self._cur_binary_loc)
+            if offset is not None:
+                self.emit_insn('%s #%d' % (branch, offset))
+                return
+        if branch != 'BRnzp':
+            self.emit_insn(self.inverted_branches[branch] + ' #3')
+        self.emit_insn('LD %s, #1' % (tmp_reg,))
+        self.emit_insn('JMP %s' % (tmp_reg,))
+        self.reloc_dump_address(self.name_basic_block(func, block))
+
+    inverted_branches = {
+        'BRz': 'BRnp',
+        'BRnp': 'BRz',
+        'BRn': 'BRzp',
+        'BRzp': 'BRn',
+        'BRp': 'BRnz',
+        'BRnz': 'BRp',
+    }
+
+    cond_branch_insns = {
+        il.ComparisonOp.Equ: 'BRz',
+        il.ComparisonOp.Neq: 'BRnp',
+    }
+
+    # --- fused compare and branch ---
+
+    negated_comparisons = {
+        il.BinaryOp.Equ: il.BinaryOp.Neq,
+        il.BinaryOp.Neq: il.BinaryOp.Equ,
+        il.BinaryOp.Lt: il.BinaryOp.Geq,
+        il.BinaryOp.Geq: il.BinaryOp.Lt,
+        il.BinaryOp.Gt: il.BinaryOp.Leq,
+        il.BinaryOp.Leq: il.BinaryOp.Gt,
+    }
+
+    # branch taken when b - a says that a <op> b
+    difference_branch_insns = {
+        il.BinaryOp.Equ: 'BRz',
+        il.BinaryOp.Neq: 'BRnp',
+        il.BinaryOp.Lt: 'BRp',
+        il.BinaryOp.Gt: 'BRn',
+        il.BinaryOp.Leq: 'BRzp',
+        il.BinaryOp.Geq: 'BRnz',
+    }
+
+    # branch taken when a says that a <op> 0
+    sign_branch_insns = {
+        il.BinaryOp.Equ: 'BRz',
+        il.BinaryOp.Neq: 'BRnp',
+        il.BinaryOp.Lt: 'BRn',
+        il.BinaryOp.Gt: 'BRp',
+        il.BinaryOp.Leq: 'BRnz',
+        il.BinaryOp.Geq: 'BRzp',
+    }
+
+    def fused_branch(self, bb, i, stmt_liveness):
+        """
+        :return: the conditional jump after the i-th statement of bb if that statement is a comparison
+                 only the jump reads, so that both can be lowered to a single branch, otherwise None
+        """
+        stmt = bb.stmts[i]
+        if type(stmt) != il.BinaryStmt or stmt.op not in self.negated_comparisons or i + 1 == len(bb.stmts):
+            return None
+        jump = bb.stmts[i + 1]
+        if type(jump) != il.CondJumpStmt or jump.srcA is not stmt.dst or \
+                jump.op not in (il.ComparisonOp.Equ, il.ComparisonOp.Neq) or \
+                jump.imm.value.type != il.CompiledValueType.Integer or jump.imm.value.value != 0:
+            return None
+        if stmt.dst in self._global_vars or stmt.dst in stmt_liveness.live_out(bb, i + 1):
+            return None
+        return jump
+
+    def lower_compare_branch(self, stmt, jump, func, dst_reg, c_reg):
+        """
+        Lowers the comparison stmt and the conditional jump on its result as one branch on the condition
+        codes. dst_reg holds the first operand, which may be overwritten since the result isn't needed,
+        and serves for the jump too.
+        """
+        op = stmt.op if jump.op == il.ComparisonOp.Neq else self.negated_comparisons[stmt.op]
+        unsigned = il.Types.is_unsigned(stmt.srcA.type)
+        b = self._constants.get(stmt.srcB)
+
+        if b == 0 and (not unsigned or op in (il.BinaryOp.Equ, il.BinaryOp.Neq)):
+            self.cl_test(dst_reg)
+            self.cl_branch(self.sign_branch_insns[op], func, jump.true_block, jump.false_block, dst_reg)
+            return
+        if b is not None and op in (il.BinaryOp.Equ, il.BinaryOp.Neq) and IMM5.holds(-b):
+            self.emit_insn('ADD %s, %s, #%d' % (dst_reg, dst_reg, -b))
+            self.cl_branch(self.sign_branch_insns[op], func, jump.true_block, jump.false_block, dst_reg)
+            return
+
+        branch = self.difference_branch_insns[op]
+        if op not in (il.BinaryOp.Equ, il.BinaryOp.Neq):
+            # b - a overflows when the operands have different top bits, but then those decide
+            if_greater = op in (il.BinaryOp.Gt, il.BinaryOp.Geq)
+            self.cl_test(dst_reg)
+            if self.layout:
+                self.flush_peephole()  # jumps back need the exact location
+            start = self._cur_binary_loc
+            # where the jumps after COMPARE go to each block without testing anything
+            entries = self.branch_entries(branch, func, jump.true_block, jump.false_block, start + 9)
+
+            def to(block, loc):
+                offset = self.near_offset(func, block, loc)
+                return offset if offset is not None else entries[block] - (loc + 1)
+
+            self.emit_insn('BRn #3')  # branch to A_TOP
+            self.cl_test(c_reg)
+            # top bit of b only: a > b if signed, a < b if unsigned
+            target = jump.true_block if if_greater != unsigned else jump.false_block
+            self.emit_insn('BRn #%d' % (to(target, start + 2),))
+            self.emit_insn('BR #2')  # jump to COMPARE
+            self.cl_test(c_reg)  # A_TOP
+            # top bit of a only: a < b if signed, a > b if unsigned
+            target = jump.true_block if if_greater == unsigned else jump.false_block
+            self.emit_insn('BRzp #%d' % (to(target, start + 5),))
+        # COMPARE: dst = b - a, leaving b alone
+        self.cl_ones(dst_reg)
+        self.emit_insn('ADD %s, %s, %s' % (dst_reg, dst_reg, c_reg))
+        self.emit_insn('ADD %s, %s, #1' % (dst_reg, dst_reg))
+        self.cl_branch(branch, func, jump.true_block, jump.false_block, dst_reg)
+
+    def lower_cast(self, stmt, func, reg_alloc, live_out, dst_reg, c_reg):
+        from_type = stmt.src.type
+        to_type = stmt.dst.type
+        if ABI.sizeof(from_type) != ABI.sizeof(to_type):
+            raise UnsupportedFeatureError('unsupported cast %s to %s' % (from_type, to_type))
+
+    def lower_deref_read(self, stmt, func, reg_alloc, live_out, dst_reg, c_reg):
+        self.emit_insn('LDR %s, %s, #0' % (dst_reg, dst_reg))
+
+    def lower_deref_write(self, stmt, func, reg_alloc, live_out, dst_reg, c_reg):
+        self.emit_insn('STR %s, %s, #0' % (c_reg, dst_reg))
+
+    def lower_comment(self, stmt, func, reg_alloc, live_out, dst_reg, c_reg):
+        pass
+
+    def lower_param(self, stmt, func, reg_alloc, live_out, dst_reg, c_reg):
+        self.cl_push(dst_reg)
+
+    def lower_call(self, stmt, func, reg_alloc, live_out, dst_reg, c_reg):
+        if stmt in self._tail_calls and self.lower_tail_call(stmt, func, reg_alloc, dst_reg, c_reg):
+            self._tail_jumps.add(stmt)
+            return
+        if func.convention is il.CallingConvention.Register:
+            self.lower_register_call(stmt, reg_alloc, live_out, dst_reg, c_reg)
+            return
+        self.emit_insn('JSRR %s' % (dst_reg,))
+        self.cl_pop(dst_reg)
+        # pop args
+        for i in range(stmt.nargs):
+            self.emit_insn('add %s, %s, #1' % (self.sp, self.sp))
+
+    def lower_register_call(self, stmt, reg_alloc, live_out, dst_reg, c_reg):
+        """
+        Calls the function dst_reg points to with the first argument in c_reg, and the rest wherever the
+        allocator keeps them. Registers the call overwrites are saved around it if they hold something
+        needed afterwards, which the assignment-based allocators avoid.
+        """
+        locations = [RegisterLocation(c_reg)] + [reg_alloc.get_loc(arg) for arg in stmt.args[1:]] if stmt.args else []
+        num_reg_args = min(len(locations), len(self.arg_regs))
+        live = [var for var in live_out if var is not stmt.dst]
+        saved = sorted(reg for reg in reg_alloc.live_registers(live) & set(self.call_clobbered) if reg != dst_reg)
+        if saved:
+            self.emit_insn('ADD %s, %s, #-%d' % (self.sp, self.sp, len(saved)))
+            for i, reg in enumerate(saved):
+                self.emit_insn('STR %s, %s, #%d' % (reg, self.sp, i))
+
+        stack_locations = locations[num_reg_args:]
+        if stack_locations:
+            self.emit_insn('ADD %s, %s, #-%d' % (self.sp, self.sp, len(stack_locations)))
+            busy = set([dst_reg] + [loc.reg for loc in locations if type(loc) == RegisterLocation])
+            for i, loc in enumerate(stack_locations):
+                if type(loc) == RegisterLocation:
+                    self.emit_insn('STR %s, %s, #%d' % (loc.reg, self.sp, i))
+                    continue
+                free = [reg for reg in self.call_clobbered if reg not in busy]
+                if not free:
+                    raise BackendError('no register left for ' + str(stmt))
+                self.load_reg_from_loc(free[0], loc)
+                self.emit_insn('STR %s, %s, #%d' % (free[0], self.sp, i))
+
+        moves = {}
+        loads = []
+        for reg, loc in zip(self.arg_regs, locations[:num_reg_args]):
+            if type(loc) == RegisterLocation:
+                moves[reg] = loc.reg
+            else:
+                loads.append((reg, loc))
+        func_reg = dst_reg
+        if dst_reg in self.arg_regs[:num_reg_args]:
+            func_reg = self.rp
+            moves[self.rp] = dst_reg
+        self.cl_parallel_move(moves)
+        for reg, loc in loads:
+            self.load_reg_from_loc(reg, loc)
+        self.emit_insn('JSRR %s' % (func_reg,))
+
+        if stack_locations:
+            self.emit_insn('ADD %s, %s, #%d' % (self.sp, self.sp, len(stack_locations)))
+        if dst_reg != self.retval_reg:
+            self.cl_move(dst_reg, self.retval_reg)
+        if saved:
+            for i, reg in enumerate(saved):
+                self.emit_insn('LDR %s, %s, #%d' % (reg, self.sp, i))
+            self.emit_insn('ADD %s, %s, #%d' % (self.sp, self.sp, len(saved)))
+
+        # the operand lowering only frees the first two operands
+        for arg in set(stmt.args[1:]) - set([stmt.func_ptr] + stmt.args[:1]):
+            if arg not in live_out:
+                reg_alloc.free_local(arg, free_stack=arg not in self._frame_locals)
+
+    def lower_tail_call(self, stmt, func, reg_alloc, dst_reg, c_reg):
+        """
+        Jumps to the function dst_reg points to in place of calling it and returning, having taken the
+        frame down first, so that it returns straight to our caller.
+
+        Under the register convention the arguments go to their registers and the address to the one
+        after them, so there must be one to spare. Under the stack convention no register is free once
+        the saved ones are restored, so the function has to be close enough behind to branch to. It must
+        also take as many arguments as we do, since our caller pops them: they are copied over ours.
+        :return: whether the call could be lowered so
+        """
+        if func.convention is il.CallingConvention.Register:
+            if stmt.nargs >= len(self.arg_regs):
+                return False
+            target = self.arg_regs[stmt.nargs]
+            locations = [RegisterLocation(c_reg)] + [reg_alloc.get_loc(arg) for arg in stmt.args[1:]] \
+                if stmt.args else []
+            moves = {target: dst_reg}
+            loads = []
+            for reg, loc in zip(self.arg_regs, locations):
+                if type(loc) == RegisterLocation:
+                    moves[reg] = loc.reg
+                else:
+                    loads.append((reg, loc))
+            self.cl_parallel_move(moves)
+            for reg, loc in loads:
+                self.load_reg_from_loc(reg, loc)
+            self.cl_leave(False)
+            self.emit_insn('JMP %s' % (target,))
+            return True
+
+        name = self._tail_calls[stmt]
+        if name is None or stmt.nargs != func.num_args or not self.near_symbol(name):
+            return False
+        # the branch comes after copying the arguments and taking the frame down
+        distance = 2 * stmt.nargs + 2 * len(self._saved_regs) + 4
+        if not PC9.holds(self.get_binary_location(name) - (self._cur_binary_loc + 1 + distance)):
+            return False
+        for i in range(stmt.nargs):
+            self.emit_insn('LDR %s, %s, #%d' % (dst_reg, self.sp, i))
+            if self._has_frame:
+                self.vl_store_local(dst_reg, self.param_bp_offset(i))
+            else:
+                self.emit_insn('STR %s, %s, #%d' % (dst_reg, self.sp, stmt.nargs - self.param_bp_offset(i)))
+        if not self._has_frame:
+            self.emit_insn('add %s, %s, #%d' % (self.sp, self.sp, stmt.nargs))  # sp isn't reset from bp
+        self.cl_leave(False)
+        self.emit_insn('add %s, %s, #1' % (self.sp, self.sp))  # the callee makes its own return value slot
+        self.flush_peephole()
+        self.emit_insn('BRnzp #%d' % (self.get_binary_location(name) - (self._cur_binary_loc + 1),))
+        return True
+
+    stmt_lowering = {
+        il.BinaryStmt: lower_binary,
+        il.UnaryStmt: lower_unary,
+        il.ConstantStmt: lower_constant,
+        il.ReturnStmt: lower_return,
+        il.GotoStmt: lower_goto,
+        il.CondJumpStmt: lower_cond_jump,
+        il.CastStmt: lower_cast,
+        il.DerefReadStmt: lower_deref_read,
+        il.DerefWriteStmt: lower_deref_write,
+        il.CommentStmt: lower_comment,
+        il.ParamStmt: lower_param,
+        il.CallStmt: lower_call,
+    }
+
     def emit_func_prologue(self, locals_size):
-        self.emit_insn('add %s, %s, #-1' % (self.sp, self.sp))  # save space for ret val
-        self.cl_push(self.rp)
-        self.cl_push(self.bp)
-        self.cl_push('r0')
-        self.cl_push('r1')
-        self.cl_push('r2')
-        self.cl_push('r3')
-        self.cl_push('r4')
+        register_convention = self._convention is il.CallingConvention.Register
+        if self._clobbered is None and not register_convention:
+            self.emit_insn('add %s, %s, #-1' % (self.sp, self.sp))  # save space for ret val
+            for reg in self._saved_regs:
+                self.cl_push(reg)
+        else:
+            # the same layout, with the stack pointer moved once
+            num_saved = len(self._saved_regs)
+            frame = num_saved if register_convention else num_saved + 1
+            if frame:
+                self.emit_insn('add %s, %s, #-%d' % (self.sp, self.sp, frame))
+            for i, reg in enumerate(self._saved_regs):
+                self.emit_insn('STR %s, %s, #%d' % (reg, self.sp, num_saved - 1 - i))
+        if not self._has_frame:
+            return
         self.cl_move(self.bp, self.sp)
 
         self.emit_comment('sub sp, %d' % (locals_size,))
         while locals_size > 16:
-            self.emit_insn('add %s, %s, #-16' % (self.bp, self.bp))
+            self.emit_insn('add %s, %s, #-16' % (self.sp, self.sp))
             locals_size -= 16
         self.emit_insn('add %s, %s, #-%d' % (self.sp, self.sp, locals_size))
 
     def emit_func_epilogue(self):
         self.emit_comment('leave')
-        self.cl_move(self.sp, self.bp)
-        self.emit_insn('STR %s, %s, 7' % (self.retval_reg, self.sp))
-        self.cl_pop('r4')
-        self.cl_pop('r3')
-        self.cl_pop('r2')
-        self.cl_pop('r1')
-        self.cl_pop('r0')
-        self.cl_pop(self.bp)
-        self.cl_pop(self.rp)
+        self.cl_leave(True)
         self.emit_insn('RET')
 
+    def cl_leave(self, returns):
+        """
+        Takes the frame down and restores the saved registers. Under the stack convention sp is left
+        pointing at the return value slot.
+        :param returns: whether to put the return value where the caller expects it
+        """
+        if self._has_frame:
+            self.cl_move(self.sp, self.bp)
+        num_saved = len(self._saved_regs)
+        register_convention = self._convention is il.CallingConvention.Register
+        if self._clobbered is None and not register_convention:
+            if returns:
+                self.emit_insn('STR %s, %s, %d' % (self._ret_reg, self.sp, num_saved))
+            for reg in reversed(self._saved_regs):
+                self.cl_pop(reg)
+        else:
+            if returns and not register_convention:
+                self.emit_insn('STR %s, %s, #%d' % (self._ret_reg, self.sp, num_saved))
+            elif returns and self._ret_reg != self.retval_reg:
+                self.cl_move(self.retval_reg, self._ret_reg)
+            for i, reg in reversed(list(enumerate(self._saved_regs))):
+                self.emit_insn('LDR %s, %s, #%d' % (reg, self.sp, num_saved - 1 - i))
+            if num_saved:
+                self.emit_insn('add %s, %s, #%d' % (self.sp, self.sp, num_saved))
+
     def emit_global_name(self, global_name):
         if global_name.location > 0 and self._cur_orig != global_name.location:
             if global_name.location < 0x3000 or global_name.location > 0xbfff:
@@ -1019,13 +2443,21 @@ class LC3(object):
 
         self.emit_orig(self._cur_binary_loc)
         self.emit_stub()
+        self.emit_runtime(self.find_runtime_routines())
 
         # emit globals then funcs
         for name in self._global_names:
             self.emit_global_name(name)
 
         self.emit_section_end()
-
+        self.flush_peephole()
+
+        if self._peephole:
+            self.peephole_hits = dict(self._peephole.hits)
+            if peephole_tracer.active:
+                for rule in self._peephole.rules:
+                    peephole_tracer.info('peephole %s: %d', rule.name, self._peephole.hits[rule.name])
+            self._peephole = None  # relocations patch instructions in place
         self.apply_relocations()
 
         self._compiled = True
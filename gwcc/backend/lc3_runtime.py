@@ -0,0 +1,194 @@
+"""
+Runtime library of the LC-3 backend: routines for the operations the LC-3 has no instructions for.
+The backend emits the ones a program uses, once, right after the startup stub.
+
+They don't follow the calling convention of compiled functions, which saves and restores every
+register and sets up a frame. Instead the operands are passed in r0 and r1 and the results come
+back in the same registers. Every other register is preserved except r7, which holds the return
+address, so the caller only has to save whatever it keeps in r0, r1 and r7.
+"""
+
+
+class Routine(object):
+    def __init__(self, name, doc, needs, code):
+        self.name = name
+        self.doc = doc
+        self.needs = needs  # names of the routines this one calls
+        self.code = code
+
+
+def assemble(code):
+    """
+    Resolves the local labels of a routine: lines starting with @ are labels, and an operand
+    naming one becomes the PC offset to it.
+    :return: the instructions of the routine
+    """
+    labels = {}
+    insns = []
+    for line in code:
+        if line.startswith('@'):
+            labels[line] = len(insns)
+        else:
+            insns.append(line)
+    for i, insn in enumerate(insns):
+        operand = insn.split()[-1]
+        if operand.startswith('@'):
+            insns[i] = insn[:-len(operand)] + '#%d' % (labels[operand] - (i + 1),)
+    return insns
+
+
+UDIVMOD = Routine('__gwcc_udivmod', 'r0, r1 = r0 / r1, r0 % r1, unsigned', (), [
+    'ADD r6, r6, #-3',
+    'STR r2, r6, #0',
+    'STR r3, r6, #1',
+    'STR r4, r6, #2',
+    'AND r2, r2, #0',  # remainder
+    'NOT r3, r1',
+    'ADD r3, r3, #1',  # minus the divisor
+    'ADD r1, r1, #0',
+    'BRn @big',
+    'AND r4, r4, #0',
+    'ADD r4, r4, #8',
+    'ADD r4, r4, #8',  # bits to go
+    # restoring division: the dividend is shifted into the remainder from the top, and the
+    # quotient into the dividend from the bottom
+    '@loop',
+    'ADD r2, r2, r2',
+    'ADD r0, r0, #0',
+    'BRzp #1',
+    'ADD r2, r2, #1',
+    'ADD r0, r0, r0',
+    'ADD r2, r2, #0',
+    'BRn #2',  # the remainder is past 0x7fff, so above the divisor
+    'ADD r1, r2, r3',
+    'BRn #2',  # the remainder is below the divisor
+    'ADD r2, r2, r3',
+    'ADD r0, r0, #1',
+    'ADD r4, r4, #-1',
+    'BRp @loop',
+    'ADD r1, r2, #0',
+    '@restore',
+    'LDR r2, r6, #0',
+    'LDR r3, r6, #1',
+    'LDR r4, r6, #2',
+    'ADD r6, r6, #3',
+    'RET',
+    # a divisor past 0x7fff goes into the dividend at most once
+    '@big',
+    'ADD r1, r0, #0',
+    'AND r0, r0, #0',
+    'ADD r1, r1, #0',
+    'BRzp @restore',
+    'ADD r2, r1, r3',
+    'BRn @restore',
+    'ADD r1, r2, #0',
+    'ADD r0, r0, #1',
+    'BRnzp @restore',
+])
+
+DIVMOD = Routine('__gwcc_divmod', 'r0, r1 = r0 / r1, r0 % r1, rounding toward zero', ('__gwcc_udivmod',), [
+    'ADD r6, r6, #-3',
+    'STR r2, r6, #0',
+    'STR r7, r6, #1',
+    'STR r0, r6, #2',  # the remainder has the sign of the dividend
+    'AND r2, r2, #0',  # -1 if the quotient is negative
+    'ADD r0, r0, #0',
+    'BRzp #3',
+    'NOT r0, r0',
+    'ADD r0, r0, #1',
+    'NOT r2, r2',
+    'ADD r1, r1, #0',
+    'BRzp #3',
+    'NOT r1, r1',
+    'ADD r1, r1, #1',
+    'NOT r2, r2',
+    'JSR __gwcc_udivmod',
+    'ADD r2, r2, #0',
+    'BRz #2',
+    'NOT r0, r0',
+    'ADD r0, r0, #1',
+    'LDR r2, r6, #2',
+    'BRzp #2',
+    'NOT r1, r1',
+    'ADD r1, r1, #1',
+    'LDR r2, r6, #0',
+    'LDR r7, r6, #1',
+    'ADD r6, r6, #3',
+    'RET',
+])
+
+SHL = Routine('__gwcc_shl', 'r0 = r0 << r1, r1 is clobbered', (), [
+    'ADD r1, r1, #0',
+    'BRnz #3',
+    'ADD r0, r0, r0',
+    'ADD r1, r1, #-1',
+    'BRp #-3',
+    'RET',
+])
+
+SHR = Routine('__gwcc_shr', 'r0 = r0 >> r1 shifting in zeros, r1 is clobbered', (), [
+    'ADD r6, r6, #-3',
+    'STR r2, r6, #0',
+    'STR r3, r6, #1',
+    'STR r4, r6, #2',
+    'AND r2, r2, #0',
+    'ADD r2, r2, #1',
+    'ADD r1, r1, #0',
+    'BRnz @restore',
+    '@mask',
+    'ADD r2, r2, r2',  # picks the lowest bit that is kept
+    'ADD r1, r1, #-1',
+    'BRp @mask',
+    'AND r3, r3, #0',  # result
+    'ADD r1, r1, #1',  # picks the bit of the result it goes to
+    'ADD r2, r2, #0',
+    'BRz @done',
+    # copy the bits one by one
+    '@loop',
+    'AND r4, r0, r2',
+    'BRz #1',
+    'ADD r3, r3, r1',
+    'ADD r1, r1, r1',
+    'ADD r2, r2, r2',
+    'BRnp @loop',
+    '@done',
+    'ADD r0, r3, #0',
+    '@restore',
+    'LDR r2, r6, #0',
+    'LDR r3, r6, #1',
+    'LDR r4, r6, #2',
+    'ADD r6, r6, #3',
+    'RET',
+])
+
+SAR = Routine('__gwcc_sar', 'r0 = r0 >> r1 shifting in the sign, r1 is clobbered', ('__gwcc_shr',), [
+    'ADD r0, r0, #0',
+    'BRzp __gwcc_shr',
+    # x >> n = ~(~x >> n) for negative x
+    'ADD r6, r6, #-1',
+    'STR r7, r6, #0',
+    'NOT r0, r0',
+    'JSR __gwcc_shr',
+    'NOT r0, r0',
+    'LDR r7, r6, #0',
+    'ADD r6, r6, #1',
+    'RET',
+])
+
+# in the order they are emitted
+ROUTINES = [UDIVMOD, DIVMOD, SHL, SHR, SAR]
+ROUTINES_BY_NAME = {routine.name: routine for routine in ROUTINES}
+
+
+def closure(names):
+    """
+    :return: the routines named and the ones they call, in the order they are emitted
+    """
+    needed = set()
+    pending = list(names)
+    while pending:
+        name = pending.pop()
+        if name not in needed:
+            needed.add(name)
+            pending.extend(ROUTINES_BY_NAME[name].needs)
+    return [routine for routine in ROUTINES if routine.name in needed]
@@ -0,0 +1,127 @@
+"""
+Linear-scan register allocation (Poletto & Sarkar) over live intervals of a linearized CFG.
+"""
+
+from .. import il
+
+
+class LiveInterval(object):
+    """
+    The range of program points over which a variable has to be kept somewhere. Statement i of the
+    linear order reads its operands at point 2*i and writes its result at point 2*i + 1, so a
+    variable that dies in a statement can share a register with the one that statement defines.
+    """
+    __slots__ = ('var', 'start', 'end', 'reg', 'hint', 'preferred', 'crosses_call')
+
+    def __init__(self, var, point):
+        self.var = var
+        self.start = point
+        self.end = point
+        self.reg = None
+        self.hint = None  # interval whose register we'd like to reuse, saving a move
+        self.preferred = None  # register we'd like otherwise
+        self.crosses_call = False  # whether the variable is live across a call
+
+    def add(self, point):
+        if point < self.start:
+            self.start = point
+        elif point > self.end:
+            self.end = point
+
+    def __repr__(self):
+        return '%s[%d, %d]%s' % (self.var.name, self.start, self.end, '@' + self.reg if self.reg else '')
+
+
+def build_intervals(blocks, liveness, stmt_liveness, ignore=()):
+    """
+    Builds one interval per variable covering every point where it is used, defined, or live.
+    Interval holes are not tracked: a variable live around a loop keeps its register for the
+    whole loop.
+    :param blocks: basic blocks in linear order
+    :param ignore: variables that are never allocated, e.g. globals
+    :return: map from variable to LiveInterval
+    """
+    intervals = {}
+
+    def touch(var, point):
+        interval = intervals.get(var)
+        if interval is None:
+            intervals[var] = interval = LiveInterval(var, point)
+        else:
+            interval.add(point)
+        return interval
+
+    i = 0
+    for bb in blocks:
+        for var in liveness.live_in(bb):
+            if var not in ignore:
+                touch(var, 2 * i)
+        for j, stmt in enumerate(bb.stmts):
+            uses = il.used_vars(stmt)
+            for var in uses:
+                if var not in ignore:
+                    touch(var, 2 * i)
+            dst = il.defed_var(stmt)
+            if dst is not None and dst not in ignore:
+                interval = touch(dst, 2 * i + 1)
+                # a call's result doesn't come from the function pointer
+                if interval.hint is None and uses and uses[0] in intervals and type(stmt) != il.CallStmt:
+                    interval.hint = intervals[uses[0]]
+            for var in stmt_liveness.live_out(bb, j):
+                if var not in ignore:
+                    interval = touch(var, 2 * i + 1)
+                    if type(stmt) == il.CallStmt and var is not dst:
+                        interval.crosses_call = True
+            i += 1
+    return intervals
+
+
+def linear_scan(intervals, registers, call_clobbered=()):
+    """
+    Assigns registers to intervals, spilling the interval that ends last whenever all registers
+    are taken.
+    :param intervals: iterable of LiveInterval
+    :param registers: allocatable register names, in order of preference
+    :param call_clobbered: registers a call overwrites, which intervals crossing one can't have
+    :return: list of spilled intervals. Every other interval has its reg set.
+    """
+    free = list(registers)
+    active = []  # sorted by increasing end
+    spilled = []
+
+    for interval in sorted(intervals, key=lambda iv: (iv.start, iv.end, iv.var.id)):
+        # expire old intervals
+        while active and active[0].end < interval.start:
+            free.append(active.pop(0).reg)
+
+        allowed = [reg for reg in free if not (interval.crosses_call and reg in call_clobbered)]
+        if allowed:
+            if interval.hint is not None and interval.hint.reg in allowed:
+                interval.reg = interval.hint.reg
+            elif interval.preferred in allowed:
+                interval.reg = interval.preferred
+            else:
+                interval.reg = min(allowed, key=registers.index)
+            free.remove(interval.reg)
+        else:
+            victims = [iv for iv in active if not (interval.crosses_call and iv.reg in call_clobbered)]
+            victim = victims[-1] if victims else None
+            if victim is None:
+                spilled.append(interval)
+                continue
+            if victim.end > interval.end:
+                interval.reg = victim.reg
+                victim.reg = None
+                spilled.append(victim)
+                active.remove(victim)
+            else:
+                spilled.append(interval)
+                continue
+
+        # insert into active, keeping it sorted by end
+        k = len(active)
+        while k > 0 and active[k - 1].end > interval.end:
+            k -= 1
+        active.insert(k, interval)
+
+    return spilled
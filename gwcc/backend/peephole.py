@@ -0,0 +1,275 @@
+"""
+Peephole optimization of the LC-3 instructions the backend emits, over a window of straight-line
+code that is buffered until something forces it out.
+"""
+
+import re
+from collections import defaultdict
+
+SETS_CC = frozenset(['ADD', 'AND', 'NOT', 'LD', 'LDR', 'LDI'])
+ALU = frozenset(['ADD', 'AND', 'NOT'])
+PURE = frozenset(['ADD', 'AND', 'NOT', 'LD', 'LDR', 'LDI', 'LEA'])  # only write their first operand
+PC_RELATIVE = frozenset(['LD', 'LDI', 'LEA', 'ST', 'STI'])
+CONTROL = frozenset(['JMP', 'JSR', 'JSRR', 'RET', 'RTI', 'TRAP', 'HALT', 'GETC', 'OUT', 'PUTS', 'IN'])
+OPCODES = PURE | PC_RELATIVE | CONTROL | frozenset(['STR'])
+BRANCH = re.compile(r'^BR[NZP]*$')
+ALL_REGS = frozenset('r%d' % (i,) for i in range(8))
+
+
+class Insn(object):
+    """
+    One instruction of the window: its opcode in upper case and its operands, registers in lower case.
+    """
+    __slots__ = ('op', 'args', 'text')
+
+    def __init__(self, op, args, text):
+        self.op = op
+        self.args = args
+        self.text = text
+
+    @staticmethod
+    def parse(text):
+        """
+        :return: an Insn, or None if the line isn't an instruction (a label, data, a directive)
+        """
+        parts = text.split(None, 1)
+        op = parts[0].upper()
+        if op not in OPCODES and not BRANCH.match(op):
+            return None
+        args = [arg.strip() for arg in parts[1].split(',')] if len(parts) > 1 else []
+        return Insn(op, [arg.lower() if arg.lower() in ALL_REGS else arg for arg in args], text)
+
+    def is_branch(self):
+        return BRANCH.match(self.op) is not None
+
+    def pc_offset(self):
+        """
+        :return: how many words ahead this instruction reaches, relative to the next one
+        """
+        if self.is_branch() or self.op in PC_RELATIVE or self.op == 'JSR':
+            target = self.args[-1]
+            if target.startswith('#'):
+                return int(target[1:])
+        return 0
+
+    def ends_window(self):
+        return self.is_branch() or self.op in CONTROL or self.op in PC_RELATIVE
+
+    def writes(self):
+        if self.op in PURE:
+            return self.args[0]
+        if self.op in ('JSR', 'JSRR'):
+            return 'r7'
+        return None
+
+    def reads(self):
+        op = self.op
+        if op == 'ADD' or op == 'AND':
+            return [arg for arg in self.args[1:] if arg in ALL_REGS]
+        if op == 'NOT' or op == 'LDR':
+            return [self.args[1]]
+        if op == 'STR':
+            return self.args[:2]
+        if op in ('ST', 'STI', 'JMP', 'JSRR'):
+            return [self.args[0]]
+        if op == 'RET':
+            return ['r7']
+        if self.ends_window():
+            return ALL_REGS  # whatever runs next may read anything
+        return []
+
+    def __str__(self):
+        return self.text
+
+
+class PeepholeRule(object):
+    """
+    Replaces a sequence of adjacent instructions matching a pattern. Pattern operands that are single
+    capital letters stand for registers, '#' followed by a small letter for an immediate; the same
+    name has to match the same operand everywhere. An opcode of '@cc' matches any instruction that
+    sets the condition codes from its first operand, '@alu' only those of them that don't read
+    memory, and '...' matches any remaining operands.
+    In the replacement, '$n' stands for the n-th matched instruction, unchanged.
+    """
+    def __init__(self, name, pattern, replacement, cc_dead=False, reg_dead=None):
+        self.name = name
+        self.pattern = [self.split(p) for p in pattern]
+        self.replacement = [self.split(r) for r in replacement]
+        self.cc_dead = cc_dead  # the condition codes must not be read before they are set again
+        self.reg_dead = reg_dead  # register variable that must not be read before it is written again
+
+    @staticmethod
+    def split(template):
+        parts = template.split(None, 1)
+        return parts[0], [arg.strip() for arg in parts[1].split(',')] if len(parts) > 1 else []
+
+    @staticmethod
+    def is_variable(token):
+        return (len(token) == 1 and token.isupper()) or (len(token) == 2 and token[0] == '#' and token[1].islower())
+
+    def match(self, insns, i):
+        """
+        :return: the bindings of the pattern variables if it matches at insns[i], otherwise None
+        """
+        if i + len(self.pattern) > len(insns):
+            return None
+        bindings = {}
+        for (op, args), insn in zip(self.pattern, insns[i:]):
+            if op == '@cc':
+                if insn.op not in SETS_CC:
+                    return None
+            elif op == '@alu':
+                if insn.op not in ALU:
+                    return None
+            elif op.upper() != insn.op:
+                return None
+            if args and args[-1] == '...':
+                args = args[:-1]
+                if len(insn.args) < len(args):
+                    return None
+            elif len(args) != len(insn.args):
+                return None
+            for token, arg in zip(args, insn.args):
+                if self.is_variable(token):
+                    if bindings.setdefault(token, arg) != arg:
+                        return None
+                elif token.lower() != arg.lower():
+                    return None
+        return bindings
+
+    def rewrite(self, matched, bindings):
+        result = []
+        for op, args in self.replacement:
+            if op.startswith('$'):
+                result.append(matched[int(op[1:]) - 1])
+                continue
+            args = [bindings.get(token, token) for token in args]
+            text = '%s %s' % (op, ', '.join(args))
+            result.append(Insn(op.upper(), args, text))
+        return result
+
+
+RULES = [
+    # a value is already where it is being moved to
+    PeepholeRule('self-move', ['add A, A, #0'], [], cc_dead=True),
+    PeepholeRule('move-back', ['add A, B, #0', 'add B, A, #0'], ['add A, B, #0']),
+    # the condition codes already reflect the register being tested
+    PeepholeRule('redundant-test', ['@cc A, ...', 'add A, A, #0'], ['$1']),
+    # a push right before a pop is a move through memory
+    PeepholeRule('push-pop', ['add r6, r6, #-1', 'STR A, r6, #0', 'LDR B, r6, #0', 'add r6, r6, #1'],
+                 ['add B, A, #0'], cc_dead=True),
+    PeepholeRule('double-negate', ['NOT A, A', 'add A, A, #1', 'NOT A, A', 'add A, A, #1'], [], cc_dead=True),
+    # a stack slot read back right after it was written
+    PeepholeRule('store-load', ['STR A, B, #k', 'LDR C, B, #k'], ['$1', 'add C, A, #0']),
+    # a value nobody reads, like the operand cl_sub negates back for nothing. loads stay, since the
+    # read may be what matters if it hits a memory-mapped device register.
+    PeepholeRule('dead-write', ['@alu A, ...'], [], cc_dead=True, reg_dead='A'),
+]
+
+
+class PeepholeOptimizer(object):
+    """
+    Sits between the backend and its output. Instructions are buffered while they are straight-line
+    code. A label, data, or an instruction that jumps or uses a pc-relative offset ends the window:
+    it is optimized by applying the rules until none matches, then written out. The words a
+    pc-relative offset reaches over are written out untouched, so the offsets the backend computed
+    stay right.
+    """
+    def __init__(self, write, rules=RULES):
+        """
+        :param write: function(line, binary_len) that outputs a line. binary_len is None for comments.
+        """
+        self.write = write
+        self.rules = rules
+        self.hits = defaultdict(int)  # rule name -> number of times it was applied
+
+        self._pending = []  # lines of the window, an Insn for each instruction and a string otherwise
+        self._protected = 0  # words to write out untouched
+
+    def emit(self, line, binary_len):
+        if binary_len is None:
+            if self._pending:
+                self._pending.append(line)
+            else:
+                self.write(line, None)
+            return
+
+        insn = Insn.parse(line) if binary_len == 1 else None
+        if self._protected > 0 or insn is None:
+            self.flush()
+            self.write(line, binary_len)
+            self._protected = max(self._protected - binary_len, insn.pc_offset() if insn else 0)
+            return
+
+        self._pending.append(insn)
+        if insn.ends_window():
+            self.flush()
+            self._protected = insn.pc_offset()
+
+    def skip(self, binary_len):
+        """
+        Accounts for words that were written out without going through the optimizer.
+        """
+        self._protected = max(self._protected - binary_len, 0)
+
+    def flush(self):
+        if not self._pending:
+            return
+        self.optimize()
+        for line in self._pending:
+            if type(line) == Insn:
+                self.write(line.text, 1)
+            else:
+                self.write(line, None)
+        self._pending = []
+
+    def optimize(self):
+        changed = True
+        while changed:
+            changed = False
+            insns = [line for line in self._pending if type(line) == Insn]
+            for i in range(len(insns)):
+                for rule in self.rules:
+                    bindings = rule.match(insns, i)
+                    if bindings is None or any(insn.ends_window() for insn in insns[i:i + len(rule.pattern)]):
+                        continue
+                    end = i + len(rule.pattern)
+                    if rule.cc_dead and not self.cc_dead(insns, end):
+                        continue
+                    if rule.reg_dead and not self.reg_dead(insns, end, bindings[rule.reg_dead]):
+                        continue
+                    self.replace(insns[i:end], rule.rewrite(insns[i:end], bindings))
+                    self.hits[rule.name] += 1
+                    changed = True
+                    break
+                if changed:
+                    break
+
+    @staticmethod
+    def cc_dead(insns, i):
+        for insn in insns[i:]:
+            if insn.is_branch():
+                return False
+            if insn.op in SETS_CC:
+                return True
+            if insn.ends_window():
+                return False
+        return False  # whatever follows the window may branch on them
+
+    @staticmethod
+    def reg_dead(insns, i, reg):
+        for insn in insns[i:]:
+            if reg in insn.reads():
+                return False
+            if insn.writes() == reg:
+                return True
+        return False
+
+    def replace(self, old, new):
+        """
+        Puts the new instructions where the first old one was, keeping the comments in between.
+        """
+        first = self._pending.index(old[0])
+        for insn in old:
+            self._pending.remove(insn)
+        self._pending[first:first] = new
@@ -7,11 +7,14 @@ import sys
 
 from pycparser import c_ast
 
-import cfg
 import il
 from il import ParseError
 from gwcc.exceptions import UnsupportedFeatureError
 from gwcc.optimization.naturalization_pass import NaturalizationPass
+from gwcc.optimization.pipeline import optimize_function, optimize_program
+from gwcc.util import trace
+
+tracer = trace.get_tracer('frontend')
 
 
 class Scope(object):
@@ -50,9 +53,11 @@ class Scope(object):
         return name
 
 class Frontend(object):
-    def __init__(self, arch):
+    def __init__(self, arch, opt_level=0, inline_threshold=None):
         # target abi information
         self.target_arch = arch
+        self.opt_level = opt_level
+        self.inline_threshold = inline_threshold  # None for the default of opt_level
 
         # state
         self._scope_stack = [Scope('global')]
@@ -116,11 +121,11 @@ class Frontend(object):
         assert self.cur_func
         self.cur_block.add_stmt(stmt)
         if type(stmt) == il.GotoStmt:
-            self.cur_func.cfg.add_edge(cfg.FlowEdge(self.cur_block, stmt.dst_block))
+            self.cur_func.cfg.connect(self.cur_block, stmt.dst_block)
             self.cur_block = self.cur_func.cfg.new_block()
         elif type(stmt) == il.CondJumpStmt:
-            self.cur_func.cfg.add_edge(cfg.FlowEdge(self.cur_block, stmt.true_block))
-            self.cur_func.cfg.add_edge(cfg.FlowEdge(self.cur_block, stmt.false_block))
+            self.cur_func.cfg.connect(self.cur_block, stmt.true_block)
+            self.cur_func.cfg.connect(self.cur_block, stmt.false_block)
             self.cur_block = self.cur_func.cfg.new_block()
         elif type(stmt) == il.ReturnStmt:
             self.cur_block = self.cur_func.cfg.new_block()
@@ -146,7 +151,10 @@ class Frontend(object):
                 ref_level, ref_type = 0, None
 
             var_name = '_' + str(self.current_scope.name) + '_' + node.name
-            il_var = il.Variable(var_name, var_type, ref_level, ref_type)
+            if self.cur_func:
+                il_var = self.cur_func.variables.intern(var_name, var_type, ref_level, ref_type)
+            else:  # a global or a parameter, which il.Function adopts
+                il_var = il.Variable(var_name, var_type, ref_level, ref_type)
 
             if self.scope_depth > 1: # we are in a function -> this is a local decl.
                 if node.init:
@@ -210,7 +218,7 @@ class Frontend(object):
             for param_decl in func_decl.type.args.params:
                 argvars.append(self.on_decl_node(param_decl))
 
-        self.cur_func = il.Function(func_decl.name, argvars, retvar)
+        self.cur_func = il.Function(func_decl.name, argvars, retvar, self.target_arch.CALLING_CONVENTION)
         self._globals.append(il.GlobalName(func_decl.name, self.cur_func, None, self.cur_pragma_loc, self.cur_pragma_linkage))
         self._c_variables[func_decl] = self.cur_func
         self.cur_block = self.cur_func.cfg.new_block()
@@ -223,6 +231,7 @@ class Frontend(object):
 
         NaturalizationPass(self.cur_func).process()
         self.cur_func.verify() # integrity check coz i am stupid
+        optimize_function(self.cur_func, self.target_arch, self.opt_level)
 
         # exit scope
         self.scope_pop(new_scope)
@@ -233,9 +242,6 @@ class Frontend(object):
     def on_if_node(self, node):
         assert type(node) == c_ast.If
 
-        # handle cond
-        cond_val = self.on_expr_node(node.cond)
-
         # generate control flow
         true_block = self.cur_func.cfg.new_block()
         end_block = self.cur_func.cfg.new_block()
@@ -243,8 +249,9 @@ class Frontend(object):
             false_block = self.cur_func.cfg.new_block()
         else:
             false_block = end_block
-        self.add_stmt(il.CondJumpStmt(true_block, false_block, cond_val, il.ComparisonOp.Neq,
-                                      il.Constant(Frontend.make_int_constant(0), cond_val.type)))
+
+        # handle cond
+        self.on_cond_node(node.cond, true_block, false_block)
 
         # handle iftrue
         self.cur_block = true_block
@@ -259,6 +266,46 @@ class Frontend(object):
 
         self.cur_block = end_block
 
+    def on_cond_node(self, node, true_block, false_block):
+        """
+        Evaluates a condition for control flow: jumps to true_block if it holds, to false_block otherwise.
+        The operands of && and || are only evaluated as far as needed, each one getting its own jump.
+        """
+        if type(node) == c_ast.BinaryOp and node.op in ('&&', '||'):
+            rhs_block = self.cur_func.cfg.new_block()
+            if node.op == '&&':
+                self.on_cond_node(node.left, rhs_block, false_block)
+            else:
+                self.on_cond_node(node.left, true_block, rhs_block)
+            self.cur_block = rhs_block
+            self.on_cond_node(node.right, true_block, false_block)
+        elif type(node) == c_ast.UnaryOp and node.op == '!':
+            self.on_cond_node(node.expr, false_block, true_block)
+        else:
+            cond_val = self.on_expr_node(node)
+            const_zero = il.Constant(Frontend.make_int_constant(0), cond_val.type, coord=node.coord)
+            self.add_stmt(il.CondJumpStmt(true_block, false_block, cond_val, il.ComparisonOp.Neq, const_zero,
+                                          coord=node.coord))
+
+    def on_logical_op_node(self, node):
+        """
+        && and || as values: the condition picks which of two blocks sets the result.
+        """
+        result = self.cur_func.new_temporary(il.Types.int, 0, None, coord=node.coord)
+        true_block = self.cur_func.cfg.new_block()
+        false_block = self.cur_func.cfg.new_block()
+        end_block = self.cur_func.cfg.new_block()
+        self.on_cond_node(node, true_block, false_block)
+
+        for block, value in ((true_block, 1), (false_block, 0)):
+            self.cur_block = block
+            imm = il.Constant(Frontend.make_int_constant(value), il.Types.int, coord=node.coord)
+            self.add_stmt(il.ConstantStmt(result, imm, coord=node.coord))
+            self.add_stmt(il.GotoStmt(end_block, coord=node.coord))
+
+        self.cur_block = end_block
+        return result
+
     def on_return_node(self, node):
         assert type(node) == c_ast.Return
         assert self.cur_func.retval
@@ -269,6 +316,9 @@ class Frontend(object):
         self.cur_block = self.cur_func.cfg.new_block()
 
     def on_binary_op_node(self, node):
+        if node.op in ('&&', '||'):
+            return self.on_logical_op_node(node)
+
         # Transform >= and <= when used with a constant, to the non-equal variants
         if type(node.right) == c_ast.Constant and node.op in ('<=', '>='):
             src_a = self.on_expr_node(node.left)
@@ -295,6 +345,14 @@ class Frontend(object):
             return il.BinaryOp.Sub
         elif op == '*':
             return il.BinaryOp.Mul
+        elif op == '/':
+            return il.BinaryOp.Div
+        elif op == '%':
+            return il.BinaryOp.Rem
+        elif op == '<<':
+            return il.BinaryOp.Shl
+        elif op == '>>':
+            return il.BinaryOp.Shr
         elif op == '==':
             return il.BinaryOp.Equ
         elif op == '!=':
@@ -303,6 +361,10 @@ class Frontend(object):
             return il.BinaryOp.Lt
         elif op == '>':
             return il.BinaryOp.Gt
+        elif op == '<=':
+            return il.BinaryOp.Leq
+        elif op == '>=':
+            return il.BinaryOp.Geq
         elif op == '&&':
             return il.BinaryOp.LogicalAnd
         elif op == '||':
@@ -325,16 +387,17 @@ class Frontend(object):
         if srcA.type == srcB.type:
             srcA_casted = srcA
             srcB_casted = srcB
+        elif il_op in (il.BinaryOp.Shl, il.BinaryOp.Shr) or il.Types.is_less_than(b_type, a_type):
+            # a shift has the type of its left operand
+            srcA_casted = srcA
+            srcB_casted = self.duplicate_var(srcA, coord=coord)
+            cast_stmt = self.on_assign(srcB_casted, srcB, coord=coord)
+            self.add_stmt(cast_stmt)
         elif il.Types.is_less_than(a_type, b_type):
             srcA_casted = self.duplicate_var(srcB, coord=coord)
             cast_stmt = self.on_assign(srcA_casted, srcA, coord=coord)
             self.add_stmt(cast_stmt)
             srcB_casted = srcB
-        elif il.Types.is_less_than(b_type, a_type):
-            srcA_casted = srcA
-            srcB_casted = self.duplicate_var(srcA, coord=coord)
-            cast_stmt = self.on_assign(srcB_casted, srcB, coord=coord)
-            self.add_stmt(cast_stmt)
         else:
             assert False # wtf
 
@@ -401,9 +464,7 @@ class Frontend(object):
 
         # handle cond
         self.cur_block = cond_block
-        cond_var = self.on_expr_node(node.cond)
-        const_zero = il.Constant(Frontend.make_int_constant(0), cond_var.type, coord=node.coord)
-        self.add_stmt(il.CondJumpStmt(stmt_block, end_block, cond_var, il.ComparisonOp.Neq, const_zero, coord=node.coord))
+        self.on_cond_node(node.cond, stmt_block, end_block)
 
         # handle stmt
         self.cur_block = stmt_block
@@ -607,7 +668,8 @@ class Frontend(object):
         return val_var
 
     def on_cast_node(self, node):
-        print node
+        if tracer.active:
+            tracer.debug('%s', node)
         to_type = self.get_node_type(node.to_type.type)
         if to_type == il.Types.ptr:
             ref_level, ref_type = self.extract_pointer_type(node.to_type.type)
@@ -619,18 +681,21 @@ class Frontend(object):
         return dst_var
 
     def on_func_call_node(self, node):
-        num_args = 0
-        if node.args:
-            for arg in node.args:
+        args = list(node.args) if node.args else []
+        arg_vars = None
+        if self.target_arch.CALLING_CONVENTION is il.CallingConvention.Register:
+            arg_vars = [self.on_expr_node(arg) for arg in args]
+        else:
+            # pushed right to left, so the first argument ends up on top
+            for arg in reversed(args):
                 arg_var = self.on_expr_node(arg)
                 self.add_stmt(il.ParamStmt(arg_var, coord=node.coord))
-                num_args += 1
         func_expr = self.on_expr_node(node.name)
         if type(func_expr) == il.Function:
             # also FIXME
             func_expr = self.on_constant(il.Types.ptr, il.CompiledValue(func_expr.name, il.CompiledValueType.Pointer), coord=node.coord)
         dst_var = self.cur_func.new_temporary(il.Types.int, 0, None, coord=node.coord)  # hack lol FIXME
-        self.add_stmt(il.CallStmt(dst_var, func_expr, num_args, coord=node.coord))
+        self.add_stmt(il.CallStmt(dst_var, func_expr, len(args), arg_vars, coord=node.coord))
         return dst_var
 
     # nodes that evaluate. return an ILVariable holding the evaluated value
@@ -665,6 +730,7 @@ class Frontend(object):
 
     def compile(self, ast):
         self.compile_stmts(ast.ext)
+        optimize_program(self._globals, self.target_arch, self.opt_level, self.inline_threshold)
         self._compiled = True
 
     @staticmethod
@@ -1,10 +1,10 @@
 import platform
 import sys
-from gwcc.util.immutableset import ImmutableSet
 
 class BasicBlock(object):
-    def __init__(self, name):
+    def __init__(self, name, id=-1):
         self.name = name
+        self.id = id # index of this block in its ControlFlowGraph
         self.stmts = []
 
     def add_stmt(self, stmt):
@@ -35,88 +35,159 @@ class FlowEdge(object):
     def __hash__(self):
         return hash((self.src, self.dst))
 
+class BlockView(object):
+    """
+    Read-only view over the live blocks of a ControlFlowGraph, in block id order.
+    """
+    def __init__(self, cfg):
+        self._cfg = cfg
+
+    def __iter__(self):
+        for bb in self._cfg._blocks:
+            if bb is not None:
+                yield bb
+
+    def __contains__(self, bb):
+        blocks = self._cfg._blocks
+        return 0 <= bb.id < len(blocks) and blocks[bb.id] is bb
+
+    def __len__(self):
+        return self._cfg._num_live
+
+    def __nonzero__(self):
+        return self._cfg._num_live != 0
+
 class ControlFlowGraph(object):
+    """
+    Blocks are numbered densely in creation order and stored in a list indexed by id, with
+    per-block successor and predecessor lists. Iteration order is always block id order.
+    Postorder and reverse postorder are cached until the next time the graph is mutated.
+    """
     def __init__(self):
-        self.basic_blocks = set()
-        self._edges = {}
-        self._reverse_edges = {}
+        self._blocks = [] # block id -> BasicBlock, or None once removed
+        self._succs = [] # block id -> list of successor blocks
+        self._preds = [] # block id -> list of predecessor blocks
+        self._num_live = 0
+        self.basic_blocks = BlockView(self)
         self.entry = None
 
+        self._postorder = None
+        self._rpo = None
+
+    def _invalidate(self):
+        self._postorder = None
+        self._rpo = None
+
     def new_block(self):
-        bb = BasicBlock('L%d' % (len(self.basic_blocks)))
-        self.basic_blocks.add(bb)
-        self._edges[bb] = set()
-        self._reverse_edges[bb] = set()
+        bb = BasicBlock('L%d' % (len(self._blocks),), len(self._blocks))
+        self._blocks.append(bb)
+        self._succs.append([])
+        self._preds.append([])
+        self._num_live += 1
         if not self.entry:
             self.entry = bb
+        self._invalidate()
         return bb
 
     @property
     def num_blocks(self):
-        return len(self.basic_blocks)
-
-    def remove_block(self, bb):
-        self.basic_blocks.remove(bb)
-        for outgoing_edge in self._edges[bb]:
-            self._reverse_edges[outgoing_edge.dst].remove(outgoing_edge)
-        del self._edges[bb]
-
-        for incoming_edge in self._reverse_edges[bb]:
-            self._edges[incoming_edge.src].remove(incoming_edge)
-        del self._reverse_edges[bb]
+        return self._num_live
 
-    def get_edges(self, bb):
-        return ImmutableSet(self._edges[bb])
+    def block(self, id):
+        return self._blocks[id]
 
-    def get_edges_to(self, bb):
-        return ImmutableSet(self._reverse_edges[bb])
+    def remove_block(self, bb):
+        assert bb in self.basic_blocks
+        for succ in self._succs[bb.id]:
+            self._preds[succ.id].remove(bb)
+        for pred in self._preds[bb.id]:
+            self._succs[pred.id].remove(bb)
+        self._succs[bb.id] = []
+        self._preds[bb.id] = []
+        self._blocks[bb.id] = None
+        self._num_live -= 1
+        self._invalidate()
+
+    def successors(self, bb):
+        """
+        :return: list of successor blocks. Owned by the graph; do not modify.
+        """
+        return self._succs[bb.id]
+
+    def predecessors(self, bb):
+        """
+        :return: list of predecessor blocks. Owned by the graph; do not modify.
+        """
+        return self._preds[bb.id]
+
+    def connect(self, src, dst):
+        succs = self._succs[src.id]
+        if dst not in succs:
+            succs.append(dst)
+            self._preds[dst.id].append(src)
+            self._invalidate()
+
+    def disconnect(self, src, dst):
+        self._succs[src.id].remove(dst)
+        self._preds[dst.id].remove(src)
+        self._invalidate()
 
     def add_edge(self, e):
         assert type(e) == FlowEdge
-        self._edges[e.src].add(e)
-        self._reverse_edges[e.dst].add(e)
+        self.connect(e.src, e.dst)
 
     def remove_edge(self, e):
-        self._edges[e.src].remove(e)
-        self._reverse_edges[e.dst].remove(e)
+        self.disconnect(e.src, e.dst)
 
     def has_edge(self, src, dst):
-        return any(map(lambda e: e.dst == dst, self._edges[src]))
+        return dst in self._succs[src.id]
+
+    def postorder(self):
+        if self._postorder is None:
+            self._postorder = tuple(self._compute_postorder())
+        return self._postorder
+
+    def reverse_postorder(self):
+        if self._rpo is None:
+            self._rpo = tuple(reversed(self.postorder()))
+        return self._rpo
+
+    def _compute_postorder(self):
+        if not self._num_live:
+            return []
+
+        if not self.entry:
+            raise ValueError('cfg has no entry')
+
+        order = []
+        visited = bytearray(len(self._blocks))
+        visited[self.entry.id] = 1
+        stack = [(self.entry, iter(self._succs[self.entry.id]))]
+        while stack:
+            bb, succs = stack[-1]
+            for succ in succs:
+                if not visited[succ.id]:
+                    visited[succ.id] = 1
+                    stack.append((succ, iter(self._succs[succ.id])))
+                    break
+            else:
+                stack.pop()
+                order.append(bb)
+        return order
 
     def pretty_print(self):
         result = ''
-        for bb in topoorder(self):
+        for bb in self.reverse_postorder():
             result += bb.pretty_print()
-            for outgoing_edge in self.get_edges(bb):
-                result += str(outgoing_edge) + '\n'
-            # for incoming_edge in self.get_edges_to(bb):
-            #     result += str(incoming_edge) + '\n'
+            for succ in self._succs[bb.id]:
+                result += '%s -> %s\n' % (bb, succ)
         return result
 
 def postorder(cfg):
-    if not cfg.basic_blocks:
-        return
-
-    if not cfg.entry:
-        raise ValueError('cfg has no entry')
-
-    coloring = {}
-    stack = [cfg.entry]
-    while stack:
-        v = stack[-1]
-        if v not in coloring: # white
-            coloring[v] = 1 # set to gray
-            for e in cfg.get_edges(v):
-                if e.dst not in coloring:
-                    stack.append(e.dst)
-        elif coloring[v] == 1: # gray
-            coloring[v] = 2 # set to black
-            yield v
-        elif coloring[v] == 2: # black
-            stack.pop()
+    return cfg.postorder()
 
 def topoorder(cfg):
-    return list(reversed(list(postorder(cfg))))
+    return cfg.reverse_postorder()
 
 
 def _dot_sanitize(s):
@@ -136,7 +207,7 @@ def dump_graph(cfg, fd=None, name='CFG'):
         print >>fd, "    %s [shape=box, label=\"%s\"]" % (bb.name, label)
 
     for bb in cfg.basic_blocks:
-        for edge in cfg.get_edges(bb):
-            print >>fd, "%s -> %s;" % (edge.src, edge.dst)
+        for succ in cfg.successors(bb):
+            print >>fd, "%s -> %s;" % (bb, succ)
 
     print >>fd, "}\n"
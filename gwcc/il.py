@@ -2,6 +2,8 @@
 A simple 3-address code IL for compiling C code.
 """
 
+from operator import attrgetter
+
 from gwcc.util.enum import Enum
 from cfg import ControlFlowGraph, BasicBlock, topoorder, dump_graph
 
@@ -53,6 +55,12 @@ class Types(Enum):
         return a.value >= b.value
 
 class Variable(object):
+    """
+    Variables compare and hash by identity. Inside a function, get them from Function.variables so
+    that every name maps to one Variable.
+    """
+    __slots__ = ('name', 'type', 'ref_level', 'ref_type', 'coord', 'id')
+
     def __init__(self, name, typ, ref_level=0, ref_type=None, coord=None):
         """
         :param name: variable name
@@ -61,6 +69,7 @@ class Variable(object):
         :param ref_type: pointed type (e.g. int=None, int*=int, int**=int, etc.)
         """
         assert typ.parent == Types
+        self.id = -1  # index in the owning VariableTable, -1 for globals
         self.name = name
         self.type = typ
         # tbh, this is a hack for tracking variables at the generation stage, but w/e
@@ -93,15 +102,62 @@ class Variable(object):
     def __repr__(self):
         return '%s.%s' % (self.user_type, self.name)
 
-    def __eq__(self, other):
-        return type(other) == Variable \
-            and self.name == other.name \
-            and self.type == other.type \
-            and self.ref_level == other.ref_level \
-            and self.ref_type == other.ref_type
 
-    def __hash__(self):
-        return hash(self.name)
+class VariableTable(object):
+    """
+    Interns the variables of one function: each name maps to a single Variable, numbered from 0 in
+    order of creation.
+    """
+    def __init__(self):
+        self._vars = []
+        self._by_name = {}
+        self._num_temporaries = 0
+
+    def add(self, var):
+        """
+        Adopts a variable that was created outside of the table, such as a parameter.
+        """
+        assert type(var) == Variable
+        existing = self._by_name.get(var.name)
+        if existing is not None:
+            if existing is not var:
+                raise ValueError('variable %s is already defined' % (var.name,))
+            return var
+        var.id = len(self._vars)
+        self._vars.append(var)
+        self._by_name[var.name] = var
+        return var
+
+    def intern(self, name, typ, ref_level=0, ref_type=None, coord=None):
+        """
+        Returns the variable called name, creating it if it does not exist yet.
+        """
+        var = self._by_name.get(name)
+        if var is None:
+            return self.add(Variable(name, typ, ref_level, ref_type, coord=coord))
+        if var.type != typ or var.ref_level != ref_level or var.ref_type != ref_type:
+            raise ValueError('variable %s redefined with a different type' % (name,))
+        return var
+
+    def new_temporary(self, typ, ref_level, ref_type, coord=None):
+        name = 't' + str(self._num_temporaries)
+        self._num_temporaries += 1
+        return self.intern(name, typ, ref_level, ref_type, coord=coord)
+
+    def get(self, name):
+        return self._by_name.get(name)
+
+    def __getitem__(self, var_id):
+        return self._vars[var_id]
+
+    def __contains__(self, var):
+        return 0 <= var.id < len(self._vars) and self._vars[var.id] is var
+
+    def __iter__(self):
+        return iter(self._vars)
+
+    def __len__(self):
+        return len(self._vars)
 
 class CompiledValueType(Enum):
     Integer = 'Integer'
@@ -128,6 +184,8 @@ class CompiledValue(object):
         return str(self.value)
 
 class Constant(object):
+    __slots__ = ('value', 'type', 'coord')
+
     def __init__(self, value, typ, coord=None):
         assert type(value) == CompiledValue
         assert typ.parent == Types
@@ -140,6 +198,8 @@ class Constant(object):
 
 
 class BaseStmt(object):
+    __slots__ = ('coord',)
+
     def __init__(self, coord=None):
         self.coord = coord
 
@@ -165,6 +225,8 @@ class BinaryOp(Enum):
     Geq = '>='
 
 class BinaryStmt(BaseStmt):
+    __slots__ = ('dst', 'op', 'srcA', 'srcB')
+
     def __init__(self, dst, op, srcA, srcB, **kwargs):
         super(BinaryStmt, self).__init__(**kwargs)
         assert type(dst) == Variable
@@ -189,6 +251,8 @@ class UnaryOp(Enum):
     Minus = '-'
 
 class UnaryStmt(BaseStmt):
+    __slots__ = ('dst', 'op', 'src')
+
     def __init__(self, dst, op, src, **kwargs):
         super(UnaryStmt, self).__init__(**kwargs)
         assert type(dst) == Variable
@@ -204,6 +268,8 @@ class UnaryStmt(BaseStmt):
         return '%s = %s%s' % (self.dst, self.op, self.src)
 
 class ConstantStmt(BaseStmt):
+    __slots__ = ('dst', 'imm')
+
     def __init__(self, dst, imm, **kwargs):
         super(ConstantStmt, self).__init__(**kwargs)
         assert type(dst) == Variable
@@ -217,6 +283,8 @@ class ConstantStmt(BaseStmt):
         return '%s = %s' % (self.dst, self.imm)
 
 class CastStmt(BaseStmt):
+    __slots__ = ('dst', 'src')
+
     def __init__(self, dst, src, **kwargs):
         super(CastStmt, self).__init__(**kwargs)
         assert type(dst) == Variable
@@ -228,6 +296,8 @@ class CastStmt(BaseStmt):
         return '%s = (%s) %s' % (self.dst, self.dst.type, self.src)
 
 class GotoStmt(BaseStmt):
+    __slots__ = ('dst_block',)
+
     def __init__(self, dst_block, **kwargs):
         super(GotoStmt, self).__init__(**kwargs)
         assert type(dst_block) == BasicBlock
@@ -245,6 +315,8 @@ class ComparisonOp(Enum):
     Geq = '>='
 
 class CondJumpStmt(BaseStmt):
+    __slots__ = ('true_block', 'false_block', 'srcA', 'op', 'imm')
+
     def __init__(self, true_block, false_block, srcA, op, imm, **kwargs):
         super(CondJumpStmt, self).__init__(**kwargs)
         assert type(true_block) == BasicBlock
@@ -264,6 +336,8 @@ class CondJumpStmt(BaseStmt):
         return 'if (%s %s %s) goto %s else goto %s' % (self.srcA, self.op, self.imm, self.true_block, self.false_block)
 
 class ParamStmt(BaseStmt):
+    __slots__ = ('arg',)
+
     def __init__(self, arg, **kwargs):
         super(ParamStmt, self).__init__(**kwargs)
         assert type(arg) == Variable
@@ -272,24 +346,41 @@ class ParamStmt(BaseStmt):
     def __repr__(self):
         return 'param %s' % (self.arg,)
 
+class CallingConvention(Enum):
+    Stack = 'stack'  # arguments go through ParamStmts, which push them
+    Register = 'register'  # arguments are operands of the CallStmt, the backend puts them in place
+
 class CallStmt(BaseStmt):
-    def __init__(self, dst, func_ptr, nargs, **kwargs):
+    __slots__ = ('dst', 'func_ptr', 'nargs', 'args')
+
+    def __init__(self, dst, func_ptr, nargs, args=None, **kwargs):
+        """
+        :param args: the arguments, under the register calling convention
+        """
         super(CallStmt, self).__init__(**kwargs)
         assert type(dst) == Variable
         assert type(func_ptr) == Variable
         assert type(nargs) == int
+        assert args is None or (len(args) == nargs and all(type(arg) == Variable for arg in args))
         self.dst = dst
         self.func_ptr = func_ptr
         self.nargs = nargs
+        self.args = list(args) if args is not None else []
 
     def __repr__(self):
+        if self.args:
+            return '%s = call %s(%s)' % (self.dst, self.func_ptr, ', '.join(map(str, self.args)))
         return '%s = call %s, %d' % (self.dst, self.func_ptr, self.nargs)
 
 class ReturnStmt(BaseStmt):
+    __slots__ = ()
+
     def __repr__(self):
         return 'return'
 
 class RefStmt(BaseStmt): # basically &x operator
+    __slots__ = ('dst', 'var')
+
     def __init__(self, dst, var, **kwargs):
         super(RefStmt, self).__init__(**kwargs)
         assert type(dst) == Variable
@@ -301,6 +392,8 @@ class RefStmt(BaseStmt): # basically &x operator
         return '%s = &%s' % (self.dst, self.var)
 
 class DerefReadStmt(BaseStmt): # basically *x operator
+    __slots__ = ('dst', 'ptr')
+
     def __init__(self, dst, ptr, **kwargs):
         super(DerefReadStmt, self).__init__(**kwargs)
         assert type(dst) == Variable
@@ -320,6 +413,8 @@ class DerefReadStmt(BaseStmt): # basically *x operator
 
 
 class DerefWriteStmt(BaseStmt): # basically *x operator
+    __slots__ = ('ptr', 'src')
+
     def __init__(self, ptr, src, **kwargs):
         super(DerefWriteStmt, self).__init__(**kwargs)
         assert type(ptr) == Variable
@@ -344,6 +439,8 @@ class CommentStmt(BaseStmt):
     """
     For debugging purposes.
     """
+    __slots__ = ('text',)
+
     def __init__(self, text, **kwargs):
         super(CommentStmt, self).__init__(**kwargs)
         self.text = text
@@ -351,83 +448,140 @@ class CommentStmt(BaseStmt):
     def __repr__(self):
         return '// ' + self.text
 
+# how to find the variables a statement reads and writes, keyed by statement class.
+# new statement kinds only need an entry here.
+_no_vars = lambda stmt: []
+_no_var = lambda stmt: None
+_dst = attrgetter('dst')
+
+_used_vars = {
+    BinaryStmt: lambda stmt: [stmt.srcA, stmt.srcB],
+    UnaryStmt: lambda stmt: [stmt.src],
+    ConstantStmt: _no_vars,
+    CastStmt: lambda stmt: [stmt.src],
+    GotoStmt: _no_vars,
+    CondJumpStmt: lambda stmt: [stmt.srcA],
+    ParamStmt: lambda stmt: [stmt.arg],
+    CallStmt: lambda stmt: [stmt.func_ptr] + stmt.args,
+    ReturnStmt: _no_vars,
+    RefStmt: lambda stmt: [stmt.var],
+    DerefReadStmt: lambda stmt: [stmt.ptr],
+    DerefWriteStmt: lambda stmt: [stmt.ptr, stmt.src],
+    CommentStmt: _no_vars,
+}
+
+_defed_var = {
+    BinaryStmt: _dst,
+    UnaryStmt: _dst,
+    ConstantStmt: _dst,
+    CastStmt: _dst,
+    GotoStmt: _no_var,
+    CondJumpStmt: _no_var,
+    ParamStmt: _no_var,
+    CallStmt: _dst,
+    ReturnStmt: _no_var,
+    RefStmt: _dst,
+    DerefReadStmt: _dst,
+    DerefWriteStmt: _no_var,
+    CommentStmt: _no_var,
+}
+
+# the fields holding the variables a statement reads, for passes that rename them. RefStmt isn't
+# here: the variable whose address is taken can't be swapped for another one holding the same value.
+_use_fields = {
+    BinaryStmt: ('srcA', 'srcB'),
+    UnaryStmt: ('src',),
+    CastStmt: ('src',),
+    CondJumpStmt: ('srcA',),
+    ParamStmt: ('arg',),
+    CallStmt: ('func_ptr',),
+    DerefReadStmt: ('ptr',),
+    DerefWriteStmt: ('ptr', 'src'),
+}
+# the same, for fields holding a list of variables
+_use_list_fields = {
+    CallStmt: ('args',),
+}
+
 def used_vars(stmt):
-    typ = type(stmt)
-    if typ == BinaryStmt:
-        return [stmt.srcA, stmt.srcB]
-    elif typ == UnaryStmt:
-        return [stmt.src]
-    elif typ == ConstantStmt:
-        return []
-    elif typ == CastStmt:
-        return [stmt.src]
-    elif typ == GotoStmt:
-        return []
-    elif typ == CondJumpStmt:
-        return [stmt.srcA]
-    elif typ == ParamStmt:
-        return [stmt.arg]
-    elif typ == CallStmt:
-        return [stmt.func_ptr]
-    elif typ == ReturnStmt:
-        return []
-    elif typ == RefStmt:
-        return [stmt.var]
-    elif typ == DerefReadStmt:
-        return [stmt.ptr]
-    elif typ == DerefWriteStmt:
-        return [stmt.ptr, stmt.src]
-    elif typ == CommentStmt:
-        return []
-    else:
+    try:
+        return _used_vars[type(stmt)](stmt)
+    except KeyError:
         raise ValueError('invalid IL statement: ' + str(stmt))
 
 def defed_var(stmt):
-    typ = type(stmt)
-    if typ == BinaryStmt:
-        return stmt.dst
-    elif typ == UnaryStmt:
-        return stmt.dst
-    elif typ == ConstantStmt:
-        return stmt.dst
-    elif typ == CastStmt:
-        return stmt.dst
-    elif typ == GotoStmt:
-        return None
-    elif typ == CondJumpStmt:
-        return None
-    elif typ == ParamStmt:
-        return None
-    elif typ == CallStmt:
-        return stmt.dst
-    elif typ == ReturnStmt:
-        return None
-    elif typ == RefStmt:
-        return stmt.dst
-    elif typ == DerefReadStmt:
-        return stmt.dst
-    elif typ == DerefWriteStmt:
-        return None
-    elif typ == CommentStmt:
+    try:
+        return _defed_var[type(stmt)](stmt)
+    except KeyError:
         return None
 
+def replace_used_vars(stmt, mapping):
+    """
+    Renames the variables stmt reads that are keys of mapping, in place.
+    :return: number of operands renamed
+    """
+    renamed = 0
+    for field in _use_fields.get(type(stmt), ()):
+        var = getattr(stmt, field)
+        if var in mapping:
+            setattr(stmt, field, mapping[var])
+            renamed += 1
+    for field in _use_list_fields.get(type(stmt), ()):
+        variables = getattr(stmt, field)
+        for i, var in enumerate(variables):
+            if var in mapping:
+                variables[i] = mapping[var]
+                renamed += 1
+    return renamed
+
+def copy_stmt(dst, src, coord=None):
+    """
+    :return: a statement copying src into dst, which casts if their types differ
+    """
+    if dst.type != src.type:
+        return CastStmt(dst, src, coord=coord)
+    return UnaryStmt(dst, UnaryOp.Identity, src, coord=coord)
+
+def clone_stmt(stmt, variables, blocks):
+    """
+    Copies stmt, renaming the variables and blocks it refers to that are keys of the maps.
+    """
+    clone = object.__new__(type(stmt))
+    for cls in type(stmt).__mro__:
+        for field in getattr(cls, '__slots__', ()):
+            value = getattr(stmt, field)
+            if type(value) == Variable:
+                value = variables.get(value, value)
+            elif type(value) == BasicBlock:
+                value = blocks.get(value, value)
+            elif type(value) == list:
+                value = [variables.get(var, var) for var in value]
+            setattr(clone, field, value)
+    return clone
+
 class Function(object):
-    def __init__(self, name, params, retval):
+    def __init__(self, name, params, retval, convention=CallingConvention.Stack):
         """
         :param name: name of the function
         :param params: an array of ILVariables representing the function's parameters
         :param retval: an ILVariable that represents the function's return value
+        :param convention: how the function is called, and how it calls others
         """
         assert type(retval) == Variable
+        assert convention.parent == CallingConvention
 
         self.name = name
         self.params = params
         self.retval = retval
-        self.temporaries = {}
+        self.convention = convention
+        self.variables = VariableTable()
         self.locals = []
 
         self.cfg = ControlFlowGraph()
 
+        self.variables.add(retval)
+        for param in params:
+            self.variables.add(param)
         self.locals.extend(params)
 
     @property
@@ -435,10 +589,65 @@ class Function(object):
         return len(self.params)
 
     def new_temporary(self, typ, ref_level, ref_type, coord=None):
-        name = 't' + str(len(self.temporaries))
-        il_var = Variable(name, typ, ref_level, ref_type, coord=coord)
-        self.temporaries[il_var] = il_var
-        return il_var
+        return self.variables.new_temporary(typ, ref_level, ref_type, coord=coord)
+
+    def address_taken(self):
+        """
+        :return: set of the variables, globals included, whose address the function takes
+        """
+        return set(stmt.var for bb in self.cfg.basic_blocks for stmt in bb.stmts if type(stmt) == RefStmt)
+
+    def tracked_variables(self):
+        """
+        :return: the variables of the function whose address is never taken, which nothing but the
+                 statements defining them can change. Passes only follow the values of these.
+        """
+        addressed = self.address_taken()
+        return frozenset(var for var in self.variables if var not in addressed)
+
+    def pointers_to_variables(self):
+        """
+        Any other pointer may hold the address of a memory-mapped device register, where every read
+        counts, so passes may only drop or reuse reads through these.
+        :return: the tracked variables, parameters aside, only ever assigned the address of a variable,
+                 or a copy or cast of another of them
+        """
+        pointers = set(var for var in self.tracked_variables() if var.ref_level > 0 and var not in self.params)
+        defs = [stmt for bb in self.cfg.basic_blocks for stmt in bb.stmts if defed_var(stmt) in pointers]
+        changed = True
+        while changed:
+            changed = False
+            for stmt in defs:
+                dst = defed_var(stmt)
+                if dst not in pointers or type(stmt) == RefStmt:
+                    continue
+                if type(stmt) == CastStmt or type(stmt) == UnaryStmt and stmt.op is UnaryOp.Identity:
+                    if stmt.src in pointers:
+                        continue
+                pointers.discard(dst)
+                changed = True
+        return frozenset(pointers)
+
+    def direct_calls(self):
+        """
+        :return: map from each call that goes straight to a function, through a temporary only ever
+                 assigned the function's address, to the name of the function
+        """
+        defs = {}
+        for bb in self.cfg.basic_blocks:
+            for stmt in bb.stmts:
+                var = defed_var(stmt)
+                if var is not None:
+                    defs[var] = None if var in defs else stmt
+        calls = {}
+        for bb in self.cfg.basic_blocks:
+            for stmt in bb.stmts:
+                if type(stmt) != CallStmt:
+                    continue
+                address = defs.get(stmt.func_ptr)
+                if type(address) == ConstantStmt and address.imm.value.type == CompiledValueType.Pointer:
+                    calls[stmt] = address.imm.value.value
+        return calls
 
     def verify(self):
         # ensure that all jumps reference valid basicblocks
@@ -454,19 +663,19 @@ class Function(object):
             assert type(last_stmt) in control_flow_stmts
             if type(last_stmt) == GotoStmt:
                 assert last_stmt.dst_block in self.cfg.basic_blocks
-                assert len(self.cfg.get_edges(bb)) == 1
-                assert next(iter(self.cfg.get_edges(bb))).dst == last_stmt.dst_block
+                assert len(self.cfg.successors(bb)) == 1
+                assert self.cfg.successors(bb)[0] == last_stmt.dst_block
             elif type(last_stmt) == CondJumpStmt:
                 assert last_stmt.true_block in self.cfg.basic_blocks
                 assert last_stmt.false_block in self.cfg.basic_blocks
                 if last_stmt.true_block != last_stmt.false_block:
-                    assert len(self.cfg.get_edges(bb)) == 2
+                    assert len(self.cfg.successors(bb)) == 2
                 else:
-                    assert len(self.cfg.get_edges(bb)) == 1
-                dsts = map(lambda e: e.dst, self.cfg.get_edges(bb))
+                    assert len(self.cfg.successors(bb)) == 1
+                dsts = self.cfg.successors(bb)
                 assert last_stmt.true_block in dsts and last_stmt.false_block in dsts
             elif type(last_stmt) == ReturnStmt:
-                assert len(self.cfg.get_edges(bb)) == 0
+                assert len(self.cfg.successors(bb)) == 0
 
         # verify def-use chains
         defined_vars = set()
@@ -0,0 +1,94 @@
+"""
+Copy propagation: reads of a variable that was copied from another one read the original instead,
+so that the copy can be left for dead code elimination.
+"""
+
+from collections import Counter
+
+from .. import cfg
+from .. import il
+
+
+class CopyPropagationPass(object):
+    """
+    Available copies, a forward problem: a copy dst = src reaches a statement if every path to it
+    goes through the copy and neither dst nor src is written in between. The state of a block is a
+    map from dst to src, and the meet keeps the pairs that agree.
+
+    Only locals whose address is never taken are considered, since anything else can change behind
+    the function's back through a pointer or a call. Copies between variables of different types
+    (pointers to different types included) are not propagated either.
+    """
+    def __init__(self, func):
+        self.func = func
+        self.cfg = func.cfg
+        self.stats = Counter()
+
+        self.tracked = func.tracked_variables()
+
+        self._in = {}  # bb -> {dst: src} of the copies available on entry
+
+    def copy_of(self, stmt):
+        """
+        :return: (dst, src) if stmt is a copy that may be propagated, otherwise None
+        """
+        if type(stmt) != il.UnaryStmt or stmt.op is not il.UnaryOp.Identity:
+            return None
+        dst, src = stmt.dst, stmt.src
+        if dst is src or dst not in self.tracked or src not in self.tracked:
+            return None
+        if dst.type != src.type or dst.ref_level != src.ref_level or dst.ref_type != src.ref_type:
+            return None
+        return dst, src
+
+    def transfer(self, stmt, copies):
+        dst = il.defed_var(stmt)
+        if dst is None:
+            return
+        for var, src in copies.items():
+            if var is dst or src is dst:
+                del copies[var]
+        copy = self.copy_of(stmt)
+        if copy:
+            dst, src = copy
+            copies[dst] = copies.get(src, src)
+
+    def analyze(self):
+        order = cfg.topoorder(self.cfg)
+        out = {}
+        changed = True
+        while changed:
+            changed = False
+            for bb in order:
+                if bb is self.cfg.entry:
+                    copies = {}
+                else:
+                    # blocks whose out state isn't known yet don't constrain the meet
+                    preds = [out[pred] for pred in self.cfg.predecessors(bb) if pred in out]
+                    copies = dict(preds[0]) if preds else {}
+                    for other in preds[1:]:
+                        for var, src in copies.items():
+                            if other.get(var) is not src:
+                                del copies[var]
+                self._in[bb] = dict(copies)
+                for stmt in bb.stmts:
+                    self.transfer(stmt, copies)
+                if out.get(bb) != copies:
+                    out[bb] = copies
+                    changed = True
+            self.stats['iterations'] += 1
+        return self
+
+    def rewrite(self):
+        for bb, copies in self._in.iteritems():
+            copies = dict(copies)
+            for stmt in bb.stmts:
+                if copies:
+                    self.stats['propagated'] += il.replace_used_vars(stmt, copies)
+                self.transfer(stmt, copies)
+        return self
+
+    def process(self):
+        self.analyze()
+        self.rewrite()
+        return self.stats
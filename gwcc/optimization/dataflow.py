@@ -39,8 +39,8 @@ class LivenessAnalysis(object):
 
             # out[n] = U(s in succ[n])( in [s])
             cur_out = set()
-            for e in self.cfg.get_edges(bb):
-                cur_out.update(self._in[e.dst])
+            for succ in self.cfg.successors(bb):
+                cur_out.update(self._in[succ])
 
             # in[n] = use[n] U(out[n] - def[n])
             cur_in = cur_out.difference(self._def[bb])
@@ -53,9 +53,9 @@ class LivenessAnalysis(object):
 
             # update worklist
             if old_in != cur_in:
-                for e in self.cfg.get_edges_to(bb):
-                    if not e.src in queue:
-                        queue.append(e.src)
+                for pred in self.cfg.predecessors(bb):
+                    if not pred in queue:
+                        queue.append(pred)
         return self
 
     def precompute_block(self, bb):
@@ -76,3 +76,210 @@ class LivenessAnalysis(object):
                 self._use[bb].add(use_var)
             if type(stmt) == il.ReturnStmt:
                 self._use[bb].add(self.func.retval)
+
+
+class BitVectorLiveness(object):
+    """
+    Liveness analyser that works on dense integer bitsets instead of sets of variables.
+
+    Every variable referenced in the function gets a small index, and the use/def/in/out
+    sets of each basicblock are stored as python ints with one bit per variable. The
+    worklist is seeded in postorder (successors before predecessors, which is what a
+    backwards problem wants) and membership is tracked separately so checks are O(1).
+
+    Exposes the same live_in/live_out interface as LivenessAnalysis.
+    """
+    def __init__(self, func):
+        self.func = func
+        self.cfg = func.cfg
+
+        self._index = {} # variable -> bit index
+        self._vars = [] # bit index -> variable
+
+        self._use = {} # bb -> bitset of vars used before being killed
+        self._def = {} # bb -> bitset of vars killed
+
+        self._out = {} # bb -> live-out bitset
+        self._in = {} # bb -> live-in bitset
+
+        self._decoded = {} # (bitset) -> frozenset of variables, so repeated queries are cheap
+
+        self.compute_liveness()
+
+    @property
+    def num_vars(self):
+        return len(self._vars)
+
+    def index_of(self, var):
+        """
+        Returns the bit index assigned to var, allocating a new one if it has not been seen yet.
+        """
+        try:
+            return self._index[var]
+        except KeyError:
+            idx = len(self._vars)
+            self._index[var] = idx
+            self._vars.append(var)
+            return idx
+
+    def var_at(self, idx):
+        return self._vars[idx]
+
+    def live_out_bits(self, bb):
+        return self._out.get(bb, 0)
+
+    def live_in_bits(self, bb):
+        return self._in.get(bb, 0)
+
+    def live_out(self, bb):
+        return self.bits_to_set(self._out.get(bb, 0))
+
+    def live_in(self, bb):
+        return self.bits_to_set(self._in.get(bb, 0))
+
+    def iter_bits(self, bits):
+        while bits:
+            low = bits & -bits
+            yield self._vars[low.bit_length() - 1]
+            bits ^= low
+
+    def bits_to_set(self, bits):
+        try:
+            return self._decoded[bits]
+        except KeyError:
+            pass
+        result = frozenset(self.iter_bits(bits))
+        self._decoded[bits] = result
+        return result
+
+    def set_to_bits(self, variables):
+        bits = 0
+        for var in variables:
+            bits |= 1 << self.index_of(var)
+        return bits
+
+    def compute_liveness(self):
+        order = cfg.postorder(self.cfg)
+        for bb in order:
+            self.precompute_block(bb)
+
+        use, kill = self._use, self._def
+        live_in, live_out = self._in, self._out
+        for bb in order:
+            live_in[bb] = 0
+            live_out[bb] = 0
+
+        queue = deque(order)
+        queued = set(order)
+        while queue:
+            bb = queue.popleft()
+            queued.discard(bb)
+
+            # out[n] = U(s in succ[n])( in [s])
+            cur_out = 0
+            for succ in self.cfg.successors(bb):
+                cur_out |= live_in.get(succ, 0)
+
+            # in[n] = use[n] U(out[n] - def[n])
+            cur_in = use[bb] | (cur_out & ~kill[bb])
+
+            live_out[bb] = cur_out
+            if cur_in != live_in[bb]:
+                live_in[bb] = cur_in
+                for pred in self.cfg.predecessors(bb):
+                    if pred not in queued and pred in live_in:
+                        queued.add(pred)
+                        queue.append(pred)
+        return self
+
+    def precompute_block(self, bb):
+        """
+        Precompute use and kill bitsets for the given basicblock.
+        Same reverse walk as LivenessAnalysis.precompute_block.
+        """
+        use_bits = 0
+        def_bits = 0
+        for stmt in reversed(bb.stmts):
+            def_var = il.defed_var(stmt)
+            if def_var:
+                bit = 1 << self.index_of(def_var)
+                def_bits |= bit
+                use_bits &= ~bit
+
+            for use_var in il.used_vars(stmt):
+                use_bits |= 1 << self.index_of(use_var)
+            if type(stmt) == il.ReturnStmt:
+                use_bits |= 1 << self.index_of(self.func.retval)
+        self._use[bb] = use_bits
+        self._def[bb] = def_bits
+
+
+class LiveSet(object):
+    """
+    Read-only set view over a liveness bitset. Membership tests are a dict lookup and a shift,
+    so callers can treat it like the sets LivenessAnalysis used to hand out.
+    """
+    def __init__(self, liveness, bits):
+        self._liveness = liveness
+        self.bits = bits
+
+    def __contains__(self, var):
+        idx = self._liveness._index.get(var)
+        return idx is not None and (self.bits >> idx) & 1 == 1
+
+    def __iter__(self):
+        return self._liveness.iter_bits(self.bits)
+
+    def __len__(self):
+        return bin(self.bits).count('1')
+
+    def __nonzero__(self):
+        return self.bits != 0
+
+
+class StatementLiveness(object):
+    """
+    Statement-level live-out sets for a whole function, computed once from the block-level
+    results of a BitVectorLiveness.
+
+    Each statement's live-out set is stored as a single bitset, so a long block costs one int
+    per statement instead of one full set of variables per statement.
+    """
+    def __init__(self, func, liveness=None):
+        self.func = func
+        self.cfg = func.cfg
+        self.liveness = liveness or BitVectorLiveness(func)
+
+        self._stmt_out = {} # bb -> list of live-out bitsets, one per statement
+
+        self.compute_liveness()
+
+    def live_out_bits(self, bb, i):
+        return self._stmt_out[bb][i]
+
+    def live_out(self, bb, i):
+        """
+        :return: set view of the variables live after the i-th statement of bb
+        """
+        return LiveSet(self.liveness, self._stmt_out[bb][i])
+
+    def compute_liveness(self):
+        liveness = self.liveness
+        retval_bit = 1 << liveness.index_of(self.func.retval)
+        for bb in self.cfg.basic_blocks:
+            stmts = bb.stmts
+            stmt_out = [0] * len(stmts)
+            cur = liveness.live_out_bits(bb)
+            for i in range(len(stmts) - 1, -1, -1):
+                stmt_out[i] = cur
+                # walk backwards over the statement to get the live-out set of the one before it
+                stmt = stmts[i]
+                def_var = il.defed_var(stmt)
+                if def_var:
+                    cur &= ~(1 << liveness.index_of(def_var))
+                for use_var in il.used_vars(stmt):
+                    cur |= 1 << liveness.index_of(use_var)
+                if type(stmt) == il.ReturnStmt:
+                    cur |= retval_bit
+            self._stmt_out[bb] = stmt_out
+        return self
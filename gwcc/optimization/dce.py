@@ -0,0 +1,71 @@
+"""
+Dead code elimination: drops the statements whose only effect is to define a variable that is never
+read afterwards.
+"""
+
+from collections import Counter
+
+from .. import il
+from .dataflow import BitVectorLiveness
+
+# statements that do nothing but define their destination. Calls, params and stores have effects
+# of their own, and reads through a pointer may hit a memory-mapped device register, unless the
+# pointer can only hold the address of a variable.
+PURE_STMTS = frozenset([il.BinaryStmt, il.UnaryStmt, il.ConstantStmt, il.CastStmt, il.RefStmt])
+
+
+class DeadCodeEliminationPass(object):
+    """
+    Walks each block backwards from its live-out set, dropping pure statements whose destination
+    isn't live, and repeats the liveness analysis until nothing more goes, since a removal can make
+    the operands of the removed statement dead in other blocks too.
+
+    Globals and variables whose address is taken are always considered live, as liveness doesn't
+    see them being read through pointers or by other functions.
+    """
+    def __init__(self, func):
+        self.func = func
+        self.cfg = func.cfg
+        self.stats = Counter()
+
+        self.tracked = func.tracked_variables()
+        self.pointers = func.pointers_to_variables()
+
+    def is_dead(self, stmt, live):
+        if type(stmt) == il.DerefReadStmt:
+            if stmt.ptr not in self.pointers:
+                return False
+        elif type(stmt) not in PURE_STMTS:
+            return False
+        if type(stmt) == il.UnaryStmt and stmt.op is il.UnaryOp.Identity and stmt.src is stmt.dst:
+            return True
+        return stmt.dst in self.tracked and stmt.dst not in live
+
+    def sweep(self, bb, liveness):
+        live = set(liveness.live_out(bb))
+        kept = []
+        for stmt in reversed(bb.stmts):
+            if self.is_dead(stmt, live):
+                continue
+            kept.append(stmt)
+            def_var = il.defed_var(stmt)
+            if def_var:
+                live.discard(def_var)
+            live.update(il.used_vars(stmt))
+            if type(stmt) == il.ReturnStmt:
+                live.add(self.func.retval)
+        removed = len(bb.stmts) - len(kept)
+        if removed:
+            kept.reverse()
+            bb.stmts[:] = kept
+        return removed
+
+    def process(self):
+        while True:
+            self.stats['iterations'] += 1
+            liveness = BitVectorLiveness(self.func)
+            removed = sum(self.sweep(bb, liveness) for bb in self.cfg.basic_blocks)
+            if not removed:
+                break
+            self.stats['removed'] += removed
+        return self.stats
@@ -0,0 +1,263 @@
+"""
+Function inlining: replaces calls to small functions with a copy of their body. That saves the
+argument pushes, the register saves and the trip through the return value slot, and lets the
+other passes work on the callee's code knowing the arguments.
+"""
+
+from collections import Counter
+
+from .. import cfg
+from .. import il
+from .loops import LoopNesting
+
+# IL statements a call takes besides passing the arguments: loading the function's address and the call
+CALL_OVERHEAD = 2
+
+# default threshold from -O2 on
+INLINE_THRESHOLD = 20
+
+
+class InliningPass(object):
+    """
+    Works on the whole program, bottom-up over the call graph, so that a function has had its own
+    calls inlined by the time it gets copied into its callers. Calls between the functions of a
+    cycle in the call graph are left alone, or inlining them would never end.
+
+    A call is inlined if the callee is no bigger than the call, or if the statements it adds, times
+    the number of call sites the callee has in the program, fit into the threshold. A call gets the
+    threshold once more for every loop it is in, since it runs that much more often.
+
+    Under the stack calling convention the arguments are the ParamStmts before the call, which have
+    to be in the same block. They become copies into the callee's parameters, right where they are,
+    so the arguments keep the values they had when they were pushed. A call made while the arguments
+    of another one are on the stack is left alone.
+    """
+    def __init__(self, globs, threshold=INLINE_THRESHOLD):
+        self.functions = [glob.value for glob in globs if type(glob.value) == il.Function]
+        self._by_name = {func.name: func for func in self.functions}
+        self.threshold = threshold
+        self.stats = Counter()
+
+        self._callees = {func: self.find_callees(func) for func in self.functions}
+        self.sites = Counter(callee for calls in self._callees.values() for callee in calls.values())
+        self._component = {}  # function -> the functions in the same strongly connected component
+        self._order = []
+        for component in self.components():
+            for func in component:
+                self._component[func] = component
+                self._order.append(func)
+        self._num_copies = Counter()  # function -> number of bodies copied into it so far
+        self._depths = None  # stack_depths of the function calls are being inlined into
+
+    def find_callees(self, func):
+        """
+        :return: map from each call in func to the function it calls, for the calls that go straight to one
+        """
+        return {call: self._by_name[name] for call, name in func.direct_calls().items() if name in self._by_name}
+
+    def components(self):
+        """
+        Tarjan's algorithm over the call graph.
+        :return: its strongly connected components, the ones called before the ones calling them
+        """
+        index = {}
+        low = {}
+        stack = []
+        on_stack = set()
+        components = []
+
+        def calls(func):
+            callees = self._callees[func]
+            result = []
+            for bb in func.cfg.basic_blocks:
+                for stmt in bb.stmts:
+                    if stmt in callees and callees[stmt] not in result:
+                        result.append(callees[stmt])
+            return result
+
+        def visit(func):
+            index[func] = low[func] = len(index)
+            stack.append(func)
+            on_stack.add(func)
+            for callee in calls(func):
+                if callee not in index:
+                    visit(callee)
+                    low[func] = min(low[func], low[callee])
+                elif callee in on_stack:
+                    low[func] = min(low[func], index[callee])
+            if low[func] == index[func]:
+                component = []
+                while component[-1:] != [func]:
+                    component.append(stack.pop())
+                    on_stack.discard(component[-1])
+                components.append(component)
+
+        for func in self.functions:
+            if func not in index:
+                visit(func)
+        return components
+
+    def order(self):
+        """
+        :return: the functions, each one after the ones it calls, cycles aside
+        """
+        return list(self._order)
+
+    @staticmethod
+    def size(func):
+        return sum(1 for bb in cfg.topoorder(func.cfg) for stmt in bb.stmts if type(stmt) != il.CommentStmt)
+
+    def worth_inlining(self, call, callee, depth):
+        growth = self.size(callee) - (CALL_OVERHEAD + call.nargs)
+        if growth <= 0:
+            return True
+        return growth * self.sites[callee] <= self.threshold * (depth + 1)
+
+    def inline_calls(self, func):
+        """
+        Inlines the calls in func that are worth it.
+        :return: number of calls inlined
+        """
+        callees = self._callees[func]
+        loops = LoopNesting(func)
+        block_of = {}  # chosen call -> its block
+        chosen = []
+        for bb in cfg.topoorder(func.cfg):
+            for stmt in bb.stmts:
+                callee = callees.get(stmt)
+                if callee is None or callee in self._component[func] or callee.num_args != stmt.nargs:
+                    continue
+                if self.worth_inlining(stmt, callee, loops.depth(bb)):
+                    block_of[stmt] = bb
+                    chosen.append(stmt)
+
+        # last to first, so that a call goes before the calls in its arguments, whose blocks stay put
+        self._depths = self.stack_depths(func) if func.convention is il.CallingConvention.Stack else None
+        inlined = 0
+        for call in reversed(chosen):
+            if self.inline_call(func, block_of[call], call, callees[call]) is None:
+                self.stats['skipped'] += 1
+            else:
+                inlined += 1
+        self.stats['inlined'] += inlined
+        return inlined
+
+    @staticmethod
+    def stack_depths(func):
+        """
+        :return: map from block to the number of arguments on the stack on entry to it, pushed for
+                 calls further on
+        """
+        depths = {func.cfg.entry: 0}
+        for bb in cfg.topoorder(func.cfg):
+            depth = depths.get(bb, 0)
+            for stmt in bb.stmts:
+                depth += InliningPass.pushes(stmt)
+            for succ in func.cfg.successors(bb):
+                depths.setdefault(succ, depth)
+        return depths
+
+    @staticmethod
+    def pushes(stmt):
+        if type(stmt) == il.ParamStmt:
+            return 1
+        elif type(stmt) == il.CallStmt:
+            return -stmt.nargs
+        return 0
+
+    @staticmethod
+    def find_params(bb, index, nargs):
+        """
+        :return: the positions in bb of the ParamStmts passing the arguments of the call at index,
+                 the first argument first, or None if they aren't all in bb
+        """
+        positions = []
+        pending = 0  # pushes of the calls in between, which pop them
+        for i in range(index - 1, -1, -1):
+            if len(positions) == nargs:
+                break
+            stmt = bb.stmts[i]
+            if type(stmt) == il.CallStmt:
+                pending += stmt.nargs
+            elif type(stmt) == il.ParamStmt:
+                if pending:
+                    pending -= 1
+                else:
+                    positions.append(i)
+        return positions if len(positions) == nargs else None
+
+    def inline_call(self, func, bb, call, callee):
+        """
+        Splits bb after the call and puts a copy of the callee's blocks in between.
+        :return: the block holding what came after the call, or None if the call couldn't be inlined
+        """
+        index = bb.stmts.index(call)
+        if func.convention is il.CallingConvention.Stack:
+            positions = self.find_params(bb, index, call.nargs)
+            if positions is None:
+                return None
+            # the spill slots of the local allocator would land on arguments pushed for another call
+            depth = self._depths[bb] + sum(self.pushes(stmt) for stmt in bb.stmts[:index])
+            if depth != call.nargs:
+                return None
+        number = self._num_copies[func]
+        self._num_copies[func] += 1
+
+        callee_blocks = cfg.topoorder(callee.cfg)
+        used = set(callee.params) | set([callee.retval])
+        for callee_bb in callee_blocks:
+            for stmt in callee_bb.stmts:
+                used.update(il.used_vars(stmt))
+                used.add(il.defed_var(stmt))
+
+        # named variables keep their name, so that they are told apart from temporaries
+        variables = {}
+        named = set(callee.locals) | set([callee.retval])
+        for var in callee.variables:
+            if var not in used:
+                continue
+            if var in named:
+                copy = func.variables.intern('_inline%d%s' % (number, var.name), var.type, var.ref_level,
+                                             var.ref_type, coord=var.coord)
+                if var is not callee.retval:
+                    func.locals.append(copy)
+            else:
+                copy = func.new_temporary(var.type, var.ref_level, var.ref_type, coord=var.coord)
+            variables[var] = copy
+
+        params = [variables[param] for param in callee.params]
+        if func.convention is il.CallingConvention.Stack:
+            for param, i in zip(params, positions):
+                bb.stmts[i] = il.copy_stmt(param, bb.stmts[i].arg, coord=bb.stmts[i].coord)
+        else:
+            bb.stmts[index:index] = [il.copy_stmt(param, arg, coord=call.coord)
+                                     for param, arg in zip(params, call.args)]
+            index += len(params)
+
+        blocks = {}
+        for callee_bb in callee_blocks:
+            blocks[callee_bb] = func.cfg.new_block()
+        after = func.cfg.new_block()
+        for callee_bb in callee_blocks:
+            copy = blocks[callee_bb]
+            for stmt in callee_bb.stmts:
+                if type(stmt) == il.ReturnStmt:
+                    copy.add_stmt(il.GotoStmt(after, coord=stmt.coord))
+                    func.cfg.connect(copy, after)
+                else:
+                    copy.add_stmt(il.clone_stmt(stmt, variables, blocks))
+            for succ in callee.cfg.successors(callee_bb):
+                func.cfg.connect(copy, blocks[succ])
+        entry = blocks[callee.cfg.entry]
+        entry.stmts.insert(0, il.CommentStmt('inlined ' + callee.name, coord=call.coord))
+
+        after.stmts = bb.stmts[index + 1:]
+        if callee.retval.type != il.Types.void:
+            after.stmts.insert(0, il.copy_stmt(call.dst, variables[callee.retval], coord=call.coord))
+        for succ in list(func.cfg.successors(bb)):
+            func.cfg.disconnect(bb, succ)
+            func.cfg.connect(after, succ)
+        del bb.stmts[index:]
+        bb.add_stmt(il.GotoStmt(entry, coord=call.coord))
+        func.cfg.connect(bb, entry)
+        return after
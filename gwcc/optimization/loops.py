@@ -0,0 +1,88 @@
+"""
+Finds the natural loops of a function, so that costs can be weighted by how deeply nested code is.
+"""
+
+from .. import cfg
+
+
+class LoopNesting(object):
+    """
+    Dominators by the iterative algorithm of Cooper, Harvey and Kennedy, and one natural loop per
+    loop header, made of the bodies of all back edges into it. Unreachable blocks are in no loop.
+    """
+    def __init__(self, func):
+        self.func = func
+        self.cfg = func.cfg
+
+        self._idom = {}  # bb -> immediate dominator. the entry is its own.
+        self._rpo_index = {}
+        self.loops = {}  # header -> set of blocks in the loop, header included
+        self._depth = {}
+
+        self.compute_dominators()
+        self.compute_loops()
+
+    def idom(self, bb):
+        return self._idom[bb]
+
+    def dominates(self, a, b):
+        if b not in self._idom:
+            return False
+        while b is not a:
+            if b is self.cfg.entry:
+                return False
+            b = self._idom[b]
+        return True
+
+    def depth(self, bb):
+        """
+        :return: number of loops bb is in
+        """
+        return self._depth.get(bb, 0)
+
+    def compute_dominators(self):
+        rpo = cfg.topoorder(self.cfg)
+        if not rpo:
+            return self
+        for i, bb in enumerate(rpo):
+            self._rpo_index[bb] = i
+        entry = rpo[0]
+        idom = self._idom
+        idom[entry] = entry
+
+        def intersect(a, b):
+            while a is not b:
+                while self._rpo_index[a] > self._rpo_index[b]:
+                    a = idom[a]
+                while self._rpo_index[b] > self._rpo_index[a]:
+                    b = idom[b]
+            return a
+
+        changed = True
+        while changed:
+            changed = False
+            for bb in rpo[1:]:
+                new_idom = None
+                for pred in self.cfg.predecessors(bb):
+                    if pred in idom:
+                        new_idom = pred if new_idom is None else intersect(pred, new_idom)
+                if idom.get(bb) is not new_idom:
+                    idom[bb] = new_idom
+                    changed = True
+        return self
+
+    def compute_loops(self):
+        for bb in self._rpo_index:
+            for succ in self.cfg.successors(bb):
+                if self.dominates(succ, bb):  # back edge
+                    body = self.loops.setdefault(succ, set([succ]))
+                    stack = [bb]
+                    while stack:
+                        member = stack.pop()
+                        if member not in body:
+                            body.add(member)
+                            stack.extend(pred for pred in self.cfg.predecessors(member) if pred in self._rpo_index)
+        for body in self.loops.values():
+            for bb in body:
+                self._depth[bb] = self._depth.get(bb, 0) + 1
+        return self
@@ -3,29 +3,30 @@ The purpose of the CFG naturalization pass is to apply simple, trivial reduction
 to simplify it before later, heavier passes.
 """
 
-from ..cfg import FlowEdge
+from collections import deque, Counter
+
 from .. import il
 
 class NaturalizationPass(object):
     def __init__(self, func):
         self.func = func
         self.cfg = func.cfg
+        self.stats = Counter() # how many times each transformation fired
 
     # merge two blocks into one.
     def merge(self, bb, succ):
         assert bb.stmts[-1].dst_block == succ
 
         # drop flow statement
-        bb.stmts = bb.stmts[:-1]
+        bb.stmts.pop()
 
         # xfer stmts
-        for stmt in succ.stmts:
-            bb.add_stmt(stmt)
+        bb.stmts.extend(succ.stmts)
 
         cfg = self.cfg
         # copy edges
-        for e in cfg.get_edges(succ):
-            cfg.add_edge(FlowEdge(bb, e.dst))
+        for succ_succ in cfg.successors(succ):
+            cfg.connect(bb, succ_succ)
 
         # drop merged block and its incident edges
         cfg.remove_block(succ)
@@ -34,11 +35,9 @@ class NaturalizationPass(object):
     # this is good for cleaning up blocks that are just a single jump.
     def inline(self, bb_to_inline, bb_inline_as):
         cfg = self.cfg
-        for e in cfg.get_edges_to(bb_to_inline):
-            pred = e.src
-
+        for pred in cfg.predecessors(bb_to_inline):
             # copy edge
-            cfg.add_edge(FlowEdge(pred, bb_inline_as))
+            cfg.connect(pred, bb_inline_as)
 
             # rewrite flow statement
             flow_stmt = pred.stmts[-1]
@@ -58,44 +57,67 @@ class NaturalizationPass(object):
 
     # replace conditional jumps where both branches are the same with just a goto
     def kill_trivial_conditional(self, bb):
-        assert len(self.cfg.get_edges(bb)) == 1
+        assert len(self.cfg.successors(bb)) == 1
         target = bb.stmts[-1].true_block
         bb.stmts[-1] = il.GotoStmt(target)
-        # self.cfg.add_edge(FlowEdge(bb, target))
+        # self.cfg.connect(bb, target)
 
     def process(self):
+        """
+        Clean up the graph using a worklist. Every transformation only changes the
+        neighbourhood of the blocks involved, so only those blocks get revisited.
+        """
         cfg = self.cfg
-        # iteratively clean up the graph and stop when no more modifications are made.
-        while True:
-            for bb in cfg.basic_blocks:
-                # kill empty blocks
-                if not bb.stmts:
-                    if cfg.get_edges(bb):
-                        raise RuntimeError('empty block has outgoing edges')
-                    elif cfg.get_edges_to(bb):
-                        raise RuntimeError('empty block has incoming edges')
+        worklist = deque(cfg.basic_blocks)
+        queued = set(worklist)
+
+        def revisit(bb):
+            if bb not in queued:
+                queued.add(bb)
+                worklist.append(bb)
+
+        while worklist:
+            bb = worklist.popleft()
+            queued.discard(bb)
+            if bb not in cfg.basic_blocks:
+                continue # already merged or inlined away
+            self.stats['visits'] += 1
+
+            # kill empty blocks
+            if not bb.stmts:
+                if cfg.successors(bb):
+                    raise RuntimeError('empty block has outgoing edges')
+                elif cfg.predecessors(bb):
+                    raise RuntimeError('empty block has incoming edges')
+                if bb is not cfg.entry:
                     cfg.remove_block(bb)
-                    break
-
-                # replace conditional jumps where both branches are the same with just a goto
-                if type(bb.stmts[-1]) == il.CondJumpStmt and bb.stmts[-1].true_block == bb.stmts[-1].false_block:
-                    # print 'dropping trivial ' + str(bb)
-                    self.kill_trivial_conditional(bb)
-                    break
-
-                # merge singleton immediate flow siblings
-                if len(cfg.get_edges(bb)) == 1:
-                    succ = next(iter(cfg.get_edges(bb))).dst
-                    if len(cfg.get_edges_to(succ)) == 1 and type(bb.stmts[-1]) == il.GotoStmt:
-                        # print 'merging ' + str(succ) + ' into ' + str(bb)
-                        self.merge(bb, succ)
-                        break
-
-                # blocks that are a single jump may be inlined
-                if len(bb.stmts) == 1 and type(bb.stmts[0]) == il.GotoStmt:
-                    if bb.stmts[0].dst_block != bb:
-                        # print 'inlining ' + str(bb) + ' as ' + str(bb.stmts[0].dst_block)
-                        self.inline(bb, bb.stmts[0].dst_block)
-                        break
-            else:
-                break
+                    self.stats['removed'] += 1
+                continue
+
+            # replace conditional jumps where both branches are the same with just a goto
+            if type(bb.stmts[-1]) == il.CondJumpStmt and bb.stmts[-1].true_block == bb.stmts[-1].false_block:
+                self.kill_trivial_conditional(bb)
+                self.stats['killed_conditionals'] += 1
+                revisit(bb)
+                continue
+
+            # merge singleton immediate flow siblings
+            if len(cfg.successors(bb)) == 1 and type(bb.stmts[-1]) == il.GotoStmt:
+                succ = cfg.successors(bb)[0]
+                if succ is not bb and succ is not cfg.entry and len(cfg.predecessors(succ)) == 1:
+                    self.merge(bb, succ)
+                    self.stats['merged'] += 1
+                    revisit(bb)
+                    continue
+
+            # blocks that are a single jump may be inlined
+            if len(bb.stmts) == 1 and type(bb.stmts[0]) == il.GotoStmt and bb is not cfg.entry:
+                target = bb.stmts[0].dst_block
+                if target != bb:
+                    preds = list(cfg.predecessors(bb))
+                    self.inline(bb, target)
+                    self.stats['inlined'] += 1
+                    for pred in preds:
+                        revisit(pred)
+                    revisit(target)
+        return self.stats
@@ -0,0 +1,55 @@
+"""
+The IL optimizations the frontend runs on every function, and then on the whole program, by
+optimization level.
+"""
+
+from gwcc.util import trace
+from .naturalization_pass import NaturalizationPass
+from .sccp import ConstantPropagationPass
+from .value_numbering import LocalValueNumberingPass
+from .copy_propagation import CopyPropagationPass
+from .dce import DeadCodeEliminationPass
+from .inliner import InliningPass, INLINE_THRESHOLD
+from .tail_calls import TailRecursionPass
+
+tracer = trace.get_tracer('optimization')
+
+
+def optimize_function(func, abi, opt_level):
+    """
+    Runs the passes of opt_level over func, which must already be naturalized.
+    """
+    if opt_level < 1:
+        return
+    stats = TailRecursionPass(func).process()
+    tracer.debug('%s: tail recursion %s', func.name, dict(stats))
+    stats = ConstantPropagationPass(func, abi).process()
+    tracer.debug('%s: sccp %s', func.name, dict(stats))
+    stats = LocalValueNumberingPass(func).process()
+    tracer.debug('%s: value numbering %s', func.name, dict(stats))
+    stats = CopyPropagationPass(func).process()
+    tracer.debug('%s: copy propagation %s', func.name, dict(stats))
+    stats = DeadCodeEliminationPass(func).process()
+    tracer.debug('%s: dce %s', func.name, dict(stats))
+    # folded branches leave gotos and single-predecessor blocks behind
+    NaturalizationPass(func).process()
+    func.verify()
+
+
+def optimize_program(globs, abi, opt_level, inline_threshold=None):
+    """
+    Inlines calls across the functions in globs, each of which has been through optimize_function,
+    and optimizes the functions that got calls inlined again.
+    :param inline_threshold: 0 to not inline, None for the default of opt_level
+    """
+    if inline_threshold is None:
+        inline_threshold = INLINE_THRESHOLD if opt_level >= 2 else 0
+    if inline_threshold <= 0:
+        return
+    inliner = InliningPass(globs, inline_threshold)
+    for func in inliner.order():
+        if inliner.inline_calls(func):
+            NaturalizationPass(func).process()
+            func.verify()
+            optimize_function(func, abi, opt_level)
+    tracer.debug('inlining %s', dict(inliner.stats))
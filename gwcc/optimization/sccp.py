@@ -0,0 +1,246 @@
+"""
+Sparse conditional constant propagation: finds the variables that hold the same constant on every
+path that can actually run, folds the statements computing them, turns conditional jumps on them
+into gotos and drops the blocks that become unreachable.
+"""
+
+from collections import deque, Counter
+
+from .. import il
+
+
+class _Overdefined(object):
+    def __repr__(self):
+        return 'overdefined'
+
+# lattice value of a variable that may hold more than one value
+OVERDEFINED = _Overdefined()
+
+
+def _div(a, b):
+    if b == 0:
+        return None
+    q = abs(a) // abs(b)  # C rounds toward zero
+    return q if (a < 0) == (b < 0) else -q
+
+def _rem(a, b):
+    q = _div(a, b)
+    return None if q is None else a - b * q
+
+_binary_folds = {
+    il.BinaryOp.Add: lambda a, b: a + b,
+    il.BinaryOp.Sub: lambda a, b: a - b,
+    il.BinaryOp.And: lambda a, b: a & b,
+    il.BinaryOp.Or: lambda a, b: a | b,
+    il.BinaryOp.Xor: lambda a, b: a ^ b,
+    il.BinaryOp.Shl: lambda a, b: a << b if 0 <= b < 16 else None,
+    il.BinaryOp.Shr: lambda a, b: a >> b if 0 <= b < 16 else None,
+    il.BinaryOp.LogicalAnd: lambda a, b: int(bool(a and b)),
+    il.BinaryOp.LogicalOr: lambda a, b: int(bool(a or b)),
+    il.BinaryOp.Mul: lambda a, b: a * b,
+    il.BinaryOp.Div: _div,
+    il.BinaryOp.Rem: _rem,
+    il.BinaryOp.Equ: lambda a, b: int(a == b),
+    il.BinaryOp.Neq: lambda a, b: int(a != b),
+    il.BinaryOp.Lt: lambda a, b: int(a < b),
+    il.BinaryOp.Gt: lambda a, b: int(a > b),
+    il.BinaryOp.Leq: lambda a, b: int(a <= b),
+    il.BinaryOp.Geq: lambda a, b: int(a >= b),
+}
+
+# results that one operand decides alone, whatever the other one holds
+_absorbing = {
+    il.BinaryOp.And: lambda a: 0 if a == 0 else None,
+    il.BinaryOp.Mul: lambda a: 0 if a == 0 else None,
+    il.BinaryOp.LogicalAnd: lambda a: 0 if a == 0 else None,
+    il.BinaryOp.LogicalOr: lambda a: 1 if a != 0 else None,
+}
+
+_unary_folds = {
+    il.UnaryOp.Identity: lambda a: a,
+    il.UnaryOp.LogicalNot: lambda a: int(not a),
+    il.UnaryOp.Negate: lambda a: ~a,
+    il.UnaryOp.Minus: lambda a: -a,
+}
+
+_comparisons = {
+    il.ComparisonOp.Equ: lambda a, b: a == b,
+    il.ComparisonOp.Neq: lambda a, b: a != b,
+    il.ComparisonOp.Lt: lambda a, b: a < b,
+    il.ComparisonOp.Gt: lambda a, b: a > b,
+    il.ComparisonOp.Leq: lambda a, b: a <= b,
+    il.ComparisonOp.Geq: lambda a, b: a >= b,
+}
+
+
+class ConstantPropagationPass(object):
+    """
+    The IL isn't in SSA form, so instead of def-use chains this keeps the lattice value of every
+    variable at the entry of every block, Wegman-Zadeck style: a block is only visited once an edge
+    into it is known to be taken, and its entry state is the meet of the states flowing in over
+    taken edges. Everything starts out overdefined at the function entry, so reading an
+    uninitialized variable is never folded.
+
+    Globals and variables whose address is taken are never tracked. Values wrap around to the width
+    of their type in the given ABI, and comparisons follow the signedness of their operands, as the
+    backend does.
+    """
+    def __init__(self, func, abi):
+        self.func = func
+        self.cfg = func.cfg
+        self.abi = abi
+        self.stats = Counter()
+
+        self.tracked = func.tracked_variables()
+
+        self._in = {}  # bb -> {variable: constant or OVERDEFINED}
+        self._taken = set()  # (bb, succ) edges known to be taken
+
+    def normalize(self, value, typ):
+        """
+        :return: value wrapped around to what a variable of type typ holds, or None for types that
+                 aren't folded
+        """
+        bits = self.abi.bitsize(typ)
+        if not bits:
+            return None
+        value &= (1 << bits) - 1
+        if not il.Types.is_unsigned(typ) and value >> (bits - 1):
+            value -= 1 << bits
+        return int(value)
+
+    def value_of(self, var, state):
+        return state[var] if var in self.tracked else OVERDEFINED
+
+    def evaluate(self, stmt, state):
+        """
+        :return: the constant stmt assigns, or OVERDEFINED
+        """
+        typ = type(stmt)
+        result = None
+        if typ == il.ConstantStmt:
+            if stmt.imm.value.type == il.CompiledValueType.Integer:
+                result = stmt.imm.value.value
+        elif typ == il.BinaryStmt:
+            a = self.value_of(stmt.srcA, state)
+            b = self.value_of(stmt.srcB, state)
+            if a is not OVERDEFINED and b is not OVERDEFINED:
+                result = _binary_folds[stmt.op](a, b)
+            elif stmt.op in _absorbing:
+                known = b if a is OVERDEFINED else a
+                if known is not OVERDEFINED:
+                    result = _absorbing[stmt.op](known)
+        elif typ == il.UnaryStmt:
+            a = self.value_of(stmt.src, state)
+            if a is not OVERDEFINED:
+                result = _unary_folds[stmt.op](a)
+        elif typ == il.CastStmt:
+            a = self.value_of(stmt.src, state)
+            if a is not OVERDEFINED and self.abi.sizeof(stmt.src.type) == self.abi.sizeof(stmt.dst.type):
+                result = a
+        if result is None:
+            return OVERDEFINED
+        result = self.normalize(result, stmt.dst.type)
+        return OVERDEFINED if result is None else result
+
+    def transfer(self, stmt, state):
+        dst = il.defed_var(stmt)
+        if dst is not None and dst in self.tracked:
+            state[dst] = self.evaluate(stmt, state)
+
+    def branch_targets(self, stmt, state):
+        """
+        :return: the successors control can go to after stmt, given the state before it
+        """
+        if type(stmt) == il.GotoStmt:
+            return [stmt.dst_block]
+        if type(stmt) == il.CondJumpStmt:
+            outcome = self.branch_outcome(stmt, state)
+            if outcome is None:
+                return [stmt.true_block, stmt.false_block]
+            return [stmt.true_block if outcome else stmt.false_block]
+        return []
+
+    def branch_outcome(self, stmt, state):
+        a = self.value_of(stmt.srcA, state)
+        if a is OVERDEFINED or stmt.imm.value.type != il.CompiledValueType.Integer:
+            return None
+        b = self.normalize(stmt.imm.value.value, stmt.srcA.type)
+        if b is None:
+            return None
+        return _comparisons[stmt.op](a, b)
+
+    def analyze(self):
+        entry = self.cfg.entry
+        self._in[entry] = dict.fromkeys(self.tracked, OVERDEFINED)
+        worklist = deque([entry])
+        queued = set(worklist)
+        while worklist:
+            bb = worklist.popleft()
+            queued.discard(bb)
+            self.stats['visits'] += 1
+
+            state = dict(self._in[bb])
+            for stmt in bb.stmts:
+                self.transfer(stmt, state)
+            if not bb.stmts:
+                continue
+
+            for succ in self.branch_targets(bb.stmts[-1], state):
+                edge = (bb, succ)
+                old = self._in.get(succ)
+                if old is None:
+                    new = dict(state)
+                else:
+                    new = {}
+                    for var, value in old.iteritems():
+                        new[var] = value if value == state[var] else OVERDEFINED
+                if edge not in self._taken or new != old:
+                    self._taken.add(edge)
+                    self._in[succ] = new
+                    if succ not in queued:
+                        queued.add(succ)
+                        worklist.append(succ)
+        return self
+
+    def is_copy(self, stmt, value, state):
+        """
+        A statement that just moves a constant along is cheaper left alone than turned into a load
+        of the constant, and copy propagation can get rid of it.
+        """
+        if type(stmt) == il.CastStmt or (type(stmt) == il.UnaryStmt and stmt.op is il.UnaryOp.Identity):
+            return self.value_of(stmt.src, state) == value
+        return False
+
+    def rewrite(self):
+        cfg = self.cfg
+        for bb in list(cfg.basic_blocks):
+            if bb not in self._in:
+                cfg.remove_block(bb)
+                self.stats['unreachable'] += 1
+
+        for bb in cfg.basic_blocks:
+            state = dict(self._in[bb])
+            for i, stmt in enumerate(bb.stmts):
+                if type(stmt) in (il.BinaryStmt, il.UnaryStmt, il.CastStmt):
+                    value = self.evaluate(stmt, state)
+                    if value is not OVERDEFINED and not self.is_copy(stmt, value, state):
+                        imm = il.Constant(il.CompiledValue(value, il.CompiledValueType.Integer), stmt.dst.type)
+                        bb.stmts[i] = il.ConstantStmt(stmt.dst, imm, coord=stmt.coord)
+                        self.stats['folded'] += 1
+                elif type(stmt) == il.CondJumpStmt:
+                    outcome = self.branch_outcome(stmt, state)
+                    if outcome is not None:
+                        target, other = (stmt.true_block, stmt.false_block) if outcome else \
+                                        (stmt.false_block, stmt.true_block)
+                        if other is not target and other in cfg.basic_blocks:
+                            cfg.disconnect(bb, other)
+                        bb.stmts[i] = il.GotoStmt(target, coord=stmt.coord)
+                        self.stats['branches'] += 1
+                self.transfer(stmt, state)
+        return self
+
+    def process(self):
+        self.analyze()
+        self.rewrite()
+        return self.stats
@@ -0,0 +1,108 @@
+"""
+Tail calls: calls whose result the function returns right away. A function calling itself that way
+can loop back to its start with new parameters instead, and the backend can jump to any other
+callee in place of calling it, so that it returns straight to the caller.
+"""
+
+from collections import Counter
+
+from .. import il
+from .inliner import InliningPass
+
+
+def find_tail_calls(func):
+    """
+    Finds the calls immediately followed by moving their result into the return value and returning.
+    A function that takes the address of one of its variables has none, since the callee might still
+    reach it through the pointer once the frame is gone or reused.
+    :return: map from each call in tail position to its block
+    """
+    if any(var in func.variables for var in func.address_taken()):
+        return {}
+
+    tail_calls = {}
+    for bb in func.cfg.basic_blocks:
+        if len(bb.stmts) < 3 or type(bb.stmts[-1]) != il.ReturnStmt:
+            continue
+        call, copy = bb.stmts[-3], bb.stmts[-2]
+        if type(call) != il.CallStmt or il.defed_var(copy) is not func.retval:
+            continue
+        if func.retval.type == il.Types.void:
+            returned = type(copy) == il.ConstantStmt  # whatever the call returned, nobody reads it
+        elif type(copy) == il.UnaryStmt:
+            returned = copy.op is il.UnaryOp.Identity and copy.src is call.dst
+        else:
+            returned = type(copy) == il.CastStmt and copy.src is call.dst
+        if returned:
+            tail_calls[call] = bb
+    return tail_calls
+
+
+class TailRecursionPass(object):
+    """
+    Turns calls a function makes to itself in tail position into jumps back to its start. The
+    arguments are evaluated into temporaries first, then copied into the parameters, so that
+    arguments reading the parameters see the old values. The start of the function moves to a
+    block of its own, leaving the entry to jump there, so that the entry keeps no predecessors.
+
+    Under the stack calling convention the arguments are the ParamStmts before the call, which
+    have to be in the same block. They become the copies into the temporaries, right where they
+    are.
+    """
+    def __init__(self, func):
+        self.func = func
+        self.cfg = func.cfg
+        self.stats = Counter()
+        self._start = None  # block the calls jump back to, once split off the entry
+
+    def start(self):
+        if self._start is None:
+            entry = self.cfg.entry
+            self._start = self.cfg.new_block()
+            self._start.stmts = entry.stmts
+            for succ in list(self.cfg.successors(entry)):
+                self.cfg.disconnect(entry, succ)
+                self.cfg.connect(self._start, succ)
+            entry.stmts = []
+            entry.add_stmt(il.GotoStmt(self._start))
+            self.cfg.connect(entry, self._start)
+        return self._start
+
+    def loop(self, bb, call):
+        """
+        Replaces the call at the end of bb and the return after it with a jump back to the start.
+        :return: whether it could
+        """
+        func = self.func
+        index = bb.stmts.index(call)
+        if func.convention is il.CallingConvention.Stack:
+            positions = InliningPass.find_params(bb, index, call.nargs)
+            if positions is None:
+                return False
+        temporaries = [func.new_temporary(param.type, param.ref_level, param.ref_type, coord=call.coord)
+                       for param in func.params]
+        copies = []
+        if func.convention is il.CallingConvention.Stack:
+            for temporary, i in zip(temporaries, positions):
+                bb.stmts[i] = il.copy_stmt(temporary, bb.stmts[i].arg, coord=bb.stmts[i].coord)
+        else:
+            copies += [il.copy_stmt(temporary, arg, coord=call.coord)
+                       for temporary, arg in zip(temporaries, call.args)]
+        copies += [il.copy_stmt(param, temporary, coord=call.coord)
+                   for param, temporary in zip(func.params, temporaries)]
+
+        start = self.start()
+        bb.stmts[index:] = copies + [il.GotoStmt(start, coord=call.coord)]
+        self.cfg.connect(bb, start)
+        return True
+
+    def process(self):
+        callees = self.func.direct_calls()
+        for call, bb in sorted(find_tail_calls(self.func).items(), key=lambda item: item[1].id):
+            if callees.get(call) != self.func.name or call.nargs != self.func.num_args:
+                continue
+            if self.loop(bb, call):
+                self.stats['looped'] += 1
+            else:
+                self.stats['skipped'] += 1
+        return self.stats
@@ -0,0 +1,129 @@
+"""
+Local value numbering: within a basic block, a statement computing a value that some variable
+already holds becomes a copy of that variable, for copy propagation and dead code elimination to
+clean up.
+"""
+
+from collections import Counter
+
+from .. import il
+
+_commutative = frozenset([il.BinaryOp.Add, il.BinaryOp.Mul, il.BinaryOp.And, il.BinaryOp.Or, il.BinaryOp.Xor,
+                          il.BinaryOp.LogicalAnd, il.BinaryOp.LogicalOr, il.BinaryOp.Equ, il.BinaryOp.Neq])
+
+
+class LocalValueNumberingPass(object):
+    """
+    Each block is numbered on its own, starting from nothing known. Every variable read gets the
+    number of the value it holds, and every statement that computes something gets a key made of
+    its operation and the numbers of its operands, so that two statements with the same key compute
+    the same value.
+
+    Reads through a pointer are only reused until the next store or call, which may change memory.
+    Those also change globals and locals whose address is taken, so what is known about them is
+    forgotten at that point. Only reads through pointers to variables are reused at all, as any
+    other address may be a memory-mapped device register, which dead code elimination keeps reads
+    of for the same reason. Constants are numbered, so expressions on equal constants match, but
+    not replaced: loading a constant again is about as cheap as a copy and keeps live ranges short.
+    """
+    def __init__(self, func):
+        self.func = func
+        self.cfg = func.cfg
+        self.stats = Counter()
+
+        self.tracked = func.tracked_variables()
+        self.pointers = func.pointers_to_variables()
+
+        self._num_values = 0
+        self._value_of = {}  # variable -> value number it holds
+        self._values = {}  # key -> value number
+        self._holders = {}  # value number -> variables that held it when they were written, latest last
+        self._loads = {}  # key of a read through a pointer -> value number
+
+    def new_value(self):
+        self._num_values += 1
+        return self._num_values
+
+    def value_of(self, var):
+        value = self._value_of.get(var)
+        if value is None:
+            value = self._value_of[var] = self.new_value()
+        return value
+
+    def key(self, stmt):
+        """
+        :return: the key of the value stmt computes, or None if it isn't worth remembering
+        """
+        typ = type(stmt)
+        if typ == il.BinaryStmt:
+            a, b = self.value_of(stmt.srcA), self.value_of(stmt.srcB)
+            if stmt.op in _commutative and b < a:
+                a, b = b, a
+            return stmt.op, a, b
+        elif typ == il.UnaryStmt:
+            return stmt.op, self.value_of(stmt.src)
+        elif typ == il.CastStmt:
+            return 'cast', stmt.dst.type, stmt.dst.ref_level, stmt.dst.ref_type, self.value_of(stmt.src)
+        elif typ == il.ConstantStmt:
+            return 'const', stmt.imm.type, stmt.imm.value.type, repr(stmt.imm.value.value)
+        elif typ == il.RefStmt:
+            return 'ref', stmt.var
+        elif typ == il.DerefReadStmt:
+            if stmt.ptr not in self.pointers:
+                return None
+            return 'load', stmt.dst.type, stmt.dst.ref_level, stmt.dst.ref_type, self.value_of(stmt.ptr)
+        return None
+
+    def holder(self, value, like):
+        """
+        :return: a variable that still holds value and can be copied into like, or None
+        """
+        for var in reversed(self._holders.get(value, ())):
+            if self._value_of.get(var) == value and var is not like and var.type == like.type and \
+                    var.ref_level == like.ref_level and var.ref_type == like.ref_type:
+                return var
+        return None
+
+    def clobber_memory(self):
+        self._loads.clear()
+        for var in self._value_of.keys():
+            if var not in self.tracked:
+                del self._value_of[var]
+
+    def number_block(self, bb):
+        self._value_of.clear()
+        self._values.clear()
+        self._holders.clear()
+        self._loads.clear()
+
+        for i, stmt in enumerate(bb.stmts):
+            typ = type(stmt)
+            dst = il.defed_var(stmt)
+            if typ == il.UnaryStmt and stmt.op is il.UnaryOp.Identity:
+                value = self.value_of(stmt.src)
+            else:
+                key = self.key(stmt)
+                known = self._loads if typ == il.DerefReadStmt else self._values
+                value = known.get(key) if key is not None else None
+                if value is not None and typ != il.ConstantStmt:
+                    src = self.holder(value, dst)
+                    if src is not None:
+                        bb.stmts[i] = il.UnaryStmt(dst, il.UnaryOp.Identity, src, coord=stmt.coord)
+                        self.stats['reused'] += 1
+                if value is None:
+                    value = self.new_value()
+                    if key is not None:
+                        known[key] = value
+
+            if typ in (il.DerefWriteStmt, il.CallStmt):
+                self.clobber_memory()
+            if dst is not None:
+                if dst not in self.tracked:
+                    self.clobber_memory()  # a global or an addressed local may be read through a pointer
+                self._value_of[dst] = value
+                self._holders.setdefault(value, []).append(dst)
+
+    def process(self):
+        for bb in self.cfg.basic_blocks:
+            self.number_block(bb)
+        return self.stats
@@ -0,0 +1,51 @@
+"""
+Opt-in debug artifacts: IL listings, CFG graphs and liveness graphs, one file per function.
+"""
+
+import errno
+import os
+
+
+class DebugArtifacts(object):
+    """
+    Decides which debug dumps are wanted and where they go. Producers check wants(kind) before
+    building anything, so with no kinds enabled nothing is computed or written.
+    """
+    KINDS = ('il', 'cfg', 'liveness')
+    EXTENSIONS = {'il': 'il', 'cfg': 'cfg.dot', 'liveness': 'liveness.dot'}
+
+    def __init__(self, kinds=(), directory='.'):
+        for kind in kinds:
+            if kind not in self.KINDS:
+                raise ValueError('unknown debug artifact ' + kind)
+        self.kinds = frozenset(kinds)
+        self.directory = directory
+
+    def wants(self, kind):
+        return kind in self.kinds
+
+    def path(self, kind, func_name):
+        return os.path.join(self.directory, '%s.%s' % (func_name, self.EXTENSIONS[kind]))
+
+    def open(self, kind, func_name):
+        try:
+            os.makedirs(self.directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        return open(self.path(kind, func_name), 'w')
+
+    def dump_function(self, func):
+        """
+        Writes the IL listing and the CFG graph of an il.Function, if they are wanted.
+        """
+        if self.wants('il'):
+            with self.open('il', func.name) as fd:
+                fd.write(func.pretty_print())
+        if self.wants('cfg'):
+            with self.open('cfg', func.name) as fd:
+                func.dump_graph(fd=fd)
+
+
+# shared instance with everything turned off
+NO_ARTIFACTS = DebugArtifacts()
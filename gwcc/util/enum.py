@@ -1,24 +1,25 @@
 class EnumValue(object):
+	"""
+	A single enum member. EnumMetaclass creates exactly one instance per member and copying
+	hands back the same instance, so members compare and hash by identity and can be used
+	as dict keys.
+
+	A member never equals its raw value: op == 3 is simply False, not an error. Compare
+	against the member itself, or against op.value.
+	"""
 	def __init__(self, parent, name, value):
 		self.parent = parent
 		self.name = name
 		self.value = value
 
-	def __eq__(self, other):
-		if other == None:
-			return False
-
-		is_other_val = isinstance(other, (EnumValue, FlagEnumComposite))
+	def __copy__(self):
+		return self
 
-		if not is_other_val:
-			import traceback
-			traceback.print_stack()
-			print 'Deprecation warning: EnumValue comparison with other types is deprecated'
+	def __deepcopy__(self, memo):
+		return self
 
-		if is_other_val:
-			return self is other or self.value == other.value
-		else:
-			return self.value == other
+	def __reduce__(self):
+		return getattr, (self.parent, self.name)
 
 	def __str__(self):
 		if type(self.value) == str:
@@ -31,6 +32,20 @@ class EnumValue(object):
 		return '<%s.%s val=%r>' % (self.parent.__name__, self.name, self.value)
 
 class EnumFlagValue(EnumValue):
+	# flags can be combined into composites, which are compared by value
+	def __eq__(self, other):
+		if self is other:
+			return True
+		if not isinstance(other, EnumFlagValue):
+			return False
+		return self.parent is other.parent and self.value == other.value
+
+	def __ne__(self, other):
+		return not self.__eq__(other)
+
+	def __hash__(self):
+		return hash((self.parent, self.value))
+
 	def isset(self, other):
 		if other.parent != self.parent:
 			raise KeyError('Unmatched enum flag parents: %r %r' % (self.parent, other.parent,))
@@ -76,6 +91,8 @@ class FlagEnumComposite(EnumFlagValue):
 		for x in args:
 			self.set(x)
 
+	__hash__ = None # mutable
+
 	def asComposite(self):
 		return self
 
@@ -180,7 +197,11 @@ class EnumMetaclass(type):
 			if k.startswith('__') or hasattr(v, '__call__') or hasattr(v, '__func__'):
 				continue
 
-			ev = EnumValue(cls, k, v) if not isflag else EnumFlagValue(cls, k, v)
+			if v in values:
+				# aliases share the interned member
+				ev = values[v]
+			else:
+				ev = EnumValue(cls, k, v) if not isflag else EnumFlagValue(cls, k, v)
 			d[k] = ev
 			setattr(cls, k, ev)
 			values[v] = ev
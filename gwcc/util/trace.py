@@ -0,0 +1,81 @@
+"""
+Leveled tracing for the compiler's internals.
+
+Each subsystem gets a named Tracer. Tracing is off by default; hot call sites test `tracer.active`
+(a plain attribute) before building any message, so a disabled tracer costs one attribute load.
+"""
+
+import json
+import sys
+
+OFF = 0
+INFO = 1
+DEBUG = 2
+
+LEVELS = {'off': OFF, 'info': INFO, 'debug': DEBUG}
+
+
+class Tracer(object):
+    def __init__(self, name):
+        self.name = name
+        self.level = OFF
+        self.stream = sys.stdout
+        self.json_stream = None
+        self.active = False
+
+    def configure(self, level=None, stream=None, json_stream=None):
+        if level is not None:
+            self.level = level
+        if stream is not None:
+            self.stream = stream
+        if json_stream is not None:
+            self.json_stream = json_stream
+        self.active = self.level > OFF or self.json_stream is not None
+
+    def enabled(self, level):
+        return level <= self.level
+
+    def log(self, level, fmt, *args):
+        if level <= self.level:
+            print >> self.stream, fmt % args if args else fmt
+
+    def info(self, fmt, *args):
+        self.log(INFO, fmt, *args)
+
+    def debug(self, fmt, *args):
+        self.log(DEBUG, fmt, *args)
+
+    def event(self, kind, fmt, **fields):
+        """
+        Records a structured event: fmt % fields goes to the text stream at DEBUG level, and the
+        fields (which must be JSON-serializable) go to the JSON lines stream if there is one.
+        """
+        if self.level >= DEBUG:
+            print >> self.stream, fmt % fields
+        if self.json_stream is not None:
+            fields['event'] = kind
+            print >> self.json_stream, json.dumps(fields, sort_keys=True)
+
+
+_tracers = {}
+_default_level = OFF
+_default_stream = None
+
+
+def get_tracer(name):
+    if name not in _tracers:
+        tracer = Tracer(name)
+        tracer.configure(_default_level, _default_stream)
+        _tracers[name] = tracer
+    return _tracers[name]
+
+
+def configure(level, stream=None):
+    """
+    Sets the text level (and optionally the stream) of every tracer, including ones created later.
+    """
+    global _default_level, _default_stream
+    _default_level = level
+    _default_stream = stream
+    for tracer in _tracers.values():
+        tracer.configure(level, stream)
@@ -9,9 +9,26 @@ from pycparser import c_parser, preprocess_file, CParser
 import gwcc
 import platform
 import argparse
+import json
 from os import path
 
 from gwcc.c_frontend import ParseError
+from gwcc.optimization.inliner import INLINE_THRESHOLD
+from gwcc.util import trace
+from gwcc.util.artifacts import DebugArtifacts
+
+# target ABIs by calling convention
+ABIS = {
+    'stack': gwcc.abi.LC3,
+    'register': gwcc.abi.LC3Registers,
+}
+
+# backend options for each optimization level
+OPT_LEVELS = [
+    dict(regalloc='local'),
+    dict(regalloc='linear-scan', peephole=True, layout=True, literal_pools=True, minimal_frames=True, tail_calls=True),
+    dict(regalloc='coloring', peephole=True, layout=True, literal_pools=True, minimal_frames=True, tail_calls=True),
+]
 
 
 def banner():
@@ -49,8 +66,49 @@ if __name__ == '__main__':
     args_parser.add_argument('source_file', default='testcases/1.c', nargs='?')
     args_parser.add_argument('-o', '--output', nargs=1)
     args_parser.add_argument('-g', '--symbols', action='store_true', default=True)
-    args_parser.add_argument('--gen-dot', action='store_true')
+    args_parser.add_argument('--gen-dot', action='store_true', help='same as --dump-il --dump-cfg')
+    args_parser.add_argument('--dump-il', action='store_true', help='write each function\'s IL to FUNC.il')
+    args_parser.add_argument('--dump-cfg', action='store_true', help='write each function\'s CFG to FUNC.cfg.dot')
+    args_parser.add_argument('--dump-liveness', action='store_true',
+                             help='write each function\'s CFG with liveness to FUNC.liveness.dot')
+    args_parser.add_argument('--dump-dir', default='.', help='directory for the --dump-* files')
+    args_parser.add_argument('--trace', choices=sorted(trace.LEVELS), default='off',
+                             help='print compiler internals to stdout')
+    args_parser.add_argument('--trace-alloc', metavar='FILE',
+                             help='write register allocator events to FILE as JSON lines')
+    args_parser.add_argument('-O', dest='opt_level', type=int, choices=range(len(OPT_LEVELS)), default=0,
+                             help='optimization level')
+    args_parser.add_argument('--regalloc', choices=gwcc.backend.LC3.regalloc_modes,
+                             help='register allocator, overriding the one picked by -O: per-block descriptors, '
+                                  'linear scan, or graph coloring')
+    args_parser.add_argument('--block-profile', metavar='FILE',
+                             help='lay blocks out by the block counts in FILE, as written by benchmarks.block_profile '
+                                  'at the same -O')
+    args_parser.add_argument('--abi', choices=sorted(ABIS), default='stack',
+                             help='calling convention: arguments and return value on the stack, or the first '
+                                  'arguments and the return value in registers')
+    args_parser.add_argument('--inline-threshold', type=int, metavar='N',
+                             help='inline a call if the IL statements it adds, times the number of calls to the '
+                                  'function, are at most N per loop it is in plus one; 0 turns inlining off. '
+                                  'The default is %d from -O2 on, 0 below' % (INLINE_THRESHOLD,))
     args = args_parser.parse_args()
+
+    trace.configure(trace.LEVELS[args.trace])
+    if args.trace_alloc:
+        trace.get_tracer('regalloc').configure(json_stream=open(args.trace_alloc, 'w'))
+    dump_kinds = [kind for kind in DebugArtifacts.KINDS if getattr(args, 'dump_' + kind)]
+    if args.gen_dot:
+        dump_kinds.extend(['il', 'cfg'])
+    artifacts = DebugArtifacts(set(dump_kinds), args.dump_dir)
+
+    backend_options = dict(OPT_LEVELS[args.opt_level])
+    if args.regalloc:
+        backend_options['regalloc'] = args.regalloc
+    if args.block_profile:
+        with open(args.block_profile) as f:
+            backend_options['block_frequencies'] = json.load(f)
+        backend_options['layout'] = True
+
     if args.output is None:
         args.output = path.splitext(path.basename(args.source_file))[0] + '.asm'
 
@@ -61,7 +119,7 @@ if __name__ == '__main__':
     else:
         source_code, ast = parse_file_text(args.source_file, use_cpp=True)
 
-    frontend = gwcc.Frontend(gwcc.abi.LC3)
+    frontend = gwcc.Frontend(ABIS[args.abi], opt_level=args.opt_level, inline_threshold=args.inline_threshold)
 
     try:
         frontend.compile(ast)
@@ -69,16 +127,12 @@ if __name__ == '__main__':
         print_error(e)
         exit(1)
 
-    if args.gen_dot:
-        for global_var in frontend._globals:
-            if type(global_var.value) == il.Function:
-                func = global_var.value
-                print func.pretty_print()
-
-                with open('tmp_cfg_func_%s.dot' % func.name, 'w') as f:
-                    func.dump_graph(fd=f)
+    for global_var in frontend.get_globals():
+        if type(global_var.value) == il.Function:
+            artifacts.dump_function(global_var.value)
 
-    backend = gwcc.backend.LC3(frontend.get_globals(), with_symbols=args.symbols)
+    backend = gwcc.backend.LC3(frontend.get_globals(), with_symbols=args.symbols, artifacts=artifacts,
+                               **backend_options)
 
     try:
         backend.compile()
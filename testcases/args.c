@@ -0,0 +1,18 @@
+#pragma extern asm
+
+int DIFF, DIGITS, NESTED;
+
+int sub(int a, int b) {
+    return a - b;
+}
+
+int digits(int a, int b, int c) {
+    return a * 100 + b * 10 + c;
+}
+
+int main() {
+    DIFF = sub(10, 3);
+    DIGITS = digits(1, 2, 3);
+    NESTED = digits(sub(9, 5), 7, sub(2, 8));
+    return sub(DIGITS, DIFF);
+}
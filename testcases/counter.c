@@ -0,0 +1,35 @@
+#pragma extern asm
+
+int count;
+int hash;
+
+void bump() {
+    int i = 0;
+    count = count + 1;
+    while (i < 3) {
+        hash = hash * 5 + count;
+        if (hash > 1000) hash = hash - 997;
+        if (hash < 0) hash = -hash;
+        i++;
+    }
+}
+
+int next() {
+    bump();
+    return count * 2 + hash;
+}
+
+int main() {
+    int i = 0;
+    int total = 0;
+    count = 0;
+    hash = 1;
+    while (i < 5) {
+        bump();
+        total = total + next();
+        if (total > 2000) bump();
+        i++;
+    }
+    bump();
+    return total + next();
+}
@@ -0,0 +1,19 @@
+#pragma extern asm
+
+int gcd(int a, int b) {
+    if (b == 0) return a;
+    return gcd(b, a % b);
+}
+
+int sum(int n, int acc) {
+    if (n == 0) return acc;
+    return sum(n-1, acc+n);
+}
+
+int lcm(int a, int b) {
+    return a / gcd(a, b) * b;
+}
+
+int main() {
+    return gcd(1071, 462) + sum(100, 0) + lcm(21, 6);
+}
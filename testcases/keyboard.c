@@ -0,0 +1,13 @@
+#pragma extern asm
+
+int* KBSR = 0xFE00;
+int FIRST, SECOND;
+
+int main() {
+    int a = *KBSR;
+    int b = *KBSR;
+    int c = *KBSR;
+    FIRST = a;
+    SECOND = b;
+    return a + b;
+}